@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+import beancount.parser.parser
+
+from moneyctl.journal import Journal, JournalWriter
+
+
+### Constants =================================================================
+
+JOURNAL_EXAMPLE_DIR = ROOT_DIR / 'misc' / 'journal_example'
+ACCOUNT_FROM = 'Assets:Карты:Sberbank-0001'
+ACCOUNT_TO = 'Expenses:Питание'
+DAYS = 5
+
+
+### Functions =================================================================
+
+def run_writer(journal_dir, writer_id, transactions_count, batch, fsync):
+    # Процесс-писатель: свои комментарии, общие файлы дат с остальными писателями
+    os.chdir(journal_dir)
+    Journal._instance = None
+    journal = Journal()
+    journal.writer.set(fsync=fsync)
+
+    for start in range(0, transactions_count, batch):
+        transactions = []
+        for i in range(start, min(start + batch, transactions_count)):
+            transaction = journal.new_transaction()
+            transaction.set(date=datetime.date(2022, 6, 1 + i % DAYS),
+                            comment=f'writer-{writer_id}-{i}',
+                            account_from=ACCOUNT_FROM, account_to=ACCOUNT_TO,
+                            amount_from=i + 1, amount_to=i + 1)
+            transaction.close()
+            transactions.append(transaction)
+        journal.commit_transactions(transactions)
+
+
+def verify(journal_dir, writers, transactions_count):
+    # Каждая транзакция ровно один раз и целиком: файл разбирается без ошибок
+    narrations = []
+    errors = []
+    for path_object in sorted((Path(journal_dir) / 'transactions').rglob('*.bean')):
+        entries, parse_errors, _ = beancount.parser.parser.parse_file(str(path_object))
+        errors.extend(parse_errors)
+        for entry in entries:
+            if entry.narration.startswith('writer-'):
+                narrations.append(entry.narration)
+                _, _, number = entry.narration.rpartition('-')
+                if entry.postings[1].units.number != int(number) + 1:
+                    errors.append(f'Transaction "{entry.narration}" has foreign amount')
+
+    expected = {f'writer-{writer_id}-{i}' for writer_id in range(writers) for i in range(transactions_count)}
+    return {
+        'transactions': len(narrations),
+        'lost': len(expected - set(narrations)),
+        'duplicated': len(narrations) - len(set(narrations)),
+        'errors': len(errors),
+    }
+
+
+def run_stress(journal_dir, writers, transactions_count, batch, fsync):
+    context = multiprocessing.get_context('fork')
+    processes = [
+        context.Process(target=run_writer, args=(journal_dir, writer_id, transactions_count, batch, fsync))
+        for writer_id in range(writers)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    seconds = time.perf_counter() - started
+
+    result = verify(journal_dir, writers, transactions_count)
+    result['failed_writers'] = sum(1 for process in processes if process.exitcode != 0)
+    result['seconds'] = round(seconds, 3)
+    result['transactions_per_second'] = round(writers * transactions_count / seconds, 1)
+    return result
+
+
+def is_valid(result):
+    return result['lost'] == result['duplicated'] == result['errors'] == result['failed_writers'] == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent journal writers stress test')
+    parser.add_argument('--writers', type=int, default=16, help='Concurrent writer processes')
+    parser.add_argument('--transactions', type=int, default=200, help='Transactions per writer')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 20], help='Transactions per commit')
+    parser.add_argument('--fsync', nargs='+', choices=JournalWriter.FSYNC_POLICIES, default=JournalWriter.FSYNC_POLICIES, help='Fsync policies to measure')
+    args = parser.parse_args()
+
+    results = {}
+    for fsync in args.fsync:
+        for batch in args.batch:
+            with tempfile.TemporaryDirectory(prefix='moneyctl-commit-') as tmp_dir:
+                journal_dir = Path(tmp_dir) / 'journal'
+                shutil.copytree(JOURNAL_EXAMPLE_DIR, journal_dir, ignore=shutil.ignore_patterns('.moneyctl'))
+                results[f'{fsync}-batch-{batch}'] = run_stress(journal_dir, args.writers, args.transactions, batch, fsync)
+
+    print(json.dumps(results, indent=2))
+
+    invalid = [name for name, result in results.items() if not is_valid(result)]
+    if invalid:
+        print(f'Lost, duplicated or broken transactions: {", ".join(invalid)}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+from decimal import Decimal
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+import pandas as pd
+
+from moneyctl.report import Report
+
+
+### Constants =================================================================
+
+FORMATS = [Report.FORMAT_CSV, Report.FORMAT_JSON, Report.FORMAT_NDJSON]
+JSON_TO_CSV_MAX_RATIO = 2.0
+
+
+### Functions =================================================================
+
+def gen_report(rows_count, seed=0):
+    random.seed(seed)
+    accounts = [f'Расходы:Категория-{i % 500}:Счет-{i}' for i in range(rows_count)]
+    positions = [Decimal(random.randint(-10 ** 8, 10 ** 8)).scaleb(-2) for _ in range(rows_count)]
+    parts = [Decimal(random.randint(0, 10 ** 6)).scaleb(-4) for _ in range(rows_count)]
+    dataframe = pd.DataFrame({'account': accounts, 'position': positions, 'part': parts})
+    total = dataframe.sum()
+    total[total.index[0]] = 'total'
+    return Report(dataframe, total)
+
+
+def run_format(report, format, repeat):
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        output = io.StringIO()
+        report.set(format=format, file=output)
+        started = time.perf_counter()
+        report.print()
+        timings.append((time.perf_counter() - started) * 1000)
+        size = len(output.getvalue())
+
+    return {
+        'median_ms': round(statistics.median(timings), 2),
+        'min_ms': round(min(timings), 2),
+        'max_ms': round(max(timings), 2),
+        'output_chars': size,
+        'repeat': repeat,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure report serialisation time per output format')
+    parser.add_argument('--rows', type=int, default=100_000, help='Rows in generated report')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per format')
+    parser.add_argument('--max-ratio', type=float, default=JSON_TO_CSV_MAX_RATIO, help='Allowed json/ndjson time relative to csv')
+    args = parser.parse_args()
+
+    report = gen_report(args.rows)
+    results = {format: run_format(report, format, args.repeat) for format in FORMATS}
+    for format in FORMATS:
+        results[format]['csv_ratio'] = round(results[format]['median_ms'] / results[Report.FORMAT_CSV]['median_ms'], 2)
+
+    print(json.dumps(results, indent=2))
+
+    slow = [format for format in FORMATS if results[format]['csv_ratio'] > args.max_ratio]
+    if slow:
+        print(f'Serialisation slower than {args.max_ratio}x csv: {", ".join(slow)}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+
+### Constants =================================================================
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+JOURNAL_EXAMPLE_DIR = ROOT_DIR / 'misc' / 'journal_example'
+COMPLETION_THRESHOLD_MS = 100
+
+SCENARIOS = {
+    'complete-accounts': (
+        [], {
+            '_MONEYCTL_COMPLETE': 'fish_complete',
+            'COMP_WORDS': 'moneyctl transaction add -f Assets',
+            'COMP_CWORD': 'Assets',
+        }),
+    'complete-commands': (
+        [], {
+            '_MONEYCTL_COMPLETE': 'fish_complete',
+            'COMP_WORDS': 'moneyctl report ',
+            'COMP_CWORD': '',
+        }),
+    'help': (['--help'], {}),
+    'report-help': (['report', '--help'], {}),
+}
+
+
+### Functions =================================================================
+
+def run_scenario(journal_dir, args, env, repeat, command=None):
+    full_env = dict(os.environ)
+    full_env.update(env)
+    full_env['PYTHONPATH'] = str(ROOT_DIR)
+    if command is None:
+        command = [sys.executable, '-m', 'moneyctl', *args]
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=journal_dir, env=full_env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return {
+        'median_ms': round(statistics.median(timings), 2),
+        'min_ms': round(min(timings), 2),
+        'max_ms': round(max(timings), 2),
+        'repeat': repeat,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure moneyctl startup time')
+    parser.add_argument('--journal', type=Path, default=JOURNAL_EXAMPLE_DIR, help='Journal directory')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per scenario')
+    parser.add_argument('--threshold', type=float, default=COMPLETION_THRESHOLD_MS, help='Completion budget above interpreter startup, ms')
+    args = parser.parse_args()
+
+    # Время запуска голого интерпретатора не зависит от moneyctl,
+    # поэтому бюджет проверяется по накладным расходам сверх него
+    baseline = run_scenario(args.journal, [], {}, args.repeat,
+                            command=[sys.executable, '-c', 'pass'])
+    results = {'interpreter': baseline}
+    for name, (command_args, env) in SCENARIOS.items():
+        result = run_scenario(args.journal, command_args, env, args.repeat)
+        result['overhead_ms'] = round(result['median_ms'] - baseline['median_ms'], 2)
+        results[name] = result
+
+    print(json.dumps(results, indent=2))
+
+    slow = [
+        name for name in results
+        if name.startswith('complete-') and results[name]['overhead_ms'] >= args.threshold
+    ]
+    if slow:
+        print(f'Completion overhead exceeds {args.threshold} ms: {", ".join(slow)}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import json
+import time
+import datetime
+import argparse
+import tempfile
+import platform
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from gen_journal import SIZES, JournalGenerator
+
+
+### Constants =================================================================
+
+RESULTS_DIR = ROOT_DIR / 'benchmarks' / 'results'
+
+ENGINES = ['native', 'bql']
+REPORTS = ['assets', 'expenses', 'income', 'invest-cash', 'invest-parts', 'dashboard']
+# Report.FORMATS без импорта moneyctl.report
+FORMATS = ['table', 'md-table', 'json', 'csv', 'ndjson']
+
+COMPLETE_ENV = {
+    '_MONEYCTL_COMPLETE': 'fish_complete',
+    'COMP_WORDS': 'moneyctl transaction add -f Assets',
+    'COMP_CWORD': 'Assets',
+}
+
+
+### Child Scenarios ===========================================================
+# Выполняются в отдельном процессе: пиковая память считается по процессу целиком,
+# а время самой операции (без запуска интерпретатора) child печатает в stdout
+
+def _load_wrapper(engine):
+    from moneyctl.journal import Journal
+    from moneyctl.beancount_wrapper import BeancountWrapper
+    return BeancountWrapper(journal=Journal(), engine=engine)
+
+
+def _get_range(wrapper):
+    dates = [entry.date for entry in wrapper.entries]
+    return min(dates), max(dates)
+
+
+def child_load(cache):
+    from moneyctl.journal import Journal
+    from moneyctl.loader import LedgerLoader
+
+    started = time.perf_counter()
+    entries, _, _ = LedgerLoader(Journal(), cache=cache).load(quiet=True)
+    return time.perf_counter() - started, len(entries)
+
+
+def child_report(name, engine):
+    wrapper = _load_wrapper(engine)
+    from_, to = _get_range(wrapper)
+
+    started = time.perf_counter()
+    if name == 'assets':
+        report = wrapper.assets_report()
+    elif name == 'expenses':
+        report = wrapper.expenses_report(from_, to)
+    elif name == 'income':
+        report = wrapper.income_report(from_, to)
+    elif name == 'invest-cash':
+        report = wrapper.invest_cash_report()
+    elif name == 'invest-parts':
+        report = wrapper.invest_parts_report()
+    elif name == 'dashboard':
+        report = wrapper.dashboard_reports(from_, to)
+    elif name == 'register':
+        report = list(wrapper.register_rows('^Expenses:'))
+    else:
+        raise ValueError(f'Unknown report "{name}"')
+    return time.perf_counter() - started, len(report) if isinstance(report, (list, dict)) else len(report.report_dataframe)
+
+
+def child_render(format, stream):
+    wrapper = _load_wrapper(ENGINES[0])
+    from_, to = _get_range(wrapper)
+    if stream:
+        # Проводки за последний год: table и md-table собирают их в памяти целиком
+        report = wrapper.register_report('^Expenses:', from_=to - datetime.timedelta(days=365))
+    else:
+        report = wrapper.expenses_report(from_, to, by='month')
+    output = io.StringIO()
+    report.set(format=format, file=output)
+
+    started = time.perf_counter()
+    report.print()
+    return time.perf_counter() - started, len(output.getvalue())
+
+
+def child_transaction_add():
+    from moneyctl.journal import Journal
+
+    journal = Journal()
+    account_from = journal.complete_accounts_names('Assets:')[0]
+    account_to = journal.complete_accounts_names('Expenses:')[0]
+
+    started = time.perf_counter()
+    transaction = journal.new_transaction()
+    transaction.set(date=datetime.datetime.now(), comment='Benchmark',
+                    account_from=account_from, account_to=account_to,
+                    amount_from=100, amount_to=100)
+    transaction.close()
+    journal.commit()
+    return time.perf_counter() - started, 1
+
+
+def run_child(scenario):
+    kind, _, argument = scenario.partition(':')
+    if kind == 'load-cold':
+        op_seconds, rows = child_load(cache=False)
+    elif kind == 'load-cached':
+        op_seconds, rows = child_load(cache=True)
+    elif kind == 'report':
+        name, _, engine = argument.partition(':')
+        op_seconds, rows = child_report(name, engine)
+    elif kind == 'render':
+        op_seconds, rows = child_render(argument, stream=False)
+    elif kind == 'render-stream':
+        op_seconds, rows = child_render(argument, stream=True)
+    elif kind == 'transaction-add':
+        op_seconds, rows = child_transaction_add()
+    else:
+        raise SystemExit(f'Unknown scenario "{scenario}"')
+    print(json.dumps({'op_ms': round(op_seconds * 1000, 2), 'rows': rows}))
+
+
+### Parent Functions ==========================================================
+
+def gen_scenarios(engines, writes):
+    # {name: (command args, env, is moneyctl CLI)}
+    scenarios = {
+        'load-cold': (['load-cold'], {}, False),
+        'load-cached': (['load-cached'], {}, False),
+    }
+    for report in REPORTS:
+        for engine in engines:
+            scenarios[f'report-{report}[{engine}]'] = ([f'report:{report}:{engine}'], {}, False)
+    # Журнал операций не зависит от движка отчетов
+    scenarios['report-register'] = ([f'report:register:{ENGINES[0]}'], {}, False)
+    for format in FORMATS:
+        scenarios[f'render-{format}'] = ([f'render:{format}'], {}, False)
+        scenarios[f'render-stream-{format}'] = ([f'render-stream:{format}'], {}, False)
+    scenarios['complete-accounts'] = ([], COMPLETE_ENV, True)
+    if writes:
+        scenarios['transaction-add'] = (['transaction-add'], {}, False)
+    return scenarios
+
+
+def get_maxrss_kb(rusage):
+    # На macOS ru_maxrss в байтах, на Linux -- в килобайтах
+    return rusage.ru_maxrss // 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+
+
+def run_process(command, journal_dir, env):
+    full_env = dict(os.environ)
+    full_env.update(env)
+    full_env['PYTHONPATH'] = str(ROOT_DIR)
+    full_env['MONEYCTL_DAEMON'] = '0'
+
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=journal_dir, env=full_env,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    stdout = process.stdout.read()
+    # wait4 возвращает ресурсы именно этого процесса, а не всех детей сразу
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall_ms = (time.perf_counter() - started) * 1000
+    if process.returncode != 0:
+        raise RuntimeError(f'Command {command} failed with code {process.returncode}')
+    return wall_ms, get_maxrss_kb(rusage), stdout
+
+
+def run_scenario(journal_dir, args, env, is_cli, repeat):
+    if is_cli:
+        command = [sys.executable, '-m', 'moneyctl', *args]
+    else:
+        command = [sys.executable, str(Path(__file__).resolve()), '--child', *args]
+
+    walls, ops, rsss = [], [], []
+    rows = None
+    for _ in range(repeat):
+        wall_ms, rss_kb, stdout = run_process(command, journal_dir, env)
+        walls.append(wall_ms)
+        rsss.append(rss_kb)
+        if not is_cli:
+            child_result = json.loads(stdout)
+            ops.append(child_result['op_ms'])
+            rows = child_result['rows']
+
+    result = {
+        'wall_ms': round(statistics.median(walls), 2),
+        'wall_min_ms': round(min(walls), 2),
+        'peak_rss_kb': max(rsss),
+        'repeat': repeat,
+    }
+    if ops:
+        result['op_ms'] = round(statistics.median(ops), 2)
+        result['rows'] = rows
+    return result
+
+
+def describe_journal(journal_dir):
+    files = [path_object for path_object in Path(journal_dir).rglob('*.bean') if '.moneyctl' not in path_object.parts]
+    return {
+        'path': str(journal_dir),
+        'files': len(files),
+        'bytes': sum(path_object.stat().st_size for path_object in files),
+    }
+
+
+def describe_environment():
+    def git(*args):
+        try:
+            return subprocess.run(['git', *args], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
+
+
+def compare_results(results, base_results):
+    # Отношение к базовому прогону: > 1 -- медленнее или больше памяти
+    comparison = {}
+    for name, result in results['scenarios'].items():
+        base = base_results['scenarios'].get(name)
+        if base is None:
+            continue
+        comparison[name] = {
+            key: round(result[key] / base[key], 2)
+            for key in ('wall_ms', 'op_ms', 'peak_rss_kb')
+            if base.get(key) and key in result
+        }
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure wall time and peak memory of moneyctl operations')
+    parser.add_argument('--child', metavar='SCENARIO', help=argparse.SUPPRESS)
+    parser.add_argument('--journal', type=Path, help='Existing journal directory (generated if not set)')
+    parser.add_argument('--size', choices=SIZES, default='small', help='Generated journal size')
+    parser.add_argument('--seed', type=int, default=0, help='Generated journal random seed')
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES, help='Report engines to measure')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per scenario')
+    parser.add_argument('--only', help='Run scenarios with names containing substring')
+    parser.add_argument('--writes', action='store_true', help='Measure transaction add on existing journal (modifies it)')
+    parser.add_argument('--output', type=Path, help='Results file (benchmarks/results/<date>-<commit>.json if not set)')
+    parser.add_argument('--compare', type=Path, help='Previous results file to compare with')
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    with tempfile.TemporaryDirectory(prefix='moneyctl-bench-') as tmp_dir:
+        generator_stats = None
+        journal_dir = args.journal
+        if journal_dir is None:
+            journal_dir = Path(tmp_dir)
+            print(f'Generating {args.size} journal in {journal_dir}', file=sys.stderr)
+            generator = JournalGenerator(journal_dir, seed=args.seed, **SIZES[args.size])
+            generator_stats = generator.generate()
+
+        # Запись в журнал пользователя -- только по явному флагу
+        writes = args.journal is None or args.writes
+        scenarios = gen_scenarios(args.engines, writes)
+        if args.only:
+            scenarios = {name: scenario for name, scenario in scenarios.items() if args.only in name}
+
+        results = {
+            'environment': describe_environment(),
+            'journal': describe_journal(journal_dir),
+            'scenarios': {},
+        }
+        if generator_stats is not None:
+            results['journal'].update(size=args.size, seed=args.seed, **generator_stats)
+
+        # Прогрев: кеш разобранного журнала нужен всем сценариям, кроме load-cold
+        run_process([sys.executable, str(Path(__file__).resolve()), '--child', 'load-cached'], journal_dir, {})
+
+        for name, (command_args, env, is_cli) in scenarios.items():
+            print(f'Running {name}', file=sys.stderr)
+            results['scenarios'][name] = run_scenario(journal_dir, command_args, env, is_cli, args.repeat)
+
+    output = args.output
+    if output is None:
+        commit = (results['environment']['commit'] or 'unknown')[:10]
+        output = RESULTS_DIR / f'{datetime.datetime.now():%Y%m%d-%H%M%S}-{commit}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as file_object:
+        json.dump(results, file_object, indent=2)
+        file_object.write('\n')
+
+    if args.compare:
+        with open(args.compare, 'r') as file_object:
+            results['comparison'] = compare_results(results, json.load(file_object))
+
+    print(json.dumps(results, indent=2))
+    print(f'Results written to {output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+import json
+import random
+import argparse
+import datetime
+from decimal import Decimal
+from pathlib import Path
+
+
+### Constants =================================================================
+
+SIZES = {
+    'small': {'years': 2, 'accounts': 40, 'postings': 5_000, 'tickers': 5},
+    'medium': {'years': 5, 'accounts': 200, 'postings': 200_000, 'tickers': 20},
+    'large': {'years': 10, 'accounts': 500, 'postings': 1_000_000, 'tickers': 50},
+}
+
+CURRENCY = 'RUB'
+FOREIGN_CURRENCIES = {'USD': Decimal('75'), 'EUR': Decimal('85')}
+
+EXPENSES_CATEGORIES = ['Питание', 'Транспорт', 'Одежда', 'Медицина', 'Развлечения', 'Семья', 'Дом', 'Связь']
+INCOME_CATEGORIES = ['Работа', 'Кэшбек', 'Проценты', 'Подработка']
+
+TEMPLATE_TEXT = '''---
+comment: "{comment}"
+account_from: "{account_from}"
+account_to: "{account_to}"
+'''
+
+
+### Classes ===================================================================
+
+class JournalGenerator:
+
+    def __init__(self, root_dir, years, accounts, postings, tickers, seed=0, end_year=None):
+        self.root_dir = Path(root_dir)
+        self.years = years
+        self.accounts_count = accounts
+        self.postings_count = postings
+        self.tickers_count = tickers
+        self.random = random.Random(seed)
+
+        end_year = end_year or datetime.date.today().year
+        self.start_date = datetime.date(end_year - years + 1, 1, 1)
+        self.end_date = datetime.date(end_year, 12, 31)
+        self.days = (self.end_date - self.start_date).days + 1
+
+        self.tickers = [f'T{i:03}' for i in range(1, tickers + 1)]
+        self.accounts = {}
+        self.prices = {}
+
+
+    def _random_date(self, start=None):
+        start = start or self.start_date
+        return start + datetime.timedelta(days=self.random.randrange((self.end_date - start).days + 1))
+
+
+    def _amount(self, low, high):
+        return Decimal(self.random.randint(low * 100, high * 100)).scaleb(-2)
+
+
+    def _gen_accounts(self):
+        # Доли счетов: ~10% карт и счетов, ~5% брокерских, ~10% доходов, остальное -- расходы
+        count = max(self.accounts_count, 8)
+        assets_count = max(2, count // 10)
+        brokers_count = max(1, count // 20)
+        income_count = max(1, count // 10)
+        expenses_count = count - assets_count - brokers_count - income_count
+
+        for i in range(assets_count):
+            currency = 'USD' if i % 10 == 1 else 'EUR' if i % 10 == 2 else CURRENCY
+            # Часть счетов открывается позже начала журнала
+            open_date = self.start_date if i < assets_count // 2 + 1 else self._random_date()
+            self.accounts[f'Assets:Карты:Card-{i:04}-{currency}'] = (open_date, currency)
+        for i in range(brokers_count):
+            self.accounts[f'Assets:Инвестиции:Broker-{i:03}'] = (self.start_date, None)
+            self.accounts[f'Assets:Инвестиции:Broker-{i:03}:Cash'] = (self.start_date, CURRENCY)
+        for i in range(income_count):
+            category = INCOME_CATEGORIES[i % len(INCOME_CATEGORIES)]
+            self.accounts[f'Income:{category}-{i:03}'] = (self.start_date, CURRENCY)
+        for i in range(expenses_count):
+            category = EXPENSES_CATEGORIES[i % len(EXPENSES_CATEGORIES)]
+            self.accounts[f'Expenses:{category}:Sub-{i:03}'] = (self.start_date, CURRENCY)
+        self.accounts['Equity:Начальное-сальдо'] = (self.start_date, None)
+
+
+    def _gen_prices(self):
+        # Случайное блуждание: ежедневная цена каждой валюты и тикера в рублях
+        commodities = dict(FOREIGN_CURRENCIES)
+        for ticker in self.tickers:
+            commodities[ticker] = Decimal(self.random.randint(10, 5000))
+        for commodity, price in commodities.items():
+            series = []
+            value = float(price)
+            for day in range(self.days):
+                value *= 1 + self.random.gauss(0, 0.01)
+                series.append(Decimal(f'{max(value, 0.01):.4f}'))
+            self.prices[commodity] = series
+
+
+    def _price(self, commodity, date):
+        return self.prices[commodity][(date - self.start_date).days]
+
+
+    def _accounts_by_prefix(self, prefix, currency=None):
+        return [
+            name for name, (_, account_currency) in self.accounts.items()
+            if name.startswith(prefix) and (currency is None or account_currency == currency)
+        ]
+
+
+    def _gen_transactions(self):
+        cards = self._accounts_by_prefix('Assets:Карты:', CURRENCY)
+        foreign_cards = [name for name in self._accounts_by_prefix('Assets:Карты:') if name not in cards]
+        brokers = [name for name in self._accounts_by_prefix('Assets:Инвестиции:') if not name.endswith(':Cash')]
+        expenses = self._accounts_by_prefix('Expenses:')
+        income = self._accounts_by_prefix('Income:')
+
+        transactions = {}
+        postings = 0
+        while postings < self.postings_count:
+            kind = self.random.random()
+            if kind < 0.80:
+                account_from = self.random.choice(cards + foreign_cards)
+                account_to = self.random.choice(expenses)
+                date = self._random_date(self.accounts[account_from][0])
+                currency = self.accounts[account_from][1]
+                amount = self._amount(50, 5000)
+                if currency == CURRENCY:
+                    text = (f'{date} * "Покупка"\n'
+                            f'    {account_from}    -{amount} {currency}\n'
+                            f'    {account_to}    {amount} {currency}\n')
+                else:
+                    # Счета расходов рублевые: покупка по валютной карте идет с конвертацией
+                    amount_to = (amount * self._price(currency, date)).quantize(Decimal('0.01'))
+                    text = (f'{date} * "Покупка"\n'
+                            f'    {account_from}    -{amount} {currency} @@ {amount_to} {CURRENCY}\n'
+                            f'    {account_to}    {amount_to} {CURRENCY}\n')
+                postings += 2
+            elif kind < 0.92:
+                account_from = self.random.choice(income)
+                account_to = self.random.choice(cards)
+                date = self._random_date(self.accounts[account_to][0])
+                amount = self._amount(10000, 150000)
+                text = (f'{date} * "Доход"\n'
+                        f'    {account_from}    -{amount} {CURRENCY}\n'
+                        f'    {account_to}    {amount} {CURRENCY}\n')
+                postings += 2
+            elif kind < 0.96 and foreign_cards:
+                account_from = self.random.choice(cards)
+                account_to = self.random.choice(foreign_cards)
+                date = self._random_date(max(self.accounts[account_from][0], self.accounts[account_to][0]))
+                currency = self.accounts[account_to][1]
+                amount_to = self._amount(10, 1000)
+                amount_from = (amount_to * self._price(currency, date)).quantize(Decimal('0.01'))
+                text = (f'{date} * "Покупка валюты"\n'
+                        f'    {account_from}    -{amount_from} {CURRENCY}\n'
+                        f'    {account_to}    {amount_to} {currency} @@ {amount_from} {CURRENCY}\n')
+                postings += 2
+            else:
+                broker = self.random.choice(brokers)
+                ticker = self.random.choice(self.tickers)
+                date = self._random_date()
+                units = self.random.randint(1, 100)
+                price = self._price(ticker, date).quantize(Decimal('0.01'))
+                text = (f'{date} * "Покупка {ticker}"\n'
+                        f'    {broker}    {units} {ticker} {{{price} {CURRENCY}}}\n'
+                        f'    {broker}    -{units * price} {CURRENCY}\n'
+                        f'    {broker}:Cash    0 {CURRENCY}\n')
+                postings += 3
+            transactions.setdefault(date, []).append(text)
+        return transactions, postings
+
+
+    def _write(self, path_object, text):
+        path_object.parent.mkdir(parents=True, exist_ok=True)
+        with open(path_object, 'w') as file_object:
+            file_object.write(text)
+
+
+    def generate(self):
+        self._gen_accounts()
+        self._gen_prices()
+
+        self._write(self.root_dir / 'config.bean',
+                    f'option "operating_currency" "{CURRENCY}"\n')
+
+        commodities = [CURRENCY] + list(FOREIGN_CURRENCIES) + self.tickers
+        self._write(self.root_dir / 'commodities' / str(self.start_date.year) / f'{self.start_date}.bean',
+                    ''.join(f'{self.start_date} commodity {commodity}\n' for commodity in commodities))
+
+        accounts_by_date = {}
+        for name, (open_date, currency) in self.accounts.items():
+            line = f'{open_date} open {name} {currency}\n' if currency else f'{open_date} open {name}\n'
+            accounts_by_date.setdefault(open_date, []).append(line)
+        for date, lines in accounts_by_date.items():
+            self._write(self.root_dir / 'accounts' / str(date.year) / f'{date}.bean', ''.join(lines))
+
+        for year in range(self.start_date.year, self.end_date.year + 1):
+            lines = []
+            for day in range(self.days):
+                date = self.start_date + datetime.timedelta(days=day)
+                if date.year != year:
+                    continue
+                for commodity, series in self.prices.items():
+                    lines.append(f'{date} price {commodity} {series[day]} {CURRENCY}\n')
+            self._write(self.root_dir / 'prices' / str(year) / f'{year}-01-01.bean', ''.join(lines))
+
+        transactions, postings = self._gen_transactions()
+        for date, texts in transactions.items():
+            self._write(self.root_dir / 'transactions' / str(date.year) / f'{date}.bean', '\n'.join(texts))
+
+        cards = self._accounts_by_prefix('Assets:Карты:', CURRENCY)
+        templates = {
+            'food-shop': ('Купил продукты', cards[0], self._accounts_by_prefix('Expenses:Питание')[0]),
+            'salary': ('Зарплата', self._accounts_by_prefix('Income:')[0], cards[0]),
+        }
+        for name, (comment, account_from, account_to) in templates.items():
+            self._write(self.root_dir / 'templates' / f'{name}.yml',
+                        TEMPLATE_TEXT.format(comment=comment, account_from=account_from, account_to=account_to))
+
+        return {
+            'accounts': len(self.accounts),
+            'transactions_files': len(transactions),
+            'transactions': sum(len(texts) for texts in transactions.values()),
+            'postings': postings,
+            'prices': sum(len(series) for series in self.prices.values()),
+        }
+
+
+### Functions =================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic moneyctl journal')
+    parser.add_argument('output', type=Path, help='Journal directory to create')
+    parser.add_argument('--size', choices=SIZES, default='small', help='Preset size')
+    parser.add_argument('--years', type=int, help='Years of history')
+    parser.add_argument('--accounts', type=int, help='Number of accounts')
+    parser.add_argument('--postings', type=int, help='Number of postings')
+    parser.add_argument('--tickers', type=int, help='Number of tickers with daily prices')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    if args.output.exists() and any(args.output.iterdir()):
+        parser.error(f'Output directory "{args.output}" is not empty')
+
+    size = dict(SIZES[args.size])
+    for key in size:
+        if getattr(args, key) is not None:
+            size[key] = getattr(args, key)
+
+    stats = JournalGenerator(args.output, seed=args.seed, **size).generate()
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
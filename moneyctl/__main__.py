@@ -1,6 +1,13 @@
 #!/usr/bin/env python3
 
-from moneyctl.cli import cli
+import sys
+
+from moneyctl.client import Client
 
 if __name__ == '__main__':
-    cli(obj={})
+    code = Client().forward(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+
+    from moneyctl.cli import cli
+    cli(obj={}, prog_name='moneyctl')
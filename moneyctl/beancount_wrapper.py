@@ -1,21 +1,123 @@
+import re
 import sys
 import beancount
 import beancount.loader
 import beancount.query.query
+from beancount.core import data
 import pandas as pd
-from datetime import date
+from decimal import Decimal
+from datetime import date, timedelta
 
-from moneyctl.report import Report
+from moneyctl.report import Report, ReportException, StreamReport
+from moneyctl.loader import LedgerLoader
+from moneyctl.cache import LedgerCache
+from moneyctl.engine import NativeEngine
+from moneyctl.price_index import PriceIndex
+from moneyctl.portfolio import PortfolioEngine, PortfolioConfig
+from moneyctl.trace import span, traced
 
 class BeancountWrapper():
 
+    ENGINE_NATIVE = 'native'
+    ENGINE_BQL = 'bql'
+
+    ENGINES = [ENGINE_NATIVE, ENGINE_BQL]
+    ENGINE_DEFAULT = ENGINE_NATIVE
+
+    PERIOD_MONTH = NativeEngine.PERIOD_MONTH
+    PERIOD_QUARTER = NativeEngine.PERIOD_QUARTER
+    PERIOD_YEAR = NativeEngine.PERIOD_YEAR
+
+    PERIODS = [PERIOD_MONTH, PERIOD_QUARTER, PERIOD_YEAR]
+
+    STEP_DAY = 'day'
+    STEP_WEEK = 'week'
+    STEP_MONTH = 'month'
+
+    STEPS = [STEP_DAY, STEP_WEEK, STEP_MONTH]
+    STEP_DEFAULT = STEP_DAY
+
+    CURRENCY = "RUB"
+
+    # Последний разобранный журнал: сервер и dashboard не пересобирают таблицу проводок
+    _native_engine_memo = (None, None)
+    _price_index_memo = (None, None)
+    _portfolio_memo = (None, None)
+
     ASSETS_PREFIX = "Assets:"
     EXPENSES_PREFIX = "Expenses:"
     INCOME_PREFIX = "Income:"
     INVESTMENTS_PREFIX = "Assets:Инвестиции:"
+    LIABILITIES_PREFIX = "Liabilities:"
+
+    def __init__(self, beancount_string=None, journal=None, cache=True,
+                 loader_mode=LedgerLoader.MODE_DEFAULT, ledger=None, engine=ENGINE_DEFAULT,
+                 loader_workers=None, currency=None):
+        if engine not in self.ENGINES:
+            raise ReportException(f'Engine "{engine}" is not supported')
+        self.engine = engine
+        self.currency = currency or self.CURRENCY
+        # Таблица курсов кешируется рядом с журналом под тем же отпечатком
+        self.fingerprint = None
+        self.price_cache = None
+        self.portfolio_cache = None
+        if ledger is not None:
+            self.entries, self.errors, self.options = ledger
+        elif journal is not None:
+            loader = LedgerLoader(journal, mode=loader_mode, cache=cache, workers=loader_workers)
+            self.entries, self.errors, self.options = loader.load()
+            self.fingerprint = loader.fingerprint
+            if cache:
+                self.price_cache = LedgerCache(journal.cache_dir / 'prices')
+                self.portfolio_cache = LedgerCache(journal.cache_dir / 'portfolio')
+        else:
+            self.entries, self.errors, self.options = beancount.loader.load_string(beancount_string, log_errors=sys.stderr)
+        if self.currency != self.CURRENCY:
+            self._validate_currency()
+
+    def _validate_currency(self):
+        if not self._get_price_index().has_currency(self.currency):
+            raise ReportException(f'Currency "{self.currency}" has no prices in journal')
+
+    def _build_price_index(self):
+        with span('engine.prices') as args:
+            price_index = None
+            if self.price_cache is not None and self.fingerprint is not None:
+                price_index = self.price_cache.get(self.fingerprint)
+            args['cached'] = price_index is not None
+            if price_index is None:
+                price_index = PriceIndex.from_entries(self.entries).precompute()
+                if self.price_cache is not None and self.fingerprint is not None:
+                    self.price_cache.put(self.fingerprint, price_index)
+        return price_index
 
-    def __init__(self, beancount_string):
-        self.entries, self.errors, self.options = beancount.loader.load_string(beancount_string, log_errors=sys.stderr)
+    def _get_price_index(self):
+        entries, price_index = BeancountWrapper._price_index_memo
+        if entries is not self.entries:
+            price_index = self._build_price_index()
+            BeancountWrapper._price_index_memo = (self.entries, price_index)
+        return price_index
+
+    def _get_native_engine(self):
+        entries, native_engine = BeancountWrapper._native_engine_memo
+        if entries is not self.entries:
+            with span('engine.build') as args:
+                native_engine = NativeEngine(self.entries, self.options, price_index=self._get_price_index())
+                args['postings'] = len(native_engine.table)
+            BeancountWrapper._native_engine_memo = (self.entries, native_engine)
+        return native_engine
+
+    def _get_portfolio(self):
+        # Снимки лотов живут вместе с версией журнала: в памяти и в кеше на диске
+        entries, portfolio = BeancountWrapper._portfolio_memo
+        if entries is not self.entries:
+            portfolio = PortfolioEngine(self._get_native_engine,
+                                        self._get_price_index(),
+                                        PortfolioConfig.from_entries(self.entries),
+                                        cache=self.portfolio_cache,
+                                        fingerprint=self.fingerprint)
+            BeancountWrapper._portfolio_memo = (self.entries, portfolio)
+        return portfolio
 
     def _rows_to_dict(self, rows):
         result_dict = {}
@@ -29,10 +131,13 @@ class BeancountWrapper():
         return result_dict
 
     def _rows_to_dataframe(self, rows):
-        return pd.DataFrame(self._rows_to_dict(rows))
+        with span('bql.dataframe', rows=len(rows)):
+            return pd.DataFrame(self._rows_to_dict(rows))
 
     def _query(self, query_text):
-        _, result_rows = beancount.query.query.run_query(self.entries, self.options, query_text)
+        with span('bql.query') as args:
+            _, result_rows = beancount.query.query.run_query(self.entries, self.options, query_text)
+            args['rows'] = len(result_rows)
         if result_rows:
             return self._rows_to_dataframe(result_rows)
         else:
@@ -48,41 +153,84 @@ class BeancountWrapper():
         return dataframe.loc[(dataframe[by_column] < 0) | (dataframe[by_column] > MIN_ACCOUNT_POSITION)]
 
 
-    def assets_report(self, empty_accounts=True, total=True):
+    @traced('report.assets')
+    def assets_report(self, empty_accounts=True, total=True, on_date=None):
+        if on_date is None:
+            response_dataframe = self._query_assets_today()
+        else:
+            response_dataframe = self._query_assets_on(on_date)
+        if not isinstance(response_dataframe, pd.DataFrame):
+            return Report(None, None)
+        if not empty_accounts:
+            response_dataframe = self._exclude_empty_accounts(response_dataframe, by_column='position')
+        response_dataframe['account'] = response_dataframe['account'].str.replace(self.ASSETS_PREFIX, '')
+        total_series = self._gen_total(response_dataframe) if total else None
+        return Report(response_dataframe, total_series)
+
+
+    def _query_assets_today(self):
         today = date.today().strftime('%Y-%m-%d')
         request = f'''
             SELECT
                 account,
-                sum(number(convert(position, "RUB", TODAY()))) as position
+                sum(number(convert(position, "{self.currency}", TODAY()))) as position
             FROM OPEN ON {today}
             WHERE
                 account ~ "{self.ASSETS_PREFIX}"
                 AND not account ~ "{self.INVESTMENTS_PREFIX}"
         '''
-        response_dataframe = self._query(request)
-        if not isinstance(response_dataframe, pd.DataFrame):
-            return Report(None, None)
-        if not empty_accounts:
-            response_dataframe = self._exclude_empty_accounts(response_dataframe, by_column='position')
-        response_dataframe['account'] = response_dataframe['account'].str.replace(self.ASSETS_PREFIX, '')
-        total_series = self._gen_total(response_dataframe) if total else None
-        return Report(response_dataframe, total_series)
+        if self.engine == self.ENGINE_NATIVE:
+            return self._get_native_engine().assets(include=self.ASSETS_PREFIX,
+                                                    exclude=self.INVESTMENTS_PREFIX,
+                                                    target=self.currency,
+                                                    on_date=date.today())
+        return self._query(request)
+
+
+    def _query_assets_on(self, on_date):
+        # Остатки на конец дня on_date: проводки после даты отбрасываются
+        on_date_str = on_date.strftime('%Y-%m-%d')
+        close_date_str = (on_date + timedelta(days=1)).strftime('%Y-%m-%d')
+        request = f'''
+            SELECT
+                account,
+                sum(number(convert(position, "{self.currency}", {on_date_str}))) as position
+            FROM CLOSE ON {close_date_str}
+            WHERE
+                account ~ "{self.ASSETS_PREFIX}"
+                AND not account ~ "{self.INVESTMENTS_PREFIX}"
+        '''
+        if self.engine == self.ENGINE_NATIVE:
+            return self._get_native_engine().assets_on(include=self.ASSETS_PREFIX,
+                                                       exclude=self.INVESTMENTS_PREFIX,
+                                                       target=self.currency,
+                                                       on_date=on_date)
+        return self._query(request)
 
 
-    def expenses_report(self, from_, to, total=True):
+    @traced('report.expenses')
+    def expenses_report(self, from_, to, total=True, by=None):
+        if by is not None:
+            return self._period_pivot_report(self.EXPENSES_PREFIX, from_, to, by, negate=False, total=total)
         from_str = from_.strftime('%Y-%m-%d')
         to_str = to.strftime('%Y-%m-%d')
         request = f'''
             SELECT
                 account,
-                sum(number(convert(position, "RUB", date))) as position
+                sum(number(convert(position, "{self.currency}", date))) as position
             WHERE
                 account ~ "{self.EXPENSES_PREFIX}"
                 AND date >= {from_str}
                 AND date <= {to_str}
             ORDER BY position, account DESC
         '''
-        response_dataframe = self._query(request)
+        if self.engine == self.ENGINE_NATIVE:
+            response_dataframe = self._get_native_engine().period(include=self.EXPENSES_PREFIX,
+                                                                  target=self.currency,
+                                                                  from_=from_,
+                                                                  to=to)
+        else:
+            response_dataframe = self._query(request)
         if not isinstance(response_dataframe, pd.DataFrame):
             return Report(None, None)
         response_dataframe['account'] = response_dataframe['account'].str.replace(self.EXPENSES_PREFIX, '')
@@ -90,36 +238,133 @@ class BeancountWrapper():
         return Report(response_dataframe, total_series)
 
 
-    def income_report(self, from_, to, total=True):
+    @traced('report.income')
+    def income_report(self, from_, to, total=True, by=None):
+        if by is not None:
+            return self._period_pivot_report(self.INCOME_PREFIX, from_, to, by, negate=True, total=total)
         from_str = from_.strftime('%Y-%m-%d')
         to_str = to.strftime('%Y-%m-%d')
         request = f'''
             SELECT
                 account,
-                neg(sum(number(convert(position, "RUB", date)))) as position
+                neg(sum(number(convert(position, "{self.currency}", date)))) as position
             WHERE
                 account ~ "{self.INCOME_PREFIX}"
                 AND date >= {from_str}
                 AND date <= {to_str}
             ORDER BY position, account DESC
         '''
-        response_dataframe = self._query(request)
+        if self.engine == self.ENGINE_NATIVE:
+            response_dataframe = self._get_native_engine().period(include=self.INCOME_PREFIX,
+                                                                  target=self.currency,
+                                                                  from_=from_,
+                                                                  to=to,
+                                                                  negate=True)
+        else:
+            response_dataframe = self._query(request)
         if not isinstance(response_dataframe, pd.DataFrame):
             return Report(None, None)
         response_dataframe['account'] = response_dataframe['account'].str.replace(self.INCOME_PREFIX, '')
         total_series = self._gen_total(response_dataframe) if total else None
         return Report(response_dataframe, total_series)
 
-    
+
+    def _gen_period_start(self, day, by):
+        if by == self.PERIOD_MONTH:
+            return date(day.year, day.month, 1)
+        if by == self.PERIOD_QUARTER:
+            return date(day.year, (day.month - 1) // 3 * 3 + 1, 1)
+        if by == self.PERIOD_YEAR:
+            return date(day.year, 1, 1)
+        raise ReportException(f'Period "{by}" is not supported')
+
+    def _gen_period_label(self, start, by):
+        if by == self.PERIOD_MONTH:
+            return f'{start.year}.{start.month:02}'
+        if by == self.PERIOD_QUARTER:
+            return f'{start.year}.Q{(start.month - 1) // 3 + 1}'
+        return f'{start.year}'
+
+    def _gen_periods_starts(self, from_, to, by):
+        step = {self.PERIOD_MONTH: 1, self.PERIOD_QUARTER: 3, self.PERIOD_YEAR: 12}[by]
+        starts = []
+        start = self._gen_period_start(from_, by)
+        while start <= to:
+            starts.append(start)
+            months = start.year * 12 + start.month - 1 + step
+            start = date(months // 12, months % 12 + 1, 1)
+        return starts
+
+    def _query_period_cells(self, prefix, from_, to, by):
+        # Один запрос с группировкой по месяцам, дальше месяцы сворачиваются в периоды
+        from_str = from_.strftime('%Y-%m-%d')
+        to_str = to.strftime('%Y-%m-%d')
+        request = f'''
+            SELECT
+                account,
+                year(date) as year,
+                month(date) as month,
+                sum(number(convert(position, "{self.currency}", date))) as position
+            WHERE
+                account ~ "{prefix}"
+                AND date >= {from_str}
+                AND date <= {to_str}
+            GROUP BY account, year, month
+        '''
+        _, result_rows = beancount.query.query.run_query(self.entries, self.options, request)
+        cells = {}
+        for row in result_rows:
+            key = (row.account, self._gen_period_start(date(row.year, row.month, 1), by))
+            cells[key] = cells.get(key, Decimal()) + row.position
+        return [(account, start, position) for (account, start), position in cells.items()]
+
+    def _period_pivot_report(self, prefix, from_, to, by, negate, total=True):
+        if by not in self.PERIODS:
+            raise ReportException(f'Period "{by}" is not supported')
+        if self.engine == self.ENGINE_NATIVE:
+            cells = self._get_native_engine().period_cells(include=prefix, target=self.currency,
+                                                           from_=from_, to=to, by=by)
+        else:
+            cells = self._query_period_cells(prefix, from_, to, by)
+        if not cells:
+            return Report(None, None)
+
+        # Счет x период; пустые ячейки -- 0, последняя колонка -- итог по счету
+        starts = self._gen_periods_starts(from_, to, by)
+        columns = {start: self._gen_period_label(start, by) for start in starts}
+        table = {}
+        for account, start, position in cells:
+            row = table.setdefault(account, {label: Decimal() for label in columns.values()})
+            row[columns[start]] = -position if negate else position
+
+        rows = []
+        for account, row in table.items():
+            row_total = sum(row.values(), Decimal())
+            rows.append([account] + list(row.values()) + [row_total])
+        rows.sort(key=lambda row: (row[-1], row[0]), reverse=True)
+
+        response_dataframe = pd.DataFrame(rows, columns=['account'] + list(columns.values()) + ['total'])
+        response_dataframe['account'] = response_dataframe['account'].str.replace(prefix, '')
+        total_series = self._gen_total(response_dataframe) if total else None
+        return Report(response_dataframe, total_series)
+
+
+    @traced('report.invest-cash')
     def invest_cash_report(self, total=True):
         request = f'''
             SELECT
                 account,
-                SUM(number) as position
+                sum(number(convert(position, "{self.currency}", TODAY()))) as position
             WHERE
-                account ~ "{self.INVESTMENTS_PREFIX}" AND currency = "RUB"
+                account ~ "{self.INVESTMENTS_PREFIX}" AND currency = "{self.CURRENCY}"
         '''
-        response_dataframe = self._query(request)
+        if self.engine == self.ENGINE_NATIVE:
+            response_dataframe = self._get_native_engine().cash(include=self.INVESTMENTS_PREFIX,
+                                                                currency=self.CURRENCY,
+                                                                target=self.currency,
+                                                                on_date=date.today())
+        else:
+            response_dataframe = self._query(request)
         if not isinstance(response_dataframe, pd.DataFrame):
             return Report(None, None)
         response_dataframe['account'] = response_dataframe['account'].str.replace(self.INVESTMENTS_PREFIX, '')
@@ -127,33 +372,165 @@ class BeancountWrapper():
         return Report(response_dataframe, total_series)
 
     
+    @traced('report.invest-parts')
     def invest_parts_report(self, total=True):
+        config = self._get_portfolio().config
+        # GETPRICE знает только прямые цены: бумаги котируются в рублях, другая валюта -- через кросс-курс
+        price = f'FIRST(GETPRICE(currency, "{self.CURRENCY}", TODAY()))'
+        if self.currency != self.CURRENCY:
+            price += f' * FIRST(GETPRICE("{self.CURRENCY}", "{self.currency}", TODAY()))'
+        excluded = ''.join(f' AND currency != "{currency}"' for currency in config.excluded)
         request = f'''
             SELECT
-    	    currency,
-            SUM(number) * FIRST(GETPRICE(currency, "RUB", TODAY())) as position
-    	WHERE
-    	    account ~ "{self.INVESTMENTS_PREFIX}"
-    	    AND currency != "RUB"
-    	    AND currency != "FXUS"
-    	    AND currency != "FXIT"
-    	    AND currency != "FXIM"
+                currency,
+                SUM(number) * {price} as position
+            WHERE
+                account ~ "{self.INVESTMENTS_PREFIX}"{excluded}
             ORDER BY position, currency DESC
         '''
-        response_dataframe = self._query(request)
+        if self.engine == self.ENGINE_NATIVE:
+            holdings = self._get_portfolio().valuate(include=self.INVESTMENTS_PREFIX,
+                                                     target=self.currency,
+                                                     on_date=date.today(),
+                                                     level=PortfolioEngine.LEVEL_HOLDING,
+                                                     all_postings=True,
+                                                     quote=self.CURRENCY)
+            response_dataframe = None
+            if holdings is not None:
+                response_dataframe = holdings[['currency', 'value']].rename(columns={'value': 'position'})
+        else:
+            response_dataframe = self._query(request)
         if not isinstance(response_dataframe, pd.DataFrame):
             return Report(None, None)
         response_dataframe = self._exclude_empty_accounts(response_dataframe, by_column='position')
-        total = response_dataframe['position'].sum()
-        response_dataframe['part'] = response_dataframe['position'] / total * 100
+        total_position = response_dataframe['position'].sum()
+        response_dataframe['part'] = response_dataframe['position'] / total_position * 100
         total_series = self._gen_total(response_dataframe) if total else None
+        return Report(response_dataframe, total_series)
 
-        # TODO посчитать total и извлечь сумму в рублях
-        # TODO посчитать процент для каждого currency
 
-        #response_dataframe['account'] = response_dataframe['account'].str.replace(self.INVESTMENTS_PREFIX, '')
-        total_series = self._gen_total(response_dataframe) if total else None
-        return Report(response_dataframe, total_series)
+    @traced('report.portfolio')
+    def portfolio_report(self, level=PortfolioEngine.LEVEL_DEFAULT, on_date=None, total=True):
+        # Лоты, стоимость покупки, рыночная стоимость, нереализованный доход и доля
+        portfolio = self._get_portfolio()
+        response_dataframe = portfolio.valuate(include=self.INVESTMENTS_PREFIX,
+                                               target=self.currency,
+                                               on_date=on_date or date.today(),
+                                               level=level)
+        # Счет повторяется по лотам и бумагам -- в JSON строки списком на любом уровне
+        if response_dataframe is None:
+            return Report(None, None, keyed=False)
+        total_series = portfolio.gen_total(response_dataframe) if total else None
+        return Report(response_dataframe, total_series, keyed=False)
+
+
+    def _gen_steps_ends(self, from_, to, step):
+        # Концы шагов в диапазоне; последний шаг всегда заканчивается в to
+        if step not in self.STEPS:
+            raise ReportException(f'Step "{step}" is not supported')
+        ends = []
+        day = from_
+        while day < to:
+            if step == self.STEP_DAY:
+                end = day
+            elif step == self.STEP_WEEK:
+                end = day + timedelta(days=6 - day.weekday())
+            else:
+                months = day.year * 12 + day.month
+                end = date(months // 12, months % 12 + 1, 1) - timedelta(days=1)
+            if end >= to:
+                break
+            ends.append(end)
+            day = end + timedelta(days=1)
+        ends.append(to)
+        return ends
+
+    def _query_networth_on(self, on_date):
+        # Эталон для --engine bql: отдельный запрос остатков на каждую дату
+        on_date_str = on_date.strftime('%Y-%m-%d')
+        close_date_str = (on_date + timedelta(days=1)).strftime('%Y-%m-%d')
+        request = f'''
+            SELECT
+                root(account, 1) as root,
+                sum(number(convert(position, "{self.currency}", {on_date_str}))) as position
+            FROM CLOSE ON {close_date_str}
+            WHERE
+                account ~ "^{self.ASSETS_PREFIX}"
+                OR account ~ "^{self.LIABILITIES_PREFIX}"
+            GROUP BY root
+        '''
+        _, result_rows = beancount.query.query.run_query(self.entries, self.options, request)
+        positions = {f'{row.root}:': row.position for row in result_rows}
+        return [positions.get(prefix) or Decimal() for prefix in (self.ASSETS_PREFIX, self.LIABILITIES_PREFIX)]
+
+    @traced('report.networth')
+    def networth_report(self, from_=None, to=None, step=STEP_DEFAULT):
+        # Ряд для графика: активы, долги и чистая стоимость на конец каждого шага
+        to = to or date.today()
+        if from_ is None:
+            dates = [entry.date for entry in self.entries if isinstance(entry, data.Transaction)]
+            if not dates:
+                return Report(None, None)
+            from_ = min(dates)
+        if from_ > to:
+            raise ReportException('Time range beginning should not be later then ending')
+        ends = self._gen_steps_ends(from_, to, step)
+
+        if self.engine == self.ENGINE_NATIVE:
+            includes = [f'^{self.ASSETS_PREFIX}', f'^{self.LIABILITIES_PREFIX}']
+            assets, liabilities = self._get_native_engine().balances_series(includes=includes,
+                                                                            target=self.currency,
+                                                                            dates=ends)
+        else:
+            assets, liabilities = zip(*[self._query_networth_on(end) for end in ends]) if ends else ([], [])
+
+        response_dataframe = pd.DataFrame({
+            'date': [end.isoformat() for end in ends],
+            'assets': list(assets),
+            'liabilities': list(liabilities),
+            'networth': [asset + liability for asset, liability in zip(assets, liabilities)],
+        })
+        return Report(response_dataframe, None)
+
+
+    REGISTER_COLUMNS = ['date', 'narration', 'account', 'amount', 'currency', 'balance']
+
+    def register_rows(self, account_pattern, from_=None, to=None):
+        # Генератор: проводки счетов по шаблону с нарастающим остатком по каждой валюте;
+        # проводки до from_ не выводятся, но входят в остаток
+        regex = re.compile(account_pattern, re.IGNORECASE)
+        matched = {}
+        balances = {}
+        for entry in self.entries:
+            if not isinstance(entry, data.Transaction):
+                continue
+            if to is not None and entry.date > to:
+                break
+            for posting in entry.postings:
+                if posting.account not in matched:
+                    matched[posting.account] = bool(regex.search(posting.account))
+                if not matched[posting.account] or posting.units is None:
+                    continue
+                number, currency = posting.units.number, posting.units.currency
+                balances[currency] = balances.get(currency, Decimal()) + number
+                if from_ is not None and entry.date < from_:
+                    continue
+                yield entry.date, entry.narration, posting.account, number, currency, balances[currency]
+
+
+    def register_report(self, account_pattern, from_=None, to=None):
+        return StreamReport(self.REGISTER_COLUMNS, self.register_rows(account_pattern, from_=from_, to=to))
+
+
+    def dashboard_reports(self, from_, to, empty_accounts=False, total=True):
+        # Все отчеты по одному загруженному журналу
+        return {
+            'assets': self.assets_report(empty_accounts=empty_accounts, total=total),
+            'expenses': self.expenses_report(from_=from_, to=to, total=total),
+            'income': self.income_report(from_=from_, to=to, total=total),
+            'invest-cash': self.invest_cash_report(total=total),
+            'invest-parts': self.invest_parts_report(total=total),
+        }
 
 # TODO !!! Перейти на стандартный для pandas способ добавления total в таблицу
 # https://stackoverflow.com/questions/41286569/get-total-of-pandas-column
@@ -0,0 +1,116 @@
+import os
+import pickle
+import hashlib
+
+
+# Classes =====================================================================
+
+### Ledger Cache Class --------------------------------------------------------
+
+class LedgerCache:
+
+    CACHE_FORMAT_VERSION = 1
+
+    DEFAULT_MAX_SIZE = 256 * 1024 * 1024 # 256 MiB
+    DEFAULT_MAX_GENERATIONS = 3
+
+    FILE_PREFIX = 'ledger-'
+    FILE_SUFFIX = '.pickle'
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE,
+                 max_generations=DEFAULT_MAX_GENERATIONS):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_generations = max_generations
+
+
+    def _hash_file(self, path_object):
+        with open(path_object, 'rb') as file_object:
+            return hashlib.file_digest(file_object, 'blake2b').hexdigest()
+
+
+    def describe(self, paths):
+        records = []
+        for path_object in sorted(paths):
+            stat = path_object.stat()
+            content_hash = self._hash_file(path_object)
+            records.append((path_object, stat.st_size, stat.st_mtime_ns, content_hash))
+        return records
+
+
+    def fingerprint_records(self, records, salt=''):
+        # Ключ поколения -- путь, размер, mtime и хеш содержимого каждого файла
+        digest = hashlib.sha256()
+        digest.update(f'{self.CACHE_FORMAT_VERSION}\0{salt}\0'.encode())
+        for path_object, size, mtime_ns, content_hash in records:
+            record = f'{path_object}\0{size}\0{mtime_ns}\0{content_hash}\n'
+            digest.update(record.encode())
+        return digest.hexdigest()
+
+
+    def fingerprint(self, paths, salt=''):
+        return self.fingerprint_records(self.describe(paths), salt=salt)
+
+
+    def _gen_filepath(self, fingerprint):
+        return self.cache_dir / f'{self.FILE_PREFIX}{fingerprint}{self.FILE_SUFFIX}'
+
+
+    def _list_generations(self):
+        if not self.cache_dir.is_dir():
+            return []
+        generations = []
+        for path_object in self.cache_dir.glob(f'{self.FILE_PREFIX}*{self.FILE_SUFFIX}'):
+            try:
+                stat = path_object.stat()
+            except FileNotFoundError:
+                continue
+            generations.append((stat.st_mtime_ns, stat.st_size, path_object))
+        generations.sort(reverse=True)
+        return generations
+
+
+    def _remove(self, path_object):
+        try:
+            path_object.unlink()
+        except FileNotFoundError:
+            pass
+
+
+    def get(self, fingerprint):
+        filepath = self._gen_filepath(fingerprint)
+        try:
+            with open(filepath, 'rb') as file_object:
+                value = pickle.load(file_object)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Битый файл кеша -- считаем промахом и удаляем
+            self._remove(filepath)
+            return None
+        # Обновляем mtime, чтобы поколение считалось недавно использованным
+        os.utime(filepath)
+        return value
+
+
+    def put(self, fingerprint, value):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        filepath = self._gen_filepath(fingerprint)
+        tmp_filepath = filepath.with_name(f'{filepath.name}.{os.getpid()}.tmp')
+        with open(tmp_filepath, 'wb') as file_object:
+            pickle.dump(value, file_object, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filepath, filepath)
+        self.evict()
+
+
+    def evict(self):
+        total_size = 0
+        for i, (_, size, path_object) in enumerate(self._list_generations()):
+            total_size += size
+            if i >= self.max_generations or total_size > self.max_size:
+                self._remove(path_object)
+
+
+    def clear(self):
+        for _, _, path_object in self._list_generations():
+            self._remove(path_object)
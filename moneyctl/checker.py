@@ -0,0 +1,516 @@
+import os
+import json
+import hashlib
+from bisect import bisect_left
+from decimal import Decimal
+from pathlib import Path
+
+import beancount.parser.parser
+from beancount.core import data, interpolate
+from beancount.core.amount import Amount
+from beancount.core.position import Cost, CostSpec
+from beancount.core.number import MISSING
+
+from moneyctl.loader import ParseCache
+from moneyctl.trace import span
+
+
+# Classes =====================================================================
+
+class CheckException(BaseException):
+    def __init__(self, message=None):
+        super().__init__(message)
+
+
+### Journal Checker Class -----------------------------------------------------
+
+class JournalChecker:
+
+    CACHE_FORMAT_VERSION = 3
+
+    ERROR_PARSE = 'parse'
+    ERROR_UNBALANCED = 'unbalanced'
+    ERROR_UNKNOWN_ACCOUNT = 'unknown-account'
+    ERROR_INACTIVE_ACCOUNT = 'inactive-account'
+    ERROR_UNKNOWN_COMMODITY = 'unknown-commodity'
+    ERROR_INVALID_CURRENCY = 'invalid-currency'
+    ERROR_SAME_ACCOUNT = 'same-account'
+    ERROR_OPEN_CLOSE = 'open-close'
+    ERROR_BALANCE = 'balance'
+    ERROR_TEMPLATE = 'template'
+
+    # Валюта в дельтах для проводки, сумму которой нельзя восстановить
+    UNKNOWN_CURRENCY = '*'
+
+    def __init__(self, journal, cache=True):
+        self.journal = journal
+        self.cache = cache
+        self.cache_file = journal.state_dir / 'check.json'
+        self.parse_cache = ParseCache(journal.cache_dir / 'files')
+        self.options = beancount.parser.parser.parse_string(journal.get_beancount_header())[2]
+        self.files = {}
+        self.checked_files_count = 0
+
+
+    def _read_cache(self):
+        if not self.cache:
+            return None
+        try:
+            with open(self.cache_file, 'r') as file_object:
+                cache = json.load(file_object)
+        except (FileNotFoundError, ValueError):
+            return None
+        except OSError as e:
+            message = f'Cannot read check cache "{self.cache_file}": {e.strerror}'
+            raise CheckException(message)
+        if cache.get('version') != self.CACHE_FORMAT_VERSION or cache.get('header') != self._gen_header_hash():
+            return None
+        return cache
+
+
+    def _write_cache(self, declarations, commodities, asserted):
+        if not self.cache:
+            return
+        cache = {
+            'version': self.CACHE_FORMAT_VERSION,
+            'header': self._gen_header_hash(),
+            'declarations': declarations,
+            'commodities': sorted(commodities),
+            'asserted': sorted(asserted),
+            'files': self.files,
+        }
+        tmp_file = self.cache_file.with_name(f'{self.cache_file.name}.{os.getpid()}.tmp')
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_file, 'w') as file_object:
+                json.dump(cache, file_object, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            tmp_file.unlink(missing_ok=True)
+            message = f'Cannot write check cache "{self.cache_file}": {e.strerror}'
+            raise CheckException(message)
+
+
+    def _gen_header_hash(self):
+        return hashlib.sha256(self.journal.get_beancount_header().encode()).hexdigest()
+
+
+    def _hash_file(self, path_object):
+        with open(path_object, 'rb') as file_object:
+            return hashlib.file_digest(file_object, 'blake2b').hexdigest()
+
+
+    def _parse(self, path_object, content_hash):
+        parse_result = self.parse_cache.get(path_object, content_hash)
+        if parse_result is None:
+            parse_result = beancount.parser.parser.parse_file(str(path_object.absolute()))
+            self.parse_cache.put(path_object, content_hash, parse_result)
+        return parse_result
+
+
+    def _summarize(self, stat, content_hash, parse_result):
+        # Все, что нужно для глобальных проверок без повторного разбора файла
+        entries, errors, _ = parse_result
+        opens, closes, commodities, assertions, pads = [], [], [], [], []
+        accounts, currencies = set(), set()
+        for entry in entries:
+            if isinstance(entry, data.Open):
+                opens.append([entry.account, entry.date.isoformat(), entry.currencies or [], entry.meta['lineno']])
+            elif isinstance(entry, data.Close):
+                closes.append([entry.account, entry.date.isoformat(), entry.meta['lineno']])
+            elif isinstance(entry, data.Commodity):
+                commodities.append(entry.currency)
+            elif isinstance(entry, data.Balance):
+                accounts.add(entry.account)
+                currencies.add(entry.amount.currency)
+                tolerance = entry.tolerance
+                if tolerance is None:
+                    exponent = entry.amount.number.as_tuple().exponent
+                    tolerance = Decimal(1).scaleb(exponent) * self.options['inferred_tolerance_multiplier'] * 2 \
+                        if exponent < 0 else Decimal(0)
+                assertions.append([entry.account, entry.date.isoformat(), str(entry.amount.number),
+                                   entry.amount.currency, str(tolerance), entry.meta['lineno']])
+            elif isinstance(entry, data.Pad):
+                accounts.update((entry.account, entry.source_account))
+                pads.append([entry.account, entry.source_account, entry.date.isoformat(), entry.meta['lineno']])
+            elif isinstance(entry, data.Transaction):
+                for posting in entry.postings:
+                    accounts.add(posting.account)
+                    currencies.update(self._get_posting_currencies(posting))
+            elif isinstance(entry, data.Price):
+                currencies.update((entry.currency, entry.amount.currency))
+
+        return {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'hash': content_hash,
+            'opens': opens,
+            'closes': closes,
+            'commodities': commodities,
+            'assertions': assertions,
+            'pads': pads,
+            'accounts': sorted(accounts),
+            'currencies': sorted(currencies),
+            'parse_errors': [[error.source['lineno'], str(error.message)] for error in errors],
+        }
+
+
+    def _get_posting_currencies(self, posting):
+        currencies = []
+        if isinstance(posting.units, Amount) and isinstance(posting.units.currency, str):
+            currencies.append(posting.units.currency)
+        if posting.cost is not None and isinstance(posting.cost.currency, str):
+            currencies.append(posting.cost.currency)
+        if posting.price is not None and isinstance(posting.price.currency, str):
+            currencies.append(posting.price.currency)
+        return currencies
+
+
+    def _gen_weight_postings(self, postings):
+        # Неразнесенные проводки: CostSpec с явной ценой за единицу превращается в Cost;
+        # без чисел (автоматическая проводка, списание лотов) баланс проверит только booking
+        result = []
+        for posting in postings:
+            units = posting.units
+            if not isinstance(units, Amount) or not isinstance(units.number, Decimal) or units.currency is MISSING:
+                return None
+            cost = posting.cost
+            if isinstance(cost, CostSpec):
+                if cost.number_total is not None or not isinstance(cost.number_per, Decimal):
+                    return None
+                posting = posting._replace(cost=Cost(cost.number_per, cost.currency, None, None))
+            elif posting.price is not None and not isinstance(posting.price.number, Decimal):
+                return None
+            result.append(posting)
+        return result
+
+
+    def _check_transaction(self, entry, declarations, commodities, asserted, deltas):
+        errors = []
+        lineno = entry.meta['lineno']
+
+        postings_accounts = {posting.account for posting in entry.postings}
+        if len(entry.postings) > 1 and len(postings_accounts) == 1:
+            errors.append([lineno, self.ERROR_SAME_ACCOUNT,
+                           f"Transaction source and destination are the same account '{entry.postings[0].account}'"])
+
+        for posting in entry.postings:
+            account = posting.account
+            lineno = posting.meta.get('lineno', entry.meta['lineno'])
+            declaration = declarations.get(account)
+            if declaration is None:
+                errors.append([lineno, self.ERROR_UNKNOWN_ACCOUNT, f"Invalid reference to unknown account '{account}'"])
+            else:
+                open_date, close_date, account_currencies = declaration
+                date = entry.date.isoformat()
+                if date < open_date or (close_date is not None and date > close_date):
+                    errors.append([lineno, self.ERROR_INACTIVE_ACCOUNT, f"Invalid reference to inactive account '{account}'"])
+                units_currency = posting.units.currency if isinstance(posting.units, Amount) else None
+                if account_currencies and isinstance(units_currency, str) and units_currency not in account_currencies:
+                    errors.append([lineno, self.ERROR_INVALID_CURRENCY,
+                                   f"Invalid currency {units_currency} for account '{account}'"])
+
+            for currency in self._get_posting_currencies(posting):
+                if currency not in commodities:
+                    errors.append([lineno, self.ERROR_UNKNOWN_COMMODITY, f"Unknown commodity {currency}"])
+
+        if asserted:
+            self._add_deltas(entry, asserted, deltas)
+
+        weight_postings = self._gen_weight_postings(entry.postings)
+        if weight_postings is not None:
+            residual = interpolate.compute_residual(weight_postings)
+            tolerances = interpolate.infer_tolerances(weight_postings, self.options)
+            if not residual.is_small(tolerances):
+                errors.append([entry.meta['lineno'], self.ERROR_UNBALANCED, f'Transaction does not balance: {residual}'])
+
+        return errors
+
+
+    def _is_elided(self, posting):
+        return not isinstance(posting.units, Amount) or not isinstance(posting.units.number, Decimal)
+
+
+    def _gen_elided_units(self, entry):
+        # Сумма единственной проводки без числа -- остаток остальных, как в interpolate;
+        # None -- посчитать без booking нельзя (например, списание лотов без цены)
+        elided = [posting for posting in entry.postings if self._is_elided(posting)]
+        if len(elided) != 1 or elided[0].cost is not None or elided[0].price is not None:
+            return None
+        weight_postings = self._gen_weight_postings([posting for posting in entry.postings if posting is not elided[0]])
+        if weight_postings is None:
+            return None
+        currency = elided[0].units.currency if isinstance(elided[0].units, Amount) else None
+        units = [-position.units for position in interpolate.compute_residual(weight_postings)]
+        if isinstance(currency, str) and any(amount.currency != currency for amount in units):
+            return None
+        return units
+
+
+    def _add_deltas(self, entry, asserted, deltas):
+        date = entry.date.isoformat()
+        elided_units = None
+        for posting in entry.postings:
+            account = posting.account
+            if not self._is_asserted(account, asserted):
+                continue
+            if not self._is_elided(posting):
+                units = [posting.units]
+            else:
+                if elided_units is None:
+                    elided_units = self._gen_elided_units(entry)
+                if elided_units is None:
+                    # Остаток неизвестен: утверждения по счету после этой даты не проверяются
+                    key = f'{account}\0{self.UNKNOWN_CURRENCY}\0{date}'
+                    deltas[key] = '0'
+                    continue
+                units = elided_units
+            for amount in units:
+                key = f'{account}\0{amount.currency}\0{date}'
+                deltas[key] = str(Decimal(deltas.get(key, 0)) + amount.number)
+
+
+    def _is_asserted(self, account, asserted):
+        # Проверка баланса счета включает его подсчета
+        while True:
+            if account in asserted:
+                return True
+            account, separator, _ = account.rpartition(':')
+            if not separator:
+                return False
+
+
+    def _check_file(self, summary, parse_result, declarations, commodities, asserted):
+        errors = [[lineno, self.ERROR_PARSE, message] for lineno, message in summary['parse_errors']]
+        deltas = {}
+        for entry in parse_result[0]:
+            if isinstance(entry, data.Transaction):
+                errors.extend(self._check_transaction(entry, declarations, commodities, asserted, deltas))
+            elif isinstance(entry, data.Price):
+                for currency in (entry.currency, entry.amount.currency):
+                    if currency not in commodities:
+                        errors.append([entry.meta['lineno'], self.ERROR_UNKNOWN_COMMODITY, f'Unknown commodity {currency}'])
+            elif isinstance(entry, data.Balance):
+                if entry.account not in declarations:
+                    errors.append([entry.meta['lineno'], self.ERROR_UNKNOWN_ACCOUNT,
+                                   f"Invalid reference to unknown account '{entry.account}'"])
+            elif isinstance(entry, data.Pad):
+                for account in (entry.account, entry.source_account):
+                    if account not in declarations:
+                        errors.append([entry.meta['lineno'], self.ERROR_UNKNOWN_ACCOUNT,
+                                       f"Invalid reference to unknown account '{account}'"])
+        summary['errors'] = errors
+        summary['deltas'] = deltas
+        self.checked_files_count += 1
+
+
+    def _collect_declarations(self):
+        # {account: [open date, close date, currencies]} и ошибки самих объявлений
+        declarations = {}
+        errors = []
+        closes = []
+        for filename, summary in self.files.items():
+            for account, date, currencies, lineno in summary['opens']:
+                if account in declarations:
+                    errors.append([filename, lineno, self.ERROR_OPEN_CLOSE, f"Duplicate open directive for '{account}'"])
+                    continue
+                declarations[account] = [date, None, currencies]
+            closes.extend((filename, close) for close in summary['closes'])
+
+        for filename, (account, date, lineno) in closes:
+            declaration = declarations.get(account)
+            if declaration is None:
+                errors.append([filename, lineno, self.ERROR_OPEN_CLOSE, f"Unopened account '{account}' is being closed"])
+            elif declaration[1] is not None:
+                errors.append([filename, lineno, self.ERROR_OPEN_CLOSE, f"Duplicate close directive for '{account}'"])
+            elif date < declaration[0]:
+                errors.append([filename, lineno, self.ERROR_OPEN_CLOSE, f"Account '{account}' is closed before it is opened"])
+            else:
+                declaration[1] = date
+        return declarations, errors
+
+
+    def _is_subaccount(self, account, parent):
+        return account == parent or account.startswith(parent + ':')
+
+
+    def _get_balance(self, series, account, currency, date):
+        # Баланс счета с подсчетами на начало дня; None -- в нем есть неизвестный остаток
+        balance = Decimal()
+        for (series_account, series_currency), numbers in series.items():
+            if not self._is_subaccount(series_account, account):
+                continue
+            if series_currency == self.UNKNOWN_CURRENCY:
+                if any(number_date < date for number_date in numbers):
+                    return None
+            elif series_currency == currency:
+                balance += sum((number for number_date, number in numbers.items() if number_date < date), Decimal())
+        return balance
+
+
+    def _apply_pads(self, series):
+        # Как beancount.ops.pad: pad дополняет счет до следующего утверждения баланса в каждой валюте;
+        # дополнение проводится датой pad между счетом и источником
+        pads = {}
+        for summary in self.files.values():
+            for account, source_account, date, lineno in summary['pads']:
+                pads.setdefault(account, []).append((date, 1, lineno, source_account))
+        if not pads:
+            return
+
+        paddings = []
+        for account, events in sorted(pads.items()):
+            for summary in self.files.values():
+                for assertion in summary['assertions']:
+                    if assertion[0] == account:
+                        # Утверждение в тот же день идет раньше pad
+                        events.append((assertion[1], 0, assertion[5], assertion))
+            active_pad = None
+            padded = set()
+            # Уже вставленные дополнения этого счета по валютам
+            totals = {}
+            for date, order, _, value in sorted(events, key=lambda event: event[:3]):
+                if order == 1:
+                    active_pad = (date, value)
+                    padded = set()
+                    continue
+                _, _, expected, currency, tolerance, _ = value
+                if active_pad is None or currency in padded:
+                    continue
+                balance = self._get_balance(series, account, currency, date)
+                if balance is None:
+                    continue
+                difference = Decimal(expected) - balance - totals.get(currency, Decimal())
+                if abs(difference) > Decimal(tolerance):
+                    padded.add(currency)
+                    totals[currency] = totals.get(currency, Decimal()) + difference
+                    paddings.append((active_pad[0], account, active_pad[1], currency, difference))
+
+        # Каждый счет дополняется по исходным проводкам, без дополнений других счетов
+        for date, account, source_account, currency, difference in paddings:
+            for key, number in ((account, difference), (source_account, -difference)):
+                numbers = series.setdefault((key, currency), {})
+                numbers[date] = numbers.get(date, Decimal()) + number
+
+
+    def _check_balances(self):
+        # Баланс на начало дня утверждения по счету и всем его подсчетам
+        series = {}
+        for summary in self.files.values():
+            for key, number in summary['deltas'].items():
+                account, currency, date = key.split('\0')
+                series.setdefault((account, currency), {})
+                series[(account, currency)][date] = series[(account, currency)].get(date, Decimal()) + Decimal(number)
+
+        self._apply_pads(series)
+
+        cumulative = {}
+        for key, numbers in series.items():
+            dates = sorted(numbers)
+            totals = []
+            total = Decimal()
+            for date in dates:
+                total += numbers[date]
+                totals.append(total)
+            cumulative[key] = (dates, totals)
+
+        unknown = {}
+        for (account, currency), (dates, _) in cumulative.items():
+            if currency == self.UNKNOWN_CURRENCY:
+                unknown[account] = dates[0]
+
+        errors = []
+        for filename, summary in self.files.items():
+            for account, date, expected, currency, tolerance, lineno in summary['assertions']:
+                if any(unknown_date < date and (unknown_account == account or unknown_account.startswith(account + ':'))
+                       for unknown_account, unknown_date in unknown.items()):
+                    continue
+                balance = Decimal()
+                for (series_account, series_currency), (dates, totals) in cumulative.items():
+                    if series_currency != currency:
+                        continue
+                    if series_account != account and not series_account.startswith(account + ':'):
+                        continue
+                    position = bisect_left(dates, date)
+                    if position > 0:
+                        balance += totals[position - 1]
+                difference = balance - Decimal(expected)
+                if abs(difference) > Decimal(tolerance):
+                    message = (f"Balance failed for '{account}': expected {expected} {currency} "
+                               f"!= accumulated {balance} {currency} ({abs(difference)} too {'much' if difference > 0 else 'little'})")
+                    errors.append([filename, lineno, self.ERROR_BALANCE, message])
+        return errors
+
+
+    def _scan(self, cached_files):
+        # Изменения определяются по stat, хеш считается только для измененных файлов
+        changed = {}
+        for path_object in sorted(self.journal.get_beancount_files()):
+            filename = str(path_object)
+            stat = path_object.stat()
+            summary = cached_files.get(filename)
+            if summary is not None and summary['size'] == stat.st_size and summary['mtime_ns'] == stat.st_mtime_ns:
+                self.files[filename] = summary
+                continue
+            content_hash = self._hash_file(path_object)
+            if summary is not None and summary['hash'] == content_hash:
+                summary['size'], summary['mtime_ns'] = stat.st_size, stat.st_mtime_ns
+                self.files[filename] = summary
+                continue
+            parse_result = self._parse(path_object, content_hash)
+            self.files[filename] = self._summarize(stat, content_hash, parse_result)
+            changed[filename] = parse_result
+        return changed
+
+
+    def _find_dependents(self, cache, declarations, commodities, asserted):
+        # Файлы, ссылающиеся на счета и валюты, объявления которых изменились
+        old_declarations = cache['declarations'] if cache else {}
+        changed_accounts = {
+            account for account in declarations.keys() | old_declarations.keys()
+            if declarations.get(account) != old_declarations.get(account)
+        }
+        old_commodities = set(cache['commodities']) if cache else set()
+        changed_commodities = commodities ^ old_commodities
+        changed_asserted = asserted ^ (set(cache['asserted']) if cache else set())
+
+        dependents = []
+        for filename, summary in self.files.items():
+            if 'errors' not in summary:
+                continue
+            if changed_accounts.intersection(summary['accounts']) \
+                    or changed_commodities.intersection(summary['currencies']) \
+                    or any(self._is_asserted(account, changed_asserted) for account in summary['accounts']):
+                dependents.append(filename)
+        return dependents
+
+
+    def run(self):
+        # [(filename, lineno, code, message), ...] по всему журналу
+        cache = self._read_cache()
+        with span('check.scan') as args:
+            changed = self._scan(cache['files'] if cache else {})
+            args['files'] = len(self.files)
+            args['changed'] = len(changed)
+
+        declarations, errors = self._collect_declarations()
+        commodities = {commodity for summary in self.files.values() for commodity in summary['commodities']}
+        asserted = {assertion[0] for summary in self.files.values() for assertion in summary['assertions']}
+
+        with span('check.files') as args:
+            for filename in self._find_dependents(cache, declarations, commodities, asserted):
+                changed[filename] = self._parse(Path(filename), self.files[filename]['hash'])
+            for filename, parse_result in changed.items():
+                self._check_file(self.files[filename], parse_result, declarations, commodities, asserted)
+            args['checked'] = self.checked_files_count
+
+        for filename, summary in self.files.items():
+            errors.extend([filename, *error] for error in summary['errors'])
+        if asserted:
+            errors.extend(self._check_balances())
+        # Шаблоны уже скомпилированы индексом журнала -- здесь только их ошибки
+        errors.extend([filename, 1, self.ERROR_TEMPLATE, message] for filename, message in self.journal.templates.get_errors())
+
+        self._write_cache(declarations, commodities, asserted)
+        errors.sort(key=lambda error: (error[0], error[1]))
+        return errors
@@ -2,13 +2,18 @@ from click.shell_completion import CompletionItem
 from datetime import datetime, date
 from click import ParamType, echo
 from calendar import monthrange
+from pathlib import Path
 from sys import exit
 
-from moneyctl.journal import Journal, JournalException, AccountStatus
-from moneyctl.beancount_wrapper import BeancountWrapper
+from moneyctl.journal import Journal, JournalException, JournalWriter, AccountStatus
 from moneyctl.report import Report, ReportException
+from moneyctl.importer import TransactionImporter
+from moneyctl.trace import Tracer, tracer
 
+import os
+import sys
 import click
+import signal
 
 
 ### Constants =================================================================
@@ -19,14 +24,39 @@ MIN_MONTH = 1
 MAX_MONTH = 12
 DEFAULT_ERROR_CODE = 1
 UNKNOWN_ERROR_CODE = 200
+LOADER_MODES = ['string', 'incremental', 'parallel'] # LedgerLoader.MODES без импорта beancount
+LOADER_MODE_DEFAULT = 'incremental'
+REPORT_ENGINES = ['native', 'bql'] # BeancountWrapper.ENGINES без импорта pandas
+REPORT_ENGINE_DEFAULT = 'native'
+REPORT_PERIODS = ['month', 'quarter', 'year'] # BeancountWrapper.PERIODS без импорта pandas
+PORTFOLIO_LEVELS = ['lot', 'holding', 'group'] # PortfolioEngine.LEVELS без импорта pandas
+PORTFOLIO_LEVEL_DEFAULT = 'holding'
+NETWORTH_STEPS = ['day', 'week', 'month'] # BeancountWrapper.STEPS без импорта pandas
+NETWORTH_STEP_DEFAULT = 'day'
+PRICES_SOURCES = ['investing', 'http'] # PriceDownloader.SOURCES без импорта beancount
+PRICES_SOURCE_DEFAULT = 'investing'
 
 
 ### CLI Entrypoint ------------------------------------------------------------
 
 @click.group()
+@click.option('--profile', is_flag=True, default=False, help='Write per-phase timing trace (JSON) to stderr')
+@click.option('--profile-output', 'profile_output', type=click.Path(dir_okay=False, path_type=Path), help='Write timing trace to file instead of stderr')
+@click.option('--pstats', 'pstats_file', type=click.Path(dir_okay=False, path_type=Path), help='Dump cProfile statistics to file')
 @click.pass_context
-def cli(ctx):
-    pass
+def cli(ctx, profile, profile_output, pstats_file):
+    # Без флагов трасса включается переменными MONEYCTL_TRACE и MONEYCTL_PSTATS
+    if profile_output:
+        output = str(profile_output)
+    elif profile:
+        output = Tracer.OUTPUT_STDERR
+    else:
+        output = Tracer.get_env_output()
+    pstats_file = pstats_file or Tracer.get_env_pstats_file()
+
+    if output or pstats_file:
+        tracer.start(output=output, pstats_file=pstats_file)
+        ctx.call_on_close(tracer.stop)
 
 
 ### CLI Exception -------------------------------------------------------------
@@ -42,10 +72,10 @@ class TransactionTemplateVarType(ParamType):
     name = "template"
     def shell_complete(self, ctx, param, incomplete):
         journal = Journal()
-        templates = journal.get_templates_names()
+        templates = journal.complete_templates_names(incomplete)
         return [
             CompletionItem(template)
-            for template in templates if template.startswith(incomplete)
+            for template in templates
         ]
 
 
@@ -55,10 +85,12 @@ class AccountVarType(ParamType):
     name = "account"
     def shell_complete(self, ctx, param, incomplete):
         journal = Journal()
-        accounts = journal.get_accounts_names(status=AccountStatus.OPEN)
+        # Счета, открытые на дату транзакции (-d), если она уже указана
+        date = ctx.params.get('date') or datetime.now()
+        accounts = journal.complete_accounts_names(incomplete, status=AccountStatus.OPEN, date=date)
         return [
             CompletionItem(account)
-            for account in accounts if account.startswith(incomplete)
+            for account in accounts
         ]
 
 
@@ -77,10 +109,12 @@ class ReportFormatVarType(ParamType):
 # Subcommand Group: Transaction ===============================================
 
 @cli.group()
+@click.option('--fsync', 'fsync', type=click.Choice(JournalWriter.FSYNC_POLICIES), help='Set journal writes durability (MONEYCTL_FSYNC or "normal" if not set)')
 @click.pass_context
-def transaction(ctx):
+def transaction(ctx, fsync):
     """Transaction subcommands"""
-    pass
+    ctx.ensure_object(dict)
+    ctx.obj['fsync'] = fsync
 
 
 ### Transaction Command: Add --------------------------------------------------
@@ -98,6 +132,10 @@ def add(ctx, template, from_, to, date, amount, comment, edit):
     '''Add transaction to journal'''
     try:
         journal = Journal()
+        journal.writer.set(fsync=ctx.obj['fsync'])
+        if template:
+            for warning in journal.templates.gen_warnings(skipped=template):
+                echo(warning, err=True)
         transaction = journal.new_transaction()
 
         transaction.set(date=date,
@@ -128,6 +166,39 @@ def add(ctx, template, from_, to, date, amount, comment, edit):
         echo(f"Unknown Error: {e}", err=True)
         exit(UNKNOWN_ERROR_CODE)
 
+
+### Transaction Command: Import -----------------------------------------------
+
+@transaction.command(name='import')
+@click.argument('file', type=click.File('r', encoding='utf-8'), default='-')
+@click.option('--format', 'format', type=click.Choice(TransactionImporter.FORMATS), help='Set input rows format (by file extension if not set)')
+@click.option('-T', '--template', 'template', type=TransactionTemplateVarType(), help='Use template for rows without one')
+@click.option('--dedup/--no-dedup', default=True, help='Skip rows already present in journal')
+@click.option('-n', '--dry-run', is_flag=True, default=False, help='Validate rows without writing to journal')
+@click.pass_context
+def import_(ctx, file, format, template, dedup, dry_run):
+    '''Import transactions from CSV or NDJSON file (or stdin)'''
+    try:
+        if format is None:
+            is_ndjson = file.name.endswith(('.ndjson', '.jsonl'))
+            format = TransactionImporter.FORMAT_NDJSON if is_ndjson else TransactionImporter.FORMAT_CSV
+
+        journal = Journal()
+        journal.writer.set(fsync=ctx.obj['fsync'])
+        for warning in journal.templates.gen_warnings():
+            echo(warning, err=True)
+        importer = TransactionImporter(journal, default_template=template, deduplicate=dedup)
+        importer.run(file, format=format, dry_run=dry_run)
+        echo(f"Imported {importer.imported_count} transactions, skipped {importer.skipped_count} duplicates", err=True)
+
+    except (JournalException, CliException) as e:
+        echo(f"Error: {e}", err=True)
+        exit(DEFAULT_ERROR_CODE)
+
+    except BaseException as e:
+        echo(f"Unknown Error: {e}", err=True)
+        exit(UNKNOWN_ERROR_CODE)
+
 # TODO Transaction Subcommand: edit
 # TODO Transaction Subcommand: print
 
@@ -135,27 +206,58 @@ def add(ctx, template, from_, to, date, amount, comment, edit):
 # Subcommand Group: Report ====================================================
 
 @cli.group()
-@click.option('--format', 'format', default=Report().get_default_format_name(), type=ReportFormatVarType(), help="Set report output format")
+@click.option('--format', 'format', default=Report.FORMAT_DEFAULT, type=ReportFormatVarType(), help="Set report output format")
 @click.option('--rounding/--no-rounding', default=True, help='Display numbers without rounding')
+@click.option('--cache/--no-cache', default=True, help='Use on-disk cache of loaded journal')
+@click.option('--loader', 'loader_mode', type=click.Choice(LOADER_MODES), default=LOADER_MODE_DEFAULT, help='Set journal loading mode')
+@click.option('-j', '--workers', 'loader_workers', type=click.IntRange(min=1), help='Set parallel loader processes (CPU count if not set)')
+@click.option('--engine', 'engine', type=click.Choice(REPORT_ENGINES), default=REPORT_ENGINE_DEFAULT, help='Set report computation engine')
+@click.option('--currency', 'currency', help='Set reports valuation currency (any commodity with prices, RUB if not set)')
 @click.pass_context
-def report(ctx, format, rounding):
+def report(ctx, format, rounding, cache, loader_mode, loader_workers, engine, currency):
     """Report subcommands"""
     ctx.ensure_object(dict)
     ctx.obj['format'] = format
     ctx.obj['rounding'] = rounding
+    ctx.obj['cache'] = cache
+    ctx.obj['loader_mode'] = loader_mode
+    ctx.obj['loader_workers'] = loader_workers
+    ctx.obj['engine'] = engine
+    ctx.obj['currency'] = currency.upper() if currency else None
+
+
+def load_beancount_wrapper(ctx):
+    # beancount и pandas импортируются только для отчетов
+    with tracer.span('cli.import'):
+        from moneyctl.beancount_wrapper import BeancountWrapper
+        from moneyctl.loader import LedgerLoader
+
+    # Журнал, уже загруженный в память сервером (moneyctl serve)
+    ledger = ctx.obj.get('ledger')
+    if ledger is not None:
+        LedgerLoader.log_errors(ledger[1])
+        return BeancountWrapper(ledger=ledger, engine=ctx.obj['engine'], currency=ctx.obj['currency'])
+
+    return BeancountWrapper(journal=Journal(),
+                            cache=ctx.obj['cache'],
+                            loader_mode=ctx.obj['loader_mode'],
+                            loader_workers=ctx.obj['loader_workers'],
+                            engine=ctx.obj['engine'],
+                            currency=ctx.obj['currency'])
 
 
 ### Report Command: Assets ----------------------------------------------------
 
 @report.command()
 @click.option('--empty-accounts/--no-empty-accounts', default=False, help='Display accounts with low amounts')
+@click.option('--on', 'on_date', type=click.DateTime(formats=['%Y-%m-%d']), help='Display balances at the end of date')
 @click.pass_context
-def assets(ctx, empty_accounts):
+def assets(ctx, empty_accounts, on_date):
     """Print current assets report"""
     try:
-        beancount_string = Journal().to_beancount_string()
-        beancount_wrapper = BeancountWrapper(beancount_string)
-        report = beancount_wrapper.assets_report(empty_accounts=empty_accounts, total=True)
+        beancount_wrapper = load_beancount_wrapper(ctx)
+        report = beancount_wrapper.assets_report(empty_accounts=empty_accounts, total=True,
+                                                 on_date=on_date.date() if on_date else None)
         report.set(format=ctx.obj['format'], rounding=ctx.obj['rounding'])
         report.print()
 
@@ -216,15 +318,15 @@ def args_to_timerange(from_, to, year, month) -> date:
 @click.option('-t', '--to', 'to', type=click.DateTime(formats=['%Y-%m-%d']), help='Set time range ending')
 @click.option('-y', '--year', 'year', type=click.IntRange(min=MIN_YEAR, max=MAX_YEAR), help='Set yearly time range')
 @click.option('-m', '--month', 'month', type=click.IntRange(min=MIN_MONTH, max=MAX_MONTH), help='Set monthly time range')
+@click.option('--by', 'by', type=click.Choice(REPORT_PERIODS), help='Split time range into periods columns')
 @click.pass_context
-def expenses(ctx, from_, to, year, month):
+def expenses(ctx, from_, to, year, month, by):
     '''Print expenses report'''
     try:
         f, t = args_to_timerange(from_, to, year, month)
 
-        beancount_string = Journal().to_beancount_string()
-        beancount_wrapper = BeancountWrapper(beancount_string)
-        report = beancount_wrapper.expenses_report(from_=f, to=t, total=True)
+        beancount_wrapper = load_beancount_wrapper(ctx)
+        report = beancount_wrapper.expenses_report(from_=f, to=t, total=True, by=by)
         report.set(format=ctx.obj['format'], rounding=ctx.obj['rounding'])
         report.print()
 
@@ -244,15 +346,15 @@ def expenses(ctx, from_, to, year, month):
 @click.option('-t', '--to', 'to', type=click.DateTime(formats=['%Y-%m-%d']), help='Set time range ending')
 @click.option('-y', '--year', 'year', type=click.IntRange(min=MIN_YEAR, max=MAX_YEAR), help='Set yearly time range')
 @click.option('-m', '--month', 'month', type=click.IntRange(min=MIN_MONTH, max=MAX_MONTH), help='Set monthly time range')
+@click.option('--by', 'by', type=click.Choice(REPORT_PERIODS), help='Split time range into periods columns')
 @click.pass_context
-def income(ctx, from_, to, year, month):
+def income(ctx, from_, to, year, month, by):
     '''Print income report'''
     try:
         f, t = args_to_timerange(from_, to, year, month)
 
-        beancount_string = Journal().to_beancount_string()
-        beancount_wrapper = BeancountWrapper(beancount_string)
-        report = beancount_wrapper.income_report(from_=f, to=t, total=True)
+        beancount_wrapper = load_beancount_wrapper(ctx)
+        report = beancount_wrapper.income_report(from_=f, to=t, total=True, by=by)
         report.set(format=ctx.obj['format'], rounding=ctx.obj['rounding'])
         report.print()
 
@@ -272,8 +374,7 @@ def income(ctx, from_, to, year, month):
 def invest_cash(ctx):
     '''Print investments cash assets report'''
     try:
-        beancount_string = Journal().to_beancount_string()
-        beancount_wrapper = BeancountWrapper(beancount_string)
+        beancount_wrapper = load_beancount_wrapper(ctx)
         report = beancount_wrapper.invest_cash_report(total=True)
         report.set(format=ctx.obj['format'], rounding=ctx.obj['rounding'])
         report.print()
@@ -293,8 +394,7 @@ def invest_cash(ctx):
 def invest_parts(ctx):
     '''Print investments assets distribution report'''
     try:
-        beancount_string = Journal().to_beancount_string()
-        beancount_wrapper = BeancountWrapper(beancount_string)
+        beancount_wrapper = load_beancount_wrapper(ctx)
         report = beancount_wrapper.invest_parts_report(total=True)
         report.set(format=ctx.obj['format'], rounding=ctx.obj['rounding'])
         report.print()
@@ -307,4 +407,251 @@ def invest_parts(ctx):
         echo(f"Unknown Error: {e}", err=True)
         exit(UNKNOWN_ERROR_CODE)
 
-### TODO download-prices
+### Report Command: Portfolio ------------------------------------------------
+
+@report.command()
+@click.option('--by', 'by', type=click.Choice(PORTFOLIO_LEVELS), default=PORTFOLIO_LEVEL_DEFAULT, help='Split portfolio by lots, holdings or configured groups')
+@click.option('--on', 'on_date', type=click.DateTime(formats=['%Y-%m-%d']), help='Value portfolio at the end of date')
+@click.pass_context
+def portfolio(ctx, by, on_date):
+    '''Print investments portfolio with cost basis and unrealized P&L'''
+    try:
+        beancount_wrapper = load_beancount_wrapper(ctx)
+        report = beancount_wrapper.portfolio_report(level=by, on_date=on_date.date() if on_date else None)
+        report.set(format=ctx.obj['format'], rounding=ctx.obj['rounding'])
+        report.print()
+
+    except (JournalException, CliException, ReportException) as e:
+        echo(f"Error: {e}", err=True)
+        exit(DEFAULT_ERROR_CODE)
+
+    except BaseException as e:
+        echo(f"Unknown Error: {e}", err=True)
+        exit(UNKNOWN_ERROR_CODE)
+
+### Report Command: Net Worth ------------------------------------------------
+
+@report.command()
+@click.option('-f', '--from', 'from_', type=click.DateTime(formats=['%Y-%m-%d']), help='Set time range beginning (first transaction if not set)')
+@click.option('-t', '--to', 'to', type=click.DateTime(formats=['%Y-%m-%d']), help='Set time range ending (today if not set)')
+@click.option('--step', 'step', type=click.Choice(NETWORTH_STEPS), default=NETWORTH_STEP_DEFAULT, help='Set series points interval')
+@click.pass_context
+def networth(ctx, from_, to, step):
+    '''Print net worth series (assets and liabilities) at the end of each step'''
+    try:
+        beancount_wrapper = load_beancount_wrapper(ctx)
+        report = beancount_wrapper.networth_report(from_=from_.date() if from_ else None,
+                                                   to=to.date() if to else None,
+                                                   step=step)
+        report.set(format=ctx.obj['format'], rounding=ctx.obj['rounding'])
+        report.print()
+
+    except (JournalException, CliException, ReportException) as e:
+        echo(f"Error: {e}", err=True)
+        exit(DEFAULT_ERROR_CODE)
+
+    except BaseException as e:
+        echo(f"Unknown Error: {e}", err=True)
+        exit(UNKNOWN_ERROR_CODE)
+
+### Report Command: Dashboard ------------------------------------------------
+
+@report.command()
+@click.option('-f', '--from', 'from_', type=click.DateTime(formats=['%Y-%m-%d']), help='Set time range beginning')
+@click.option('-t', '--to', 'to', type=click.DateTime(formats=['%Y-%m-%d']), help='Set time range ending')
+@click.option('-y', '--year', 'year', type=click.IntRange(min=MIN_YEAR, max=MAX_YEAR), help='Set yearly time range')
+@click.option('-m', '--month', 'month', type=click.IntRange(min=MIN_MONTH, max=MAX_MONTH), help='Set monthly time range')
+@click.option('--empty-accounts/--no-empty-accounts', default=False, help='Display accounts with low amounts')
+@click.option('-o', '--output-dir', 'output_dir', type=click.Path(file_okay=False, path_type=Path), help='Write each report to separate file in directory')
+@click.pass_context
+def dashboard(ctx, from_, to, year, month, empty_accounts, output_dir):
+    '''Print all reports from single journal load'''
+    try:
+        f, t = args_to_timerange(from_, to, year, month)
+
+        beancount_wrapper = load_beancount_wrapper(ctx)
+        reports = beancount_wrapper.dashboard_reports(from_=f, to=t, empty_accounts=empty_accounts, total=True)
+
+        if output_dir is not None:
+            output_dir.mkdir(parents=True, exist_ok=True)
+
+        for name, report in reports.items():
+            report.set(format=ctx.obj['format'], rounding=ctx.obj['rounding'])
+            if output_dir is None:
+                report.set(title=name.upper().replace('-', ' '))
+                report.print()
+                continue
+            filepath = output_dir / f"{name}.{report.get_format_extension()}"
+            with open(filepath, 'w') as file_object:
+                report.set(file=file_object)
+                report.print()
+
+    except (JournalException, CliException, ReportException) as e:
+        echo(f"Error: {e}", err=True)
+        exit(DEFAULT_ERROR_CODE)
+
+    except BaseException as e:
+        echo(f"Unknown Error: {e}", err=True)
+        exit(UNKNOWN_ERROR_CODE)
+
+
+### Report Command: Register --------------------------------------------------
+
+@report.command()
+@click.option('-a', '--account', 'account', required=True, help='Set accounts regular expression')
+@click.option('-f', '--from', 'from_', type=click.DateTime(formats=['%Y-%m-%d']), help='Set time range beginning')
+@click.option('-t', '--to', 'to', type=click.DateTime(formats=['%Y-%m-%d']), help='Set time range ending')
+@click.pass_context
+def register(ctx, account, from_, to):
+    '''Print postings of accounts with running balance'''
+    try:
+        beancount_wrapper = load_beancount_wrapper(ctx)
+        report = beancount_wrapper.register_report(account_pattern=account,
+                                                   from_=from_.date() if from_ else None,
+                                                   to=to.date() if to else None)
+        report.set(format=ctx.obj['format'], rounding=ctx.obj['rounding'])
+        report.print()
+
+    except BrokenPipeError:
+        # Вывод оборван (например, | head) -- это не ошибка
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        exit(0)
+
+    except (JournalException, CliException, ReportException) as e:
+        echo(f"Error: {e}", err=True)
+        exit(DEFAULT_ERROR_CODE)
+
+    except BaseException as e:
+        echo(f"Unknown Error: {e}", err=True)
+        exit(UNKNOWN_ERROR_CODE)
+
+
+# Command: Query =============================================================
+
+@cli.command()
+@click.argument('sql')
+@click.option('--format', 'format', default=Report.FORMAT_DEFAULT, type=ReportFormatVarType(), help="Set query output format")
+@click.option('--rounding/--no-rounding', default=True, help='Display numbers without rounding')
+@click.pass_context
+def query(ctx, sql, format, rounding):
+    '''Run SQL query against journal mirror (tables: entries, postings, prices, accounts)'''
+    try:
+        from moneyctl.mirror import LedgerMirror
+
+        mirror = LedgerMirror(Journal())
+        mirror.sync(ledger=ctx.obj.get('ledger') if ctx.obj else None)
+        report = mirror.query(sql)
+        report.set(format=format, rounding=rounding)
+        report.print()
+
+    except (JournalException, CliException, ReportException) as e:
+        echo(f"Error: {e}", err=True)
+        exit(DEFAULT_ERROR_CODE)
+
+    except BaseException as e:
+        echo(f"Unknown Error: {e}", err=True)
+        exit(UNKNOWN_ERROR_CODE)
+
+
+# Command: Check =============================================================
+
+@cli.command()
+@click.option('--cache/--no-cache', default=True, help='Re-check only changed files and their dependents')
+@click.pass_context
+def check(ctx, cache):
+    '''Validate journal (balances, accounts, commodities, open/close dates, templates)'''
+    try:
+        from moneyctl.checker import JournalChecker, CheckException
+
+        journal = Journal()
+        checker = JournalChecker(journal, cache=cache)
+        errors = checker.run()
+        for filename, lineno, code, message in errors:
+            echo(f'{os.path.relpath(filename, journal.root_dir)}:{lineno}: {message} [{code}]')
+        echo(f'{len(errors)} errors, {len(checker.files)} files ({checker.checked_files_count} checked)', err=True)
+
+    except (JournalException, CliException, CheckException) as e:
+        echo(f"Error: {e}", err=True)
+        exit(DEFAULT_ERROR_CODE)
+
+    except BaseException as e:
+        echo(f"Unknown Error: {e}", err=True)
+        exit(UNKNOWN_ERROR_CODE)
+
+    if errors:
+        exit(DEFAULT_ERROR_CODE)
+
+
+# Command: Serve =============================================================
+
+@cli.command()
+@click.option('--poll-interval', 'poll_interval', type=click.FloatRange(min=0.1), default=1.0, help='Set journal changes polling interval in seconds')
+@click.pass_context
+def serve(ctx, poll_interval):
+    '''Serve reports and completion from resident process'''
+    from moneyctl.server import Server, ServerException
+
+    # SIGTERM завершает сервер так же, как Ctrl+C -- с удалением сокета
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server = Server(Journal(), poll_interval=poll_interval)
+        echo(f"Serving on {server.socket_file}", err=True)
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    except (JournalException, ServerException) as e:
+        echo(f"Error: {e}", err=True)
+        exit(DEFAULT_ERROR_CODE)
+
+    except BaseException as e:
+        echo(f"Unknown Error: {e}", err=True)
+        exit(UNKNOWN_ERROR_CODE)
+
+# Subcommand Group: Prices ====================================================
+
+@cli.group()
+@click.pass_context
+def prices(ctx):
+    """Prices subcommands"""
+    ctx.ensure_object(dict)
+
+
+### Prices Command: Fetch -----------------------------------------------------
+
+@prices.command()
+@click.option('--source', 'source', type=click.Choice(PRICES_SOURCES), default=PRICES_SOURCE_DEFAULT, help='Set prices source')
+@click.option('--url', 'url', help='Set prices server url (for "http" source)')
+@click.option('--quote', 'quote', default='RUB', help='Set quote currency')
+@click.option('-j', '--workers', 'workers', type=click.IntRange(min=1), default=4, help='Set number of concurrent requests')
+@click.option('--rate-limit', 'rate_limit', type=click.FloatRange(min=0), default=2.0, help='Set maximum requests per second (0 -- unlimited)')
+@click.option('--max-gap', 'max_gap', type=click.IntRange(min=1), default=5, help='Set days without prices treated as missing range')
+@click.option('--cache/--no-cache', default=True, help='Use on-disk cache of source responses')
+@click.option('-n', '--dry-run', is_flag=True, default=False, help='Print missing ranges without fetching')
+@click.pass_context
+def fetch(ctx, source, url, quote, workers, rate_limit, max_gap, cache, dry_run):
+    '''Fetch missing prices of held commodities'''
+    try:
+        from moneyctl.prices import PriceDownloader, PricesException
+
+        fetcher = PriceDownloader.create_fetcher(source, url=url)
+        downloader = PriceDownloader(Journal(), fetcher, quote=quote, workers=workers,
+                                     rate_limit=rate_limit, cache=cache, max_gap=max_gap)
+        gaps = downloader.run(dry_run=dry_run)
+
+        if dry_run:
+            for commodity, symbol, from_, to in gaps:
+                echo(f"{commodity}\t{from_}\t{to}")
+            return
+        echo(f"Fetched {downloader.fetched_count} prices in {len(gaps)} ranges "
+             f"({downloader.requests_count} requests)", err=True)
+
+    except (JournalException, CliException, PricesException) as e:
+        echo(f"Error: {e}", err=True)
+        exit(DEFAULT_ERROR_CODE)
+
+    except BaseException as e:
+        echo(f"Unknown Error: {e}", err=True)
+        exit(UNKNOWN_ERROR_CODE)
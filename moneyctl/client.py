@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+import base64
+import socket
+from pathlib import Path
+
+from moneyctl.journal import Journal
+from moneyctl.trace import Tracer
+
+
+# Classes =====================================================================
+
+### Client Class --------------------------------------------------------------
+
+class Client:
+
+    COMPLETE_VAR = '_MONEYCTL_COMPLETE'
+    DAEMON_VAR = 'MONEYCTL_DAEMON'
+
+    # Окружение, от которого зависит вывод click и rich
+    FORWARDED_ENV = [
+        '_MONEYCTL_COMPLETE', 'COMP_WORDS', 'COMP_CWORD',
+        'TERM', 'COLORTERM', 'NO_COLOR', 'FORCE_COLOR',
+        'TTY_COMPATIBLE', 'TTY_INTERACTIVE', 'COLUMNS', 'LINES',
+    ]
+    FORWARDED_COMMANDS = ['report', 'query']
+    # Потоковый вывод: сервер накопил бы его целиком в памяти
+    LOCAL_SUBCOMMANDS = ['register']
+
+    CONNECT_TIMEOUT = 1.0
+    DEFAULT_TERMINAL_SIZE = (80, 25)
+    BUFFER_SIZE = 65536
+
+    def __init__(self, socket_file=None):
+        self.socket_file = socket_file
+
+
+    def _get_socket_file(self):
+        # Без Journal(): проверка каталога журнала -- дело команды, а не клиента
+        if self.socket_file is None:
+            self.socket_file = Path(Journal.STATE_DIR_NAME) / Journal.SOCKET_FILE_NAME
+        return self.socket_file
+
+
+    def _is_forwardable(self, argv):
+        if os.environ.get(self.DAEMON_VAR) == '0':
+            return False
+        # Обертка fish передает переменную всегда, вне дополнения -- пустой
+        if os.environ.get(self.COMPLETE_VAR):
+            return True
+        if any(arg in self.LOCAL_SUBCOMMANDS for arg in argv):
+            return False
+        # Трасса нужна по процессу, который выполняет команду
+        if Tracer.is_requested(argv):
+            return False
+        return len(argv) > 0 and argv[0] in self.FORWARDED_COMMANDS
+
+
+    def _get_terminal_size(self):
+        # Так же, как rich: первый из stdin/stdout/stderr, который является терминалом
+        for file_descriptor in (0, 1, 2):
+            try:
+                width, height = os.get_terminal_size(file_descriptor)
+            except (AttributeError, ValueError, OSError):
+                continue
+            return width or self.DEFAULT_TERMINAL_SIZE[0], height or self.DEFAULT_TERMINAL_SIZE[1]
+        return self.DEFAULT_TERMINAL_SIZE
+
+
+    def _gen_env(self):
+        env = {key: os.environ[key] for key in self.FORWARDED_ENV if key in os.environ}
+        width, height = self._get_terminal_size()
+        env.setdefault('COLUMNS', str(width))
+        env.setdefault('LINES', str(height))
+        if sys.stdout.isatty():
+            env.setdefault('FORCE_COLOR', '1')
+        return env
+
+
+    def _request(self, request):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(self.CONNECT_TIMEOUT)
+            connection.connect(str(self._get_socket_file()))
+            connection.settimeout(None)
+            connection.sendall(json.dumps(request).encode() + b'\n')
+            connection.shutdown(socket.SHUT_WR)
+            chunks = []
+            while True:
+                chunk = connection.recv(self.BUFFER_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return json.loads(b''.join(chunks))
+
+
+    def forward(self, argv):
+        if not self._is_forwardable(argv):
+            return None
+
+        request = {
+            'argv': argv,
+            'env': self._gen_env(),
+            'streams': {
+                'stdout': {'encoding': sys.stdout.encoding, 'errors': sys.stdout.errors},
+                'stderr': {'encoding': sys.stderr.encoding, 'errors': sys.stderr.errors},
+            },
+        }
+        try:
+            response = self._request(request)
+        except (OSError, ValueError):
+            # Сервер не запущен или недоступен -- выполняем команду в процессе
+            return None
+
+        sys.stdout.buffer.write(base64.b64decode(response['stdout']))
+        sys.stdout.flush()
+        sys.stderr.buffer.write(base64.b64decode(response['stderr']))
+        sys.stderr.flush()
+        return response['code']
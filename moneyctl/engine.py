@@ -0,0 +1,533 @@
+import re
+import datetime
+from decimal import Decimal, InvalidOperation
+
+import numpy as np
+import pandas as pd
+from beancount.core import data
+
+from moneyctl.report import ReportException
+from moneyctl.price_index import PriceIndex
+
+
+# Classes =====================================================================
+
+class EngineException(ReportException):
+    def __init__(self, message=None):
+        super().__init__(message)
+
+
+### Postings Table Class ------------------------------------------------------
+
+class PostingsTable:
+
+    MAX_SCALE = 18
+    NO_CURRENCY = -1
+    NO_LOT = -1
+
+    def __init__(self, entries):
+        self.accounts = []
+        self.currencies = []
+        # Лоты -- стоимости beancount (number, currency, date, label) проводок с {}
+        self.lots = []
+        self._accounts_ids = {}
+        self._currencies_ids = {}
+        self._lots_ids = {}
+
+        dates = []
+        accounts = []
+        currencies = []
+        cost_currencies = []
+        lots = []
+        numbers = []
+
+        # Единственный проход по объектам beancount -- дальше только массивы
+        for entry in entries:
+            if not isinstance(entry, data.Transaction):
+                continue
+            date = entry.date.toordinal()
+            for posting in entry.postings:
+                units = posting.units
+                if units is None or not isinstance(units.number, Decimal):
+                    continue
+                cost = posting.cost
+                dates.append(date)
+                accounts.append(self._intern_account(posting.account))
+                currencies.append(self._intern_currency(units.currency))
+                cost_currencies.append(
+                    self._intern_currency(cost.currency)
+                    if cost is not None and cost.currency else self.NO_CURRENCY)
+                lots.append(self._intern_lot(cost) if cost is not None else self.NO_LOT)
+                numbers.append(units.number)
+
+        exponents = [number.as_tuple().exponent for number in numbers]
+        self.scale = max([-exponent for exponent in exponents] + [0])
+        if self.scale > self.MAX_SCALE:
+            message = f'Postings need {self.scale} fractional digits, native engine supports {self.MAX_SCALE}'
+            raise EngineException(message)
+
+        self.date = np.array(dates, dtype=np.int64)
+        self.account = np.array(accounts, dtype=np.int32)
+        self.currency = np.array(currencies, dtype=np.int32)
+        self.cost_currency = np.array(cost_currencies, dtype=np.int32)
+        self.lot = np.array(lots, dtype=np.int32)
+        self.exponent = np.array(exponents, dtype=np.int32)
+        try:
+            self.number = np.array([int(number.scaleb(self.scale)) for number in numbers], dtype=np.int64)
+        except OverflowError:
+            message = 'Posting amounts are too large for native engine'
+            raise EngineException(message)
+
+
+    def _intern_account(self, account):
+        if account not in self._accounts_ids:
+            self._accounts_ids[account] = len(self.accounts)
+            self.accounts.append(account)
+        return self._accounts_ids[account]
+
+
+    def _intern_currency(self, currency):
+        if currency not in self._currencies_ids:
+            self._currencies_ids[currency] = len(self.currencies)
+            self.currencies.append(currency)
+        return self._currencies_ids[currency]
+
+
+    def _intern_lot(self, cost):
+        if cost not in self._lots_ids:
+            self._lots_ids[cost] = len(self.lots)
+            self.lots.append(cost)
+        return self._lots_ids[cost]
+
+
+    def get_currency_id(self, currency):
+        return self._currencies_ids.get(currency, self.NO_CURRENCY)
+
+
+    def get_account_id(self, account):
+        return self._accounts_ids.get(account, -1)
+
+
+    def match_accounts_ids(self, pattern):
+        # Маска по id счетов (а не по проводкам)
+        regex = re.compile(pattern, re.IGNORECASE)
+        return np.array([bool(regex.search(account)) for account in self.accounts], dtype=bool)
+
+
+    def match_accounts(self, pattern):
+        # Как оператор ~ в BQL: re.search без учета регистра
+        matched = self.match_accounts_ids(pattern)
+        if len(matched) == 0:
+            return np.zeros(len(self.account), dtype=bool)
+        return matched[self.account]
+
+
+    def to_decimal(self, scaled_number):
+        return Decimal(int(scaled_number)).scaleb(-self.scale)
+
+
+    def __len__(self):
+        return len(self.date)
+
+
+### Balance Index Class -------------------------------------------------------
+
+class BalanceIndex:
+
+    # Запас от переполнения int64 при накоплении сумм
+    MAX_ABS_TOTAL = 2 ** 62
+
+    def __init__(self, table):
+        self.table = table
+
+        # Проводки по группам (счет, валюта, валюта стоимости), внутри группы по дате;
+        # lexsort устойчив, поэтому проводки одной даты остаются в порядке журнала
+        order = np.lexsort((table.date, table.cost_currency, table.currency, table.account))
+        accounts = table.account[order]
+        currencies = table.currency[order]
+        cost_currencies = table.cost_currency[order]
+        numbers = table.number[order]
+        if np.abs(numbers.astype(np.float64)).sum() >= self.MAX_ABS_TOTAL:
+            message = 'Posting amounts are too large for balance index'
+            raise EngineException(message)
+
+        changed = ((accounts[1:] != accounts[:-1])
+                   | (currencies[1:] != currencies[:-1])
+                   | (cost_currencies[1:] != cost_currencies[:-1]))
+        starts = np.flatnonzero(np.concatenate(([True], changed))) if len(order) else np.empty(0, dtype=np.int64)
+        ends = np.append(starts[1:], len(order))
+        group_ids = np.repeat(np.arange(len(starts)), ends - starts)
+
+        self.dates = table.date[order]
+        # Нарастающие суммы и минимальная экспонента -- для любого префикса группы
+        totals = np.cumsum(numbers)
+        offsets = np.concatenate(([0], totals[starts[1:] - 1])) if len(starts) else np.empty(0, dtype=np.int64)
+        self.totals = totals - np.repeat(offsets, ends - starts)
+        self.exponents = pd.Series(table.exponent[order]).groupby(group_ids).cummin().to_numpy()
+
+        self.groups = list(zip(accounts[starts].tolist(), currencies[starts].tolist(),
+                               cost_currencies[starts].tolist(), starts.tolist(), ends.tolist()))
+        # (счет, валюта) -> диапазоны групп по валютам стоимости: поиск остатка без обхода всех групп
+        self.groups_ranges = {}
+        for account_id, currency_id, _, start, end in self.groups:
+            self.groups_ranges.setdefault((account_id, currency_id), []).append((start, end))
+
+
+    def _find_position(self, start, end, ordinal):
+        # Последняя проводка группы на дату или раньше; None -- проводок еще не было
+        position = start + int(np.searchsorted(self.dates[start:end], ordinal, side='right')) - 1
+        return position if position >= start else None
+
+
+    def get_positions(self, accounts_mask, date):
+        # [(account_id, currency_id, cost_currency_id, scaled_number, exponent), ...] на конец дня date
+        ordinal = date.toordinal()
+        positions = []
+        for account_id, currency_id, cost_currency_id, start, end in self.groups:
+            if not accounts_mask[account_id]:
+                continue
+            position = self._find_position(start, end, ordinal)
+            if position is None:
+                continue
+            positions.append((account_id, currency_id, cost_currency_id,
+                              int(self.totals[position]), int(self.exponents[position])))
+        return positions
+
+
+    def get_balance(self, account, currency, date):
+        account_id = self.table.get_account_id(account)
+        currency_id = self.table.get_currency_id(currency)
+        ordinal = date.toordinal()
+        total = 0
+        exponent = 0
+        for start, end in self.groups_ranges.get((account_id, currency_id), []):
+            position = self._find_position(start, end, ordinal)
+            if position is not None:
+                total += int(self.totals[position])
+                exponent = min(exponent, int(self.exponents[position]))
+        return self.table.to_decimal(total).quantize(Decimal(1).scaleb(exponent))
+
+
+### Native Engine Class -------------------------------------------------------
+
+class NativeEngine:
+
+    PERIOD_MONTH = 'month'
+    PERIOD_QUARTER = 'quarter'
+    PERIOD_YEAR = 'year'
+
+    EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+    def __init__(self, entries, options, price_index=None):
+        self.table = PostingsTable(entries)
+        self.price_index = price_index or PriceIndex.from_entries(entries)
+        self._balance_index = None
+
+
+    def get_balance_index(self):
+        # Строится один раз на версию журнала, при первом запросе остатков на дату
+        if self._balance_index is None:
+            self._balance_index = BalanceIndex(self.table)
+        return self._balance_index
+
+
+    def _convert(self, currencies, cost_currencies, target, dates):
+        # Повторяет convert.convert_position: прямой курс, затем через валюту стоимости
+        rate_ids = np.full(len(currencies), PriceIndex.UNCONVERTED, dtype=np.int64)
+
+        for currency_id in np.unique(currencies).tolist():
+            currency = self.table.currencies[currency_id]
+            if currency == target:
+                continue
+            selected = np.flatnonzero(currencies == currency_id)
+            ids = self.price_index.lookup(currency, target, dates[selected])
+
+            missing = ids == PriceIndex.NOT_FOUND
+            for via_id in np.unique(cost_currencies[selected][missing]).tolist():
+                if via_id == PostingsTable.NO_CURRENCY or self.table.currencies[via_id] == target:
+                    continue
+                via = self.table.currencies[via_id]
+                via_selected = missing & (cost_currencies[selected] == via_id)
+                via_dates = dates[selected][via_selected]
+                first_ids = self.price_index.lookup(currency, via, via_dates)
+                second_ids = self.price_index.lookup(via, target, via_dates)
+                found = (first_ids != PriceIndex.NOT_FOUND) & (second_ids != PriceIndex.NOT_FOUND)
+                via_ids = np.full(len(via_dates), PriceIndex.NOT_FOUND, dtype=np.int64)
+                via_ids[found] = self.price_index.composite(first_ids[found], second_ids[found])
+                ids[via_selected] = via_ids
+
+            rate_ids[selected] = np.where(ids != PriceIndex.NOT_FOUND, ids, PriceIndex.UNCONVERTED)
+
+        return rate_ids
+
+
+    def _quantize(self, total, exponent):
+        # Обратные курсы (1 / rate) несут 28 знаков: такая сумма уже округлена
+        # по точности контекста Decimal и больше знаков не вмещает
+        try:
+            return total.quantize(Decimal(1).scaleb(exponent))
+        except InvalidOperation:
+            return total
+
+
+    def _sum(self, index, keys, rate_ids=None):
+        # Точная сумма в Decimal по группам: целые суммы по (ключ, курс),
+        # затем одно умножение на курс для каждой пары
+        if rate_ids is None:
+            rate_ids = np.full(len(index), PriceIndex.UNCONVERTED, dtype=np.int64)
+
+        frame = pd.DataFrame({
+            'key': keys,
+            'rate': rate_ids,
+            'number': self.table.number[index],
+            'exponent': self.table.exponent[index] + self.price_index.get_exponents(rate_ids),
+        })
+        totals = {key: Decimal() for key in pd.unique(frame['key']).tolist()}
+        grouped = frame.groupby(['key', 'rate'], sort=False)['number'].sum()
+        for (key, rate_id), number in grouped.items():
+            totals[key] += self.table.to_decimal(number) * self.price_index.values[rate_id]
+
+        # Экспонента как у суммы Decimal в BQL: min(0, экспоненты слагаемых)
+        exponents = frame.groupby('key', sort=False)['exponent'].min()
+        result = {}
+        for key, total in totals.items():
+            exponent = min(0, int(exponents[key]))
+            result[key] = self._quantize(total, exponent)
+        return result
+
+
+    def _select(self, include=None, exclude=None, from_=None, to=None, currency=None):
+        mask = np.ones(len(self.table), dtype=bool)
+        if include is not None:
+            mask &= self.table.match_accounts(include)
+        if exclude is not None:
+            mask &= ~self.table.match_accounts(exclude)
+        if from_ is not None:
+            mask &= self.table.date >= from_.toordinal()
+        if to is not None:
+            mask &= self.table.date <= to.toordinal()
+        if currency is not None:
+            mask &= self.table.currency == self.table.get_currency_id(currency)
+        return np.flatnonzero(mask)
+
+
+    def _sort_desc(self, rows):
+        # ORDER BY position, <key> DESC
+        return sorted(rows, key=lambda row: (row[1] if row[1] is not None else Decimal(), row[0]), reverse=True)
+
+
+    def _to_dataframe(self, rows, key_column, value_column='position'):
+        if not rows:
+            return None
+        return pd.DataFrame({
+            key_column: [row[0] for row in rows],
+            value_column: [row[1] for row in rows],
+        })
+
+
+    def assets(self, include, exclude, target, on_date):
+        index = self._select(include=include, exclude=exclude)
+        dates = np.full(len(index), on_date.toordinal(), dtype=np.int64)
+        rate_ids = self._convert(self.table.currency[index], self.table.cost_currency[index], target, dates)
+        accounts = self.table.account[index]
+        totals = self._sum(index, accounts, rate_ids)
+
+        # FROM OPEN ON: проводки до даты сворачиваются в остатки по счетам
+        # (в порядке имен), пустые остатки исчезают, поздние проводки остаются
+        before = self.table.date[index] < on_date.toordinal()
+        lots = pd.DataFrame({
+            'account': accounts[before],
+            'currency': self.table.currency[index][before],
+            'cost_currency': self.table.cost_currency[index][before],
+            'number': self.table.number[index][before],
+        }).groupby(['account', 'currency', 'cost_currency'])['number'].sum()
+        opened = sorted(
+            {int(account) for (account, _, _), number in lots.items() if number != 0},
+            key=lambda account: self.table.accounts[account])
+        later = pd.unique(accounts[~before]).tolist()
+
+        opened_set = set(opened)
+        order = opened + [account for account in later if account not in opened_set]
+        rows = [(self.table.accounts[account], totals[account]) for account in order]
+        return self._to_dataframe(rows, 'account')
+
+
+    def assets_on(self, include, exclude, target, on_date):
+        # Остатки на конец дня on_date по индексу, в курсе на ту же дату
+        accounts_mask = self.table.match_accounts_ids(include) & ~self.table.match_accounts_ids(exclude)
+        positions = self.get_balance_index().get_positions(accounts_mask, on_date)
+        if not positions:
+            return None
+
+        accounts, currencies, cost_currencies, numbers, exponents = (np.array(column) for column in zip(*positions))
+        dates = np.full(len(positions), on_date.toordinal(), dtype=np.int64)
+        rate_ids = self._convert(currencies, cost_currencies, target, dates)
+        exponents = exponents + self.price_index.get_exponents(rate_ids)
+
+        totals = {}
+        min_exponents = {}
+        for account, number, rate_id, exponent in zip(accounts.tolist(), numbers.tolist(), rate_ids.tolist(), exponents.tolist()):
+            totals[account] = totals.get(account, Decimal()) + self.table.to_decimal(number) * self.price_index.values[rate_id]
+            min_exponents[account] = min(min_exponents.get(account, 0), exponent)
+
+        # Порядок строк -- первое появление счета в журнале, как у BQL без OPEN
+        first_positions = self.get_first_positions()
+        rows = [
+            (self.table.accounts[account], self._quantize(totals[account], min_exponents[account]))
+            for account in sorted(totals, key=lambda account: first_positions[account])
+        ]
+        return self._to_dataframe(rows, 'account')
+
+
+    def get_first_positions(self):
+        first_positions = np.full(len(self.table.accounts), len(self.table), dtype=np.int64)
+        np.minimum.at(first_positions, self.table.account, np.arange(len(self.table)))
+        return first_positions
+
+
+    def period(self, include, target, from_, to, negate=False):
+        index = self._select(include=include, from_=from_, to=to)
+        rate_ids = self._convert(self.table.currency[index], self.table.cost_currency[index],
+                                 target, self.table.date[index])
+        totals = self._sum(index, self.table.account[index], rate_ids)
+        rows = [
+            (self.table.accounts[account], -total if negate else total)
+            for account, total in totals.items()
+        ]
+        return self._to_dataframe(self._sort_desc(rows), 'account')
+
+
+    def _gen_periods_numbers(self, ordinals, by):
+        # Номер периода от 1970 года: месяц, квартал или год
+        months = (ordinals - self.EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        if by == self.PERIOD_MONTH:
+            return months
+        if by == self.PERIOD_QUARTER:
+            return months // 3
+        if by == self.PERIOD_YEAR:
+            return months // 12
+        message = f'Period "{by}" is not supported'
+        raise EngineException(message)
+
+
+    def _gen_period_start(self, number, by):
+        months = number * {self.PERIOD_MONTH: 1, self.PERIOD_QUARTER: 3, self.PERIOD_YEAR: 12}[by]
+        return datetime.date(1970 + months // 12, months % 12 + 1, 1)
+
+
+    def period_cells(self, include, target, from_, to, by):
+        # [(account, начало периода, сумма), ...] -- одна группировка по (счет, период)
+        index = self._select(include=include, from_=from_, to=to)
+        if len(index) == 0:
+            return []
+        rate_ids = self._convert(self.table.currency[index], self.table.cost_currency[index],
+                                 target, self.table.date[index])
+        periods = self._gen_periods_numbers(self.table.date[index], by)
+        pairs, keys = np.unique(np.stack([self.table.account[index].astype(np.int64), periods], axis=1),
+                                axis=0, return_inverse=True)
+        totals = self._sum(index, keys.reshape(-1), rate_ids)
+        return [
+            (self.table.accounts[pairs[key][0]], self._gen_period_start(int(pairs[key][1]), by), total)
+            for key, total in totals.items()
+        ]
+
+
+    def cash(self, include, currency, target=None, on_date=None):
+        index = self._select(include=include, currency=currency)
+        rate_ids = None
+        if target is not None and target != currency:
+            dates = np.full(len(index), on_date.toordinal(), dtype=np.int64)
+            rate_ids = self._convert(self.table.currency[index], self.table.cost_currency[index], target, dates)
+        totals = self._sum(index, self.table.account[index], rate_ids)
+        rows = [(self.table.accounts[account], total) for account, total in totals.items()]
+        return self._to_dataframe(rows, 'account')
+
+
+    def lots(self, include, on_date):
+        # Снимок портфеля по лотам на конец дня on_date (None -- по всем проводкам): столбцы
+        # account, currency, cost, units; cost=None -- позиция без стоимости (валюта, бумаги без {})
+        index = self._select(include=include, to=on_date)
+        frame = pd.DataFrame({
+            'account': self.table.account[index],
+            'currency': self.table.currency[index],
+            'lot': self.table.lot[index],
+            'number': self.table.number[index],
+            'exponent': self.table.exponent[index],
+        })
+        grouped = frame.groupby(['account', 'currency', 'lot'], sort=False).agg(
+            number=('number', 'sum'), exponent=('exponent', 'min')).reset_index()
+        grouped = grouped[grouped['number'] != 0]
+
+        # Имена и стоимости -- выборкой по id; лот NO_LOT (-1) попадает на последний элемент, None
+        lots = pd.Series(self.table.lots + [None], dtype=object)
+        units = [
+            self.table.to_decimal(number).quantize(Decimal(1).scaleb(min(0, exponent)))
+            for number, exponent in zip(grouped['number'].tolist(), grouped['exponent'].tolist())
+        ]
+        return pd.DataFrame({
+            'account': pd.Series(self.table.accounts, dtype=object).take(grouped['account']).tolist(),
+            'currency': pd.Series(self.table.currencies, dtype=object).take(grouped['currency']).tolist(),
+            'cost': pd.Series(lots.take(grouped['lot']).tolist(), dtype=object),
+            'units': pd.Series(units, dtype=object),
+        })
+
+
+    def _gen_steps_ids(self, ordinals, steps):
+        # Номер первого шага, в который попадает проводка (шаг -- конец дня steps[i])
+        return np.searchsorted(steps, ordinals, side='left')
+
+
+    def balances_series(self, includes, target, dates):
+        # Остатки на конец каждой даты dates (по возрастанию) по каждому шаблону includes
+        # в курсе на ту же дату: один проход нарастающей суммой по матрице
+        # (шаблон, валюта, валюта стоимости) x шаг, затем векторная конвертация
+        steps = np.array([day.toordinal() for day in dates], dtype=np.int64)
+        series = [[Decimal()] * len(steps) for _ in includes]
+        if len(steps) == 0:
+            return series
+
+        classes = np.full(len(self.table), -1, dtype=np.int64)
+        for class_id, include in reversed(list(enumerate(includes))):
+            classes[self.table.match_accounts(include)] = class_id
+        index = np.flatnonzero((classes >= 0) & (self.table.date <= steps[-1]))
+        if len(index) == 0:
+            return series
+        if np.abs(self.table.number[index].astype(np.float64)).sum() >= BalanceIndex.MAX_ABS_TOTAL:
+            message = 'Posting amounts are too large for balances series'
+            raise EngineException(message)
+
+        # Ключ группы упакован в одно число: np.unique по строкам матрицы в разы медленнее
+        size = len(self.table.currencies) + 1
+        keys = (classes[index] * size + self.table.currency[index]) * size + (self.table.cost_currency[index] + 1)
+        packed, group_ids = np.unique(keys, return_inverse=True)
+        groups = np.stack([packed // (size * size), packed // size % size, packed % size - 1], axis=1)
+        totals = np.zeros((len(groups), len(steps)), dtype=np.int64)
+        np.add.at(totals, (group_ids, self._gen_steps_ids(self.table.date[index], steps)), self.table.number[index])
+        totals = np.cumsum(totals, axis=1)
+        group_exponents = np.zeros(len(groups), dtype=np.int64)
+        np.minimum.at(group_exponents, group_ids, self.table.exponent[index])
+
+        # Курсы для всех клеток матрицы сразу; пустые клетки не конвертируются
+        rows, columns = np.nonzero(totals)
+        rate_ids = self._convert(groups[rows, 1], groups[rows, 2], target, steps[columns])
+        exponents = group_exponents[rows] + self.price_index.get_exponents(rate_ids)
+
+        # Целые суммы по (шаблон, шаг, курс) -- одно умножение Decimal на курс;
+        # ключи упакованы в числа, без groupby pandas (MultiIndex дорог при первом вызове)
+        cells = groups[rows, 0] * len(steps) + columns
+        keys, key_ids = np.unique(cells * len(self.price_index.values) + rate_ids, return_inverse=True)
+        numbers = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(numbers, key_ids, totals[rows, columns])
+        for key, number in zip(keys.tolist(), numbers.tolist()):
+            cell, rate_id = divmod(key, len(self.price_index.values))
+            class_id, step = divmod(cell, len(steps))
+            series[class_id][step] += self.table.to_decimal(number) * self.price_index.values[rate_id]
+
+        cells, cell_ids = np.unique(cells, return_inverse=True)
+        # Начальные нули -- это min(0, ...) как в _sum
+        cells_exponents = np.zeros(len(cells), dtype=np.int64)
+        np.minimum.at(cells_exponents, cell_ids, exponents)
+        for cell, exponent in zip(cells.tolist(), cells_exponents.tolist()):
+            class_id, step = divmod(cell, len(steps))
+            series[class_id][step] = self._quantize(series[class_id][step], exponent)
+        return series
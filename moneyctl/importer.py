@@ -0,0 +1,232 @@
+import os
+import csv
+import json
+import hashlib
+import datetime
+from decimal import Decimal, InvalidOperation
+from collections import Counter
+
+from moneyctl.journal import Transaction, TransactionException, JournalException
+
+
+# Classes =====================================================================
+
+class ImportException(TransactionException):
+    def __init__(self, message=None):
+        super().__init__(message)
+
+
+### Transaction Hash Index Class ----------------------------------------------
+
+class TransactionHashIndex:
+
+    INDEX_FORMAT_VERSION = 1
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.index_file = journal.state_dir / 'transactions-hashes.json'
+        self.files = {}
+        # Мультимножество: две одинаковые покупки за день -- две разные транзакции
+        self.hashes = Counter()
+
+
+    @staticmethod
+    def gen_hash(date, comment, postings):
+        # postings -- список (account, number, currency); порядок не важен
+        normalized = sorted(
+            (account, str(Decimal(number).normalize()) if number is not None else '', currency or '')
+            for account, number, currency in postings
+        )
+        text = json.dumps([date.strftime('%Y-%m-%d'), comment or '', normalized], ensure_ascii=False)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+
+    @classmethod
+    def gen_transaction_hash(cls, transaction):
+        return cls.gen_hash(transaction.get_date(), transaction.comment, transaction.get_postings())
+
+
+    def _scan_file(self, path_object):
+        # beancount нужен только для разбора изменившихся файлов
+        import beancount.parser.parser
+        from beancount.core import data
+
+        entries, _, _ = beancount.parser.parser.parse_file(str(path_object.absolute()))
+        hashes = []
+        for entry in entries:
+            if not isinstance(entry, data.Transaction):
+                continue
+            postings = [
+                (posting.account,
+                 posting.units.number if posting.units else None,
+                 posting.units.currency if posting.units else None)
+                for posting in entry.postings
+            ]
+            hashes.append(self.gen_hash(entry.date, entry.narration, postings))
+        return hashes
+
+
+    def _read(self):
+        try:
+            with open(self.index_file, 'r') as file_object:
+                data = json.load(file_object)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if data.get('version') != self.INDEX_FORMAT_VERSION:
+            return {}
+        return data['files']
+
+
+    def save(self):
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.index_file.with_name(f'{self.index_file.name}.{os.getpid()}.tmp')
+        with open(tmp_file, 'w') as file_object:
+            json.dump({'version': self.INDEX_FORMAT_VERSION, 'files': self.files}, file_object)
+        os.replace(tmp_file, self.index_file)
+
+
+    def load(self):
+        cached_files = self._read()
+        self.files = {}
+        glob = self.journal.beancount_files_glob
+        for path_object in sorted(self.journal.transactions_dir.glob(glob)):
+            stat = path_object.stat()
+            cached = cached_files.get(str(path_object))
+            if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                hashes = cached[2]
+            else:
+                hashes = self._scan_file(path_object)
+            self.files[str(path_object)] = [stat.st_size, stat.st_mtime_ns, hashes]
+        self.hashes = Counter(h for _, _, hashes in self.files.values() for h in hashes)
+        self.save()
+
+
+    def consume(self, transaction_hash):
+        # True -- в журнале есть еще не сопоставленная такая же транзакция
+        if self.hashes[transaction_hash] > 0:
+            self.hashes[transaction_hash] -= 1
+            return True
+        return False
+
+
+    def update_file(self, path_object, hashes):
+        # Файл дописан нами -- добавляем хеши без повторного разбора
+        stat = path_object.stat()
+        previous = self.files.get(str(path_object), [0, 0, []])[2]
+        self.files[str(path_object)] = [stat.st_size, stat.st_mtime_ns, previous + hashes]
+
+
+### Transaction Importer Class ------------------------------------------------
+
+class TransactionImporter:
+
+    FORMAT_CSV = 'csv'
+    FORMAT_NDJSON = 'ndjson'
+
+    FORMATS = [FORMAT_CSV, FORMAT_NDJSON]
+
+    DATE_FORMAT = '%Y-%m-%d'
+
+    def __init__(self, journal, default_template=None, deduplicate=True):
+        self.journal = journal
+        self.default_template = default_template
+        self.deduplicate = deduplicate
+        self.hash_index = TransactionHashIndex(journal)
+        self.imported_count = 0
+        self.skipped_count = 0
+
+
+    def _read_rows(self, stream, format):
+        if format == self.FORMAT_CSV:
+            yield from csv.DictReader(stream)
+        elif format == self.FORMAT_NDJSON:
+            for line in stream:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            message = f'Import does not support "{format}" format type'
+            raise ImportException(message)
+
+
+    def _parse_amount(self, value, row_number):
+        if value is None or value == '':
+            return None
+        try:
+            return Decimal(str(value).replace(' ', '').replace('_', ''))
+        except InvalidOperation:
+            message = f'Row {row_number}: incorrect amount "{value}"'
+            raise ImportException(message)
+
+
+    def _parse_date(self, value, row_number):
+        if not value:
+            return None
+        try:
+            return datetime.datetime.strptime(value, self.DATE_FORMAT)
+        except ValueError:
+            message = f'Row {row_number}: incorrect date "{value}"'
+            raise ImportException(message)
+
+
+    def _row_to_transaction(self, row, row_number):
+        amount = self._parse_amount(row.get('amount'), row_number)
+        amount_from = self._parse_amount(row.get('amount_from'), row_number) or amount
+        amount_to = self._parse_amount(row.get('amount_to'), row_number) or amount
+
+        transaction = Transaction(self.journal)
+        try:
+            transaction.set(date=self._parse_date(row.get('date'), row_number),
+                            template=row.get('template') or self.default_template,
+                            comment=row.get('comment') or None,
+                            account_from=row.get('from') or None,
+                            account_to=row.get('to') or None,
+                            amount_from=amount_from,
+                            amount_to=amount_to)
+            transaction.close()
+        except ImportException:
+            raise
+        except JournalException as e:
+            message = f'Row {row_number}: {e}'
+            raise ImportException(message)
+        return transaction
+
+
+    def run(self, stream, format=FORMAT_CSV, dry_run=False):
+        if dry_run:
+            return self._run(stream, format, dry_run)
+        # Проверка дублей и запись -- под одной блокировкой: параллельный импорт не задвоит строки
+        with self.journal.writer.lock():
+            return self._run(stream, format, dry_run)
+
+
+    def _run(self, stream, format, dry_run):
+        if self.deduplicate:
+            self.hash_index.load()
+
+        transactions = []
+        hashes = []
+        for row_number, row in enumerate(self._read_rows(stream, format), start=1):
+            transaction = self._row_to_transaction(row, row_number)
+            transaction_hash = self.hash_index.gen_transaction_hash(transaction)
+            if self.deduplicate and self.hash_index.consume(transaction_hash):
+                self.skipped_count += 1
+                continue
+            transactions.append(transaction)
+            hashes.append(transaction_hash)
+
+        if dry_run or not transactions:
+            self.imported_count = len(transactions)
+            return transactions
+
+        self.journal.commit_transactions(transactions)
+        self.imported_count = len(transactions)
+
+        if self.deduplicate:
+            hashes_by_file = {}
+            for transaction, transaction_hash in zip(transactions, hashes):
+                hashes_by_file.setdefault(transaction.get_file(), []).append(transaction_hash)
+            for path_object, file_hashes in hashes_by_file.items():
+                self.hash_index.update_file(path_object, file_hashes)
+            self.hash_index.save()
+
+        return transactions
@@ -0,0 +1,271 @@
+import os
+import json
+from bisect import bisect_left, bisect_right
+
+
+# Classes =====================================================================
+
+### Journal Index Class -------------------------------------------------------
+
+class JournalIndex:
+
+    INDEX_FORMAT_VERSION = 3
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.index_file = journal.state_dir / 'index.json'
+        self.accounts = []
+        self.templates = []
+        self.templates_names = []
+        self.templates_errors = []
+        self.accounts_names = []
+        self.open_accounts_names = []
+        self.lifetimes = None
+        self.loaded = False
+
+
+    def _gen_signature(self):
+        # Только stat -- сами файлы счетов и шаблонов не открываются
+        signature = []
+        paths = sorted(self.journal.accounts_dir.glob(self.journal.beancount_files_glob))
+        paths += self.journal.get_templates_files()
+        for path_object in paths:
+            stat = path_object.stat()
+            signature.append([str(path_object), stat.st_size, stat.st_mtime_ns])
+        return signature
+
+
+    def _read(self):
+        try:
+            with open(self.index_file, 'r') as file_object:
+                data = json.load(file_object)
+        except (FileNotFoundError, ValueError):
+            return None
+        if data.get('version') != self.INDEX_FORMAT_VERSION:
+            return None
+        return data
+
+
+    def _write(self, data):
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.index_file.with_name(f'{self.index_file.name}.{os.getpid()}.tmp')
+        with open(tmp_file, 'w') as file_object:
+            json.dump(data, file_object, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_file, self.index_file)
+
+
+    def _build(self, signature):
+        accounts = []
+        for account in self.journal.scan_accounts().values():
+            commodity = account.get_commodity()
+            status = account.get_status()
+            accounts.append([
+                account.get_name(),
+                account.open_date,
+                account.close_date,
+                status.name if status else None,
+                commodity.get_ticker() if commodity else None,
+                account.intervals,
+            ])
+        accounts.sort()
+        templates = self.journal.templates.compile({record[0] for record in accounts})
+        return {
+            'version': self.INDEX_FORMAT_VERSION,
+            'signature': signature,
+            'accounts': accounts,
+            'templates': templates,
+        }
+
+
+    def _apply(self, data):
+        self.accounts = data['accounts']
+        self.templates = data['templates']
+        self.templates_names = [record[0] for record in self.templates]
+        # Ошибки компиляции собраны в индексе: их выводят check и команды с шаблонами,
+        # а не сборка индекса, которая идет и при дополнении, и в демоне
+        self.templates_errors = [
+            (name, filename, message) for name, filename, _, errors in self.templates for message in errors
+        ]
+        self.accounts_names = [record[0] for record in self.accounts]
+        self.open_accounts_names = [record[0] for record in self.accounts if record[3] == 'OPEN']
+        self.lifetimes = None
+        self.loaded = True
+
+
+    def refresh(self):
+        signature = self._gen_signature()
+        data = self._read()
+        if data is None or data['signature'] != signature:
+            data = self._build(signature)
+            self._write(data)
+        self._apply(data)
+
+
+    def invalidate(self):
+        self.loaded = False
+
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            self.refresh()
+
+
+    def _prefix_lookup(self, names, prefix):
+        result = []
+        for i in range(bisect_left(names, prefix), len(names)):
+            if not names[i].startswith(prefix):
+                break
+            result.append(names[i])
+        return result
+
+
+    def _find_record(self, records, names, name):
+        i = bisect_left(names, name)
+        if i < len(names) and names[i] == name:
+            return records[i]
+        return None
+
+
+    def get_accounts_records(self):
+        self._ensure_loaded()
+        return self.accounts
+
+
+    def get_account_record(self, name):
+        self._ensure_loaded()
+        return self._find_record(self.accounts, self.accounts_names, name)
+
+
+    def get_templates_records(self):
+        self._ensure_loaded()
+        return self.templates
+
+
+    def get_templates_errors(self):
+        self._ensure_loaded()
+        return self.templates_errors
+
+
+    def get_template_record(self, name):
+        self._ensure_loaded()
+        return self._find_record(self.templates, self.templates_names, name)
+
+
+    def get_templates_names(self):
+        self._ensure_loaded()
+        return self.templates_names
+
+
+    def _get_lifetimes(self):
+        self._ensure_loaded()
+        if self.lifetimes is None:
+            self.lifetimes = AccountLifetimeIndex(self.accounts)
+        return self.lifetimes
+
+
+    def is_account_open(self, name, date):
+        return self._get_lifetimes().is_open(name, date)
+
+
+    def get_open_accounts(self, date):
+        return self._get_lifetimes().get_open(date)
+
+
+    def complete_accounts(self, prefix, open_only=False, date=None):
+        self._ensure_loaded()
+        if open_only and date is not None:
+            lifetimes = self._get_lifetimes()
+            return [name for name in self._prefix_lookup(self.accounts_names, prefix) if lifetimes.is_open(name, date)]
+        if open_only:
+            return self._prefix_lookup(self.open_accounts_names, prefix)
+        return self._prefix_lookup(self.accounts_names, prefix)
+
+
+    def complete_templates(self, prefix):
+        self._ensure_loaded()
+        return self._prefix_lookup(self.templates_names, prefix)
+
+
+### Interval Tree Class -------------------------------------------------------
+
+class IntervalTree:
+
+    def __init__(self, intervals):
+        # intervals -- [(start, end, value), ...], границы включительно
+        self.root = self._build(intervals)
+
+
+    def _build(self, intervals):
+        # Центрированное дерево: в узле интервалы, содержащие центр, по началу и по концу
+        if not intervals:
+            return None
+        starts = sorted(start for start, _, _ in intervals)
+        center = starts[len(starts) // 2]
+        left = [interval for interval in intervals if interval[1] < center]
+        right = [interval for interval in intervals if interval[0] > center]
+        middle = [interval for interval in intervals if interval[0] <= center <= interval[1]]
+        by_start = sorted(middle, key=lambda interval: interval[0])
+        by_end = sorted(middle, key=lambda interval: interval[1], reverse=True)
+        return (center, by_start, by_end, self._build(left), self._build(right))
+
+
+    def query(self, point):
+        # O(log n + k): в каждом узле просматриваются только подходящие интервалы
+        result = []
+        node = self.root
+        while node is not None:
+            center, by_start, by_end, left, right = node
+            if point < center:
+                for start, _, value in by_start:
+                    if start > point:
+                        break
+                    result.append(value)
+                node = left
+            elif point > center:
+                for _, end, value in by_end:
+                    if end < point:
+                        break
+                    result.append(value)
+                node = right
+            else:
+                result.extend(value for _, _, value in by_start)
+                node = None
+        return result
+
+
+### Account Lifetime Index Class ----------------------------------------------
+
+class AccountLifetimeIndex:
+
+    DATE_FORMAT = '%Y-%m-%d'
+    # Открытый интервал (без close) тянется до конца времен
+    MAX_DATE = '9999-12-31'
+
+    def __init__(self, records):
+        self.starts = {}
+        self.ends = {}
+        intervals = []
+        for record in records:
+            name, account_intervals = record[0], record[5]
+            self.starts[name] = [start for start, _ in account_intervals]
+            self.ends[name] = [end or self.MAX_DATE for _, end in account_intervals]
+            intervals += [(start, end or self.MAX_DATE, name) for start, end in account_intervals]
+        self.tree = IntervalTree(intervals)
+
+
+    def _format_date(self, date):
+        return date if isinstance(date, str) else date.strftime(self.DATE_FORMAT)
+
+
+    def is_open(self, name, date):
+        # Даты open и close включительно, как в проверке beancount
+        date = self._format_date(date)
+        starts = self.starts.get(name)
+        if not starts:
+            return False
+        i = bisect_right(starts, date) - 1
+        return i >= 0 and date <= self.ends[name][i]
+
+
+    def get_open(self, date):
+        return sorted(self.tree.query(self._format_date(date)))
@@ -1,7 +1,14 @@
+import os
+import json
+import fcntl
 import tomllib
 import datetime
 from enum import Enum
 from pathlib import Path
+from contextlib import contextmanager
+
+from moneyctl.index import JournalIndex
+from moneyctl.trace import span
 
 # Classes =====================================================================
 
@@ -14,30 +21,42 @@ class JournalException(BaseException):
 
 class Journal:
 
+    STATE_DIR_NAME = '.moneyctl'
+    SOCKET_FILE_NAME = 'serve.sock'
+
     _instance = None
 
     def __new__(cls, *args, **kwargs):
+        # Экземпляр запоминается только после успешной проверки каталога журнала
         if not cls._instance:
-            cls._instance = super().__new__(cls, *args, **kwargs)
-            cls._instance._init()
+            instance = super().__new__(cls, *args, **kwargs)
+            instance._init()
+            cls._instance = instance
         return cls._instance
 
 
     def _init(self):
         self.beancount_files_extension = 'bean'
-        self.templates_files_extension = 'toml'
+        self.templates_files_extensions = ['toml', 'yml', 'yaml']
 
-        self.templates_files_glob = '**/*.' + self.templates_files_extension
+        self.templates_files_globs = ['**/*.' + extension for extension in self.templates_files_extensions]
         self.beancount_files_glob = "**/*." + self.beancount_files_extension
 
         self.root_dir = Path('.')
         self.transactions_dir = self.root_dir / 'transactions'
         self.templates_dir = self.root_dir / 'templates'
         self.accounts_dir = self.root_dir / 'accounts'
+        self.prices_dir = self.root_dir / 'prices'
+        self.state_dir = self.root_dir / self.STATE_DIR_NAME
+        self.cache_dir = self.state_dir / 'cache'
+        self.socket_file = self.state_dir / self.SOCKET_FILE_NAME
 
         self.accounts = {}
-        self.templates = {}
+        self.accounts_loaded = False
+        self.templates = TemplateRegistry(self)
         self.transaction = None
+        self.index = JournalIndex(self)
+        self.writer = JournalWriter(self)
 
         self.validate()
 
@@ -54,11 +73,11 @@ class Journal:
             raise JournalException(message)
 
 
-    def _read_templates(self):
-        for path_object in self.templates_dir.glob(self.templates_files_glob):
-            template_name = path_object.stem
-            template_object = Template(self, path_object)
-            self.templates[template_name] = template_object
+    def invalidate(self):
+        self.accounts = {}
+        self.accounts_loaded = False
+        self.templates.invalidate()
+        self.index.invalidate()
 
 
     def _gen_transaction_filepath(self, date):
@@ -68,64 +87,124 @@ class Journal:
         return filepath
 
 
-    def _read_accounts(self):
-        for path_object in self.accounts_dir.glob(self.beancount_files_glob):
+    def get_templates_files(self):
+        files = []
+        for files_glob in self.templates_files_globs:
+            files += self.templates_dir.glob(files_glob)
+        return sorted(files)
+
+
+    def scan_accounts(self):
+        accounts = {}
+        events = {}
+        for path_object in sorted(self.accounts_dir.glob(self.beancount_files_glob)):
             with open(path_object.absolute(), 'r') as file_object:
                 lines = file_object.readlines()
                 for line in lines:
                     words = line.split()
-                    if len(words) >= 4:
+                    if len(words) >= 3:
 
                         date = words[0]
                         status = words[1]
                         account = words[2]
-                        ticker = words[3]
+                        ticker = words[3] if len(words) >= 4 else None
 
-                        if account not in self.accounts:
-                            self.accounts[account] = Account(self, account)
+                        if account not in accounts:
+                            accounts[account] = Account(self, account)
 
                         if status == 'open':
-                            self.accounts[account].set(
+                            accounts[account].set(
                                 open_date=date,
                                 status=AccountStatus.OPEN,
-                                commodity=Commodity(ticker)) # TODO читать все Commodity по аналогии с Accounts
+                                commodity=Commodity(ticker) if ticker else None) # TODO читать все Commodity по аналогии с Accounts
                         elif status == 'close':
-                            self.accounts[account].set(
+                            accounts[account].set(
                                 close_date=date,
                                 status=AccountStatus.CLOSED)
                         else:
                             message = f'Unknown status "{status}" for account "{account}" in file "{path_object.absolute()}"'
                             raise JournalException(message)
+                        events.setdefault(account, []).append((date, status == 'close'))
 
+        for account, account_events in events.items():
+            accounts[account].set(intervals=self._gen_account_intervals(sorted(account_events)))
+        return accounts
 
-    def get_template(self, template_name):
-        if not self.templates:
-            self._read_templates()
 
-        if template_name not in self.templates:
-            message = f'Template "{template_name}" does not exist'
-            raise JournalException(message)
+    def _gen_account_intervals(self, events):
+        # [[open_date, close_date], ...]; close_date=None -- счет открыт до сих пор
+        intervals = []
+        for date, is_close in events:
+            is_open = bool(intervals) and intervals[-1][1] is None
+            if not is_close and not is_open:
+                intervals.append([date, None])
+            elif is_close and is_open:
+                intervals[-1][1] = date
+        return intervals
 
-        return self.templates[template_name]
+
+    def _gen_account(self, record):
+        name, open_date, close_date, status, ticker, intervals = record
+        account = Account(self, name)
+        account.set(open_date=open_date,
+                    close_date=close_date,
+                    status=AccountStatus[status] if status else None,
+                    commodity=Commodity(ticker) if ticker else None,
+                    intervals=intervals)
+        return account
+
+
+    def _read_accounts(self):
+        for record in self.index.get_accounts_records():
+            self.accounts[record[0]] = self._gen_account(record)
+        self.accounts_loaded = True
+
+
+    def get_template(self, template_name):
+        return self.templates.get(template_name)
 
 
     def get_account(self, account_name):
-        if not self.accounts:
-            self._read_accounts()
+        # Один счет -- бинарный поиск в индексе, без создания объектов для всех счетов
         if account_name not in self.accounts:
-            message = f'Account "{account_name}" does not exist'
-            raise JournalException(message)
+            record = self.index.get_account_record(account_name)
+            if record is None:
+                message = f'Account "{account_name}" does not exist'
+                raise JournalException(message)
+            self.accounts[account_name] = self._gen_account(record)
         return self.accounts[account_name]
 
 
     def get_templates_names(self):
-        if not self.templates:
-            self._read_templates()
-        return list(self.templates.keys())
+        return list(self.index.get_templates_names())
+
+
+    def complete_templates_names(self, prefix):
+        return self.index.complete_templates(prefix)
+
+
+    def is_account_open(self, account_name, date):
+        return self.index.is_account_open(account_name, date)
+
+
+    def get_open_accounts_names(self, date):
+        return self.index.get_open_accounts(date)
+
+
+    def complete_accounts_names(self, prefix, status=None, date=None):
+        # status=OPEN с датой -- счета, открытые именно на эту дату
+        if status is None:
+            return self.index.complete_accounts(prefix)
+        if status == AccountStatus.OPEN:
+            return self.index.complete_accounts(prefix, open_only=True, date=date)
+        return [
+            name for name in self.get_accounts_names(status=status)
+            if name.startswith(prefix)
+        ]
 
 
     def get_accounts_names(self, status=None):
-        if not self.accounts:
+        if not self.accounts_loaded:
             self._read_accounts()
         if status is None:
             return list(self.accounts.keys())
@@ -144,24 +223,199 @@ class Journal:
 
 
     def commit(self):
-        text = self.transaction.gen_text()
-        date = self.transaction.get_date()
-        transaction_file = self._gen_transaction_filepath(date)
-        transaction_file.parent.mkdir(parents=True, exist_ok=True)
-        with open(transaction_file, "a") as f:
-            f.write("\n" + text)
-        self.transaction.set(file=transaction_file)
+        self.commit_transactions([self.transaction])
 
 
-    def to_beancount_string(self):
+    def get_beancount_header(self):
         beancount_string = 'option "operating_currency" "RUB"\n'
         beancount_string += 'option "inferred_tolerance_default" "*:0.01"\n'
-        for path_object in self.root_dir.glob(self.beancount_files_glob):
-            with open(path_object.absolute(), 'r') as file_object:
-                beancount_string += file_object.read()
         return beancount_string
 
 
+    def get_beancount_files(self):
+        with span('journal.glob') as args:
+            files = list(self.root_dir.glob(self.beancount_files_glob))
+            args['files'] = len(files)
+        return files
+
+
+    def commit_transactions(self, transactions):
+        for transaction in transactions:
+            transaction_file = self._gen_transaction_filepath(transaction.get_date())
+            self.writer.add(transaction_file, transaction.gen_text())
+            transaction.set(file=transaction_file)
+        files = self.writer.flush()
+
+        self.index.refresh()
+        return files
+
+
+    def to_beancount_string(self):
+        beancount_string = self.get_beancount_header()
+        files = self.get_beancount_files()
+        with span('journal.read', files=len(files)) as args:
+            for path_object in files:
+                with open(path_object.absolute(), 'r') as file_object:
+                    beancount_string += file_object.read()
+            args['chars'] = len(beancount_string)
+        return beancount_string
+
+
+### Journal Writer Class ------------------------------------------------------
+
+class JournalWriter:
+
+    FSYNC_OFF = 'off'
+    FSYNC_NORMAL = 'normal'
+    FSYNC_FULL = 'full'
+
+    FSYNC_POLICIES = [FSYNC_OFF, FSYNC_NORMAL, FSYNC_FULL]
+    FSYNC_DEFAULT = FSYNC_NORMAL
+
+    FSYNC_VAR = 'MONEYCTL_FSYNC'
+
+    def __init__(self, journal, fsync=None):
+        self.journal = journal
+        self.fsync = fsync or os.environ.get(self.FSYNC_VAR) or self.FSYNC_DEFAULT
+        self.lock_file = journal.state_dir / 'journal.lock'
+        self.intent_file = journal.state_dir / 'commit.wal'
+        self.queue = []
+        self.lock_fd = None
+        self.lock_depth = 0
+
+
+    def set(self, fsync=None):
+        if fsync is not None:
+            self.fsync = fsync
+
+
+    def _validate_fsync(self):
+        if self.fsync not in self.FSYNC_POLICIES:
+            message = f'Fsync policy "{self.fsync}" is not supported'
+            raise JournalException(message)
+
+
+    @contextmanager
+    def lock(self):
+        # Рекомендательная блокировка на весь журнал; вложенные вызовы не блокируются повторно
+        if self.lock_depth == 0:
+            self.journal.state_dir.mkdir(parents=True, exist_ok=True)
+            lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                self.recover()
+            except BaseException:
+                os.close(lock_fd)
+                raise
+            self.lock_fd = lock_fd
+        self.lock_depth += 1
+        try:
+            yield
+        finally:
+            self.lock_depth -= 1
+            if self.lock_depth == 0:
+                os.close(self.lock_fd)
+                self.lock_fd = None
+
+
+    def add(self, filepath, text):
+        self.queue.append((filepath, text))
+
+
+    def _fsync_dir(self, dirpath):
+        dir_fd = os.open(dirpath, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+    def _append(self, filepath, data):
+        fd = os.open(filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            while data:
+                written = os.write(fd, data)
+                data = data[written:]
+            if self.fsync != self.FSYNC_OFF:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+    def _write_intent(self, chunks):
+        # Журнал намерений: что и с какого размера дописывается в каждый файл
+        intent = [[str(filepath), size, data.decode('utf-8')] for filepath, (size, data) in chunks.items()]
+        tmp_file = self.intent_file.with_name(f'{self.intent_file.name}.{os.getpid()}.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as file_object:
+            json.dump(intent, file_object, ensure_ascii=False)
+            if self.fsync == self.FSYNC_FULL:
+                file_object.flush()
+                os.fsync(file_object.fileno())
+        os.replace(tmp_file, self.intent_file)
+        if self.fsync == self.FSYNC_FULL:
+            self._fsync_dir(self.journal.state_dir)
+
+
+    def recover(self):
+        # Commit, прерванный посреди записи, дописывается до конца (roll forward)
+        try:
+            with open(self.intent_file, 'r', encoding='utf-8') as file_object:
+                intent = json.load(file_object)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            # Намерение записано не полностью -- файлы журнала еще не тронуты
+            self.intent_file.unlink()
+            return
+
+        for path, size, text in intent:
+            filepath = Path(path)
+            data = text.encode('utf-8')
+            current_size = filepath.stat().st_size if filepath.exists() else 0
+            tail = b''
+            if current_size > size:
+                with open(filepath, 'rb') as file_object:
+                    file_object.seek(size)
+                    tail = file_object.read()
+            if current_size < size or not data.startswith(tail):
+                message = f'Cannot recover interrupted commit: file "{path}" was modified'
+                raise JournalException(message)
+            if len(tail) < len(data):
+                self._append(filepath, data[len(tail):])
+        self.intent_file.unlink()
+
+
+    def flush(self):
+        self._validate_fsync()
+        if not self.queue:
+            return []
+
+        # Все тексты одного файла дописываются одним вызовом write
+        texts_by_file = {}
+        for filepath, text in self.queue:
+            texts_by_file.setdefault(filepath, []).append(text)
+        self.queue = []
+
+        with self.lock():
+            chunks = {}
+            for filepath, texts in texts_by_file.items():
+                new_dir = not filepath.parent.is_dir()
+                filepath.parent.mkdir(parents=True, exist_ok=True)
+                if new_dir and self.fsync == self.FSYNC_FULL:
+                    self._fsync_dir(filepath.parent.parent)
+                size = filepath.stat().st_size if filepath.exists() else 0
+                chunks[filepath] = (size, ''.join('\n' + text for text in texts).encode('utf-8'))
+
+            self._write_intent(chunks)
+            for filepath, (_, data) in chunks.items():
+                self._append(filepath, data)
+                if self.fsync == self.FSYNC_FULL:
+                    self._fsync_dir(filepath.parent)
+            self.intent_file.unlink()
+
+        return list(chunks)
+
+
 ### Account Classes -----------------------------------------------------------
 
 class AccountStatus(Enum):
@@ -178,9 +432,10 @@ class Account:
         self.close_date = None
         self.status = None
         self.commodity = None
+        self.intervals = []
         
     def set(self, name=None, open_date=None, close_date=None,
-            status=None, commodity=None):
+            status=None, commodity=None, intervals=None):
         if name:
            self.name = name
         if open_date:
@@ -191,6 +446,8 @@ class Account:
             self.status = status
         if commodity:
             self.commodity = commodity
+        if intervals:
+            self.intervals = intervals
 
     def get_status(self):
         return self.status
@@ -201,11 +458,16 @@ class Account:
     def get_commodity(self):
         return self.commodity
 
-    def validate(self):
-        # проверить что commodity существует
-        # проверить что существует open_date
-        # проверить что close_date старее open_date
-        pass
+    def validate(self, date=None):
+        if not self.intervals:
+            message = f'Account "{self.name}" is never opened'
+            raise JournalException(message)
+        if self.commodity is None:
+            message = f'Account "{self.name}" has no commodity'
+            raise JournalException(message)
+        if date is not None and not self.journal.is_account_open(self.name, date):
+            message = f'Account "{self.name}" is not open on {date.strftime("%Y-%m-%d")}'
+            raise JournalException(message)
 
 
 ### Commodity Classes ---------------------------------------------------------
@@ -316,8 +578,8 @@ class Transaction:
 
 
     def _validate_accounts(self):
-        self.account_to.validate()
-        self.account_from.validate()
+        self.account_to.validate(self.date)
+        self.account_from.validate(self.date)
         if self.account_from.get_name() == self.account_to.get_name():
             message = 'Transaction "account_from" and "account_to" should not be equal'
             raise TransactionException(message)
@@ -360,6 +622,13 @@ class Transaction:
         return self.date
 
 
+    def get_postings(self):
+        return [
+            (self.account_from.get_name(), -self.amount_from, self.account_from.get_commodity().get_ticker()),
+            (self.account_to.get_name(), self.amount_to, self.account_to.get_commodity().get_ticker()),
+        ]
+
+
     def gen_text(self):
         date_str = self.date.strftime("%Y-%m-%d")
 
@@ -388,19 +657,157 @@ class Transaction:
 ### Template Classes ----------------------------------------------------------
 
 class Template(Transaction):
-    def __init__(self, journal, filepath):
+    def __init__(self, journal, fields):
         super().__init__(journal)
-        with open(filepath, 'rb') as f:
-            data = tomllib.load(f)
-            if "amount_from" in data:
-                self.amount_from = data["amount_from"]
-            if "amount_to" in data:
-                self.amount_to = data["amount_to"]
-            if "comment" in data:
-                self.comment = data["comment"]
-            if "date" in data:
-                self.date = datetime.strptime(data["date"], "%Y-%m-%d")
-            if "account_from" in data:
-                self.account_from = self.journal.get_account(data["account_from"])
-            if "account_to" in data:
-                self.account_to = self.journal.get_account(data["account_to"])
+        if "amount_from" in fields:
+            self.amount_from = fields["amount_from"]
+        if "amount_to" in fields:
+            self.amount_to = fields["amount_to"]
+        if "comment" in fields:
+            self.comment = fields["comment"]
+        if "date" in fields:
+            self.date = datetime.date.fromisoformat(fields["date"])
+        if "account_from" in fields:
+            self.account_from = self.journal.get_account(fields["account_from"])
+        if "account_to" in fields:
+            self.account_to = self.journal.get_account(fields["account_to"])
+
+
+class TemplateRegistry:
+
+    ACCOUNT_FIELDS = ['account_from', 'account_to']
+    AMOUNT_FIELDS = ['amount_from', 'amount_to']
+    FIELDS = ACCOUNT_FIELDS + AMOUNT_FIELDS + ['comment', 'date']
+
+    YAML_NULLS = ['', '~', 'null', 'Null', 'NULL']
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.templates = {}
+
+
+    def invalidate(self):
+        self.templates = {}
+
+
+    def _parse_yaml_value(self, value):
+        if value[:1] == '"':
+            return json.loads(value)
+        if value[:1] == "'":
+            if len(value) < 2 or value[-1] != "'":
+                raise ValueError(f'unterminated string {value}')
+            return value[1:-1].replace("''", "'")
+        if value in self.YAML_NULLS:
+            return None
+        for value_type in (int, float):
+            try:
+                return value_type(value)
+            except ValueError:
+                pass
+        return value
+
+
+    def _parse_yaml(self, text):
+        # Шаблон -- плоский словарь "ключ: значение"; вложенные структуры YAML не нужны
+        data = {}
+        for lineno, line in enumerate(text.splitlines(), start=1):
+            stripped = line.strip()
+            if not stripped or stripped.startswith('#') or stripped == '---':
+                continue
+            key, separator, value = stripped.partition(':')
+            if line[0].isspace() or not separator or not key:
+                raise ValueError(f'line {lineno}: expected "key: value"')
+            value = value.strip()
+            if value[:1] not in ('"', "'") and ' #' in value:
+                value = value[:value.index(' #')].rstrip()
+            try:
+                data[key.strip()] = self._parse_yaml_value(value)
+            except ValueError as e:
+                raise ValueError(f'line {lineno}: {e}')
+        return data
+
+
+    def _read(self, path_object):
+        if path_object.suffix == '.toml':
+            with open(path_object, 'rb') as file_object:
+                return tomllib.load(file_object)
+        with open(path_object, 'r', encoding='utf-8') as file_object:
+            return self._parse_yaml(file_object.read())
+
+
+    def _compile_fields(self, data, accounts_names):
+        fields = {}
+        errors = []
+        for key, value in data.items():
+            if key not in self.FIELDS:
+                errors.append(f'Unknown field "{key}"')
+            elif value is None:
+                continue
+            elif key in self.ACCOUNT_FIELDS:
+                if not isinstance(value, str) or value not in accounts_names:
+                    errors.append(f'Account "{value}" does not exist')
+                fields[key] = value
+            elif key in self.AMOUNT_FIELDS:
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+                    errors.append(f'Field "{key}" should be a number greater then zero')
+                fields[key] = value
+            elif key == 'date':
+                try:
+                    value = value if isinstance(value, datetime.date) else datetime.date.fromisoformat(value)
+                    fields[key] = value.isoformat()
+                except (TypeError, ValueError):
+                    errors.append('Field "date" should be a date in format YYYY-MM-DD')
+            else:
+                if not isinstance(value, str):
+                    errors.append(f'Field "{key}" should be a string')
+                fields[key] = value
+        if 'account_from' in fields and fields.get('account_from') == fields.get('account_to'):
+            errors.append('Fields "account_from" and "account_to" should not be equal')
+        return fields, errors
+
+
+    def compile(self, accounts_names):
+        # Все шаблоны разбираются и проверяются один раз -- при перестроении индекса журнала
+        records = {}
+        for path_object in self.journal.get_templates_files():
+            name = path_object.stem
+            if name in records:
+                message = f'Template "{name}" is already defined in file "{records[name][1]}"'
+                records[name][3].append(message)
+                continue
+            try:
+                data = self._read(path_object)
+            except (OSError, UnicodeDecodeError, ValueError) as e:
+                records[name] = [name, str(path_object), {}, [f'Cannot parse template: {e}']]
+                continue
+            fields, errors = self._compile_fields(data, accounts_names)
+            records[name] = [name, str(path_object), fields, errors]
+        return [records[name] for name in sorted(records)]
+
+
+    def get(self, template_name):
+        # Загружается только запрошенный шаблон из уже скомпилированной записи индекса
+        if template_name not in self.templates:
+            record = self.journal.index.get_template_record(template_name)
+            if record is None:
+                message = f'Template "{template_name}" does not exist'
+                raise JournalException(message)
+            _, filename, fields, errors = record
+            if errors:
+                message = f'Template "{template_name}" in file "{filename}" is broken: {"; ".join(errors)}'
+                raise JournalException(message)
+            self.templates[template_name] = Template(self.journal, fields)
+        return self.templates[template_name]
+
+
+    def get_errors(self):
+        return [(filename, message) for _, filename, message in self.journal.index.get_templates_errors()]
+
+
+    def gen_warnings(self, skipped=None):
+        # Предупреждения о сломанных шаблонах, кроме skipped: его ошибка и так прервет команду
+        return [
+            f'Warning: template "{filename}": {message}'
+            for name, filename, message in self.journal.index.get_templates_errors()
+            if name != skipped
+        ]
@@ -0,0 +1,296 @@
+import io
+import os
+import sys
+import pickle
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import beancount
+import beancount.loader
+import beancount.parser.parser
+import beancount.parser.booking
+import beancount.parser.printer
+import beancount.ops.validation
+from beancount.core import data
+
+from moneyctl.cache import LedgerCache
+from moneyctl.trace import span
+
+
+# Classes =====================================================================
+
+class LoaderException(BaseException):
+    def __init__(self, message=None):
+        super().__init__(message)
+
+
+### Parse Cache Class ---------------------------------------------------------
+
+class ParseCache:
+
+    FILE_SUFFIX = '.pickle'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+
+    def _gen_filepath(self, path_object):
+        name = hashlib.sha256(str(path_object.absolute()).encode()).hexdigest()
+        return self.cache_dir / f'{name}{self.FILE_SUFFIX}'
+
+
+    def contains(self, path_object, content_hash):
+        # Хеш -- отдельный первый pickle: результат разбора не загружается
+        try:
+            with open(self._gen_filepath(path_object), 'rb') as file_object:
+                return pickle.load(file_object) == content_hash
+        except Exception:
+            return False
+
+
+    def get(self, path_object, content_hash):
+        try:
+            with open(self._gen_filepath(path_object), 'rb') as file_object:
+                if pickle.load(file_object) != content_hash:
+                    return None
+                return pickle.load(file_object)
+        except Exception:
+            return None
+
+
+    @staticmethod
+    def dumps(content_hash, parse_result):
+        return (pickle.dumps(content_hash, protocol=pickle.HIGHEST_PROTOCOL)
+                + pickle.dumps(parse_result, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+    @staticmethod
+    def loads(payload):
+        file_object = io.BytesIO(payload)
+        pickle.load(file_object)
+        return pickle.load(file_object)
+
+
+    def write(self, path_object, payload):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        filepath = self._gen_filepath(path_object)
+        tmp_filepath = filepath.with_name(f'{filepath.name}.{os.getpid()}.tmp')
+        with open(tmp_filepath, 'wb') as file_object:
+            file_object.write(payload)
+        tmp_filepath.replace(filepath)
+
+
+    def put(self, path_object, content_hash, parse_result):
+        self.write(path_object, self.dumps(content_hash, parse_result))
+
+
+    def prune(self, paths):
+        # Удаляем результаты разбора файлов, которых больше нет в журнале
+        if not self.cache_dir.is_dir():
+            return
+        alive = {self._gen_filepath(path_object).name for path_object in paths}
+        for path_object in self.cache_dir.glob(f'*{self.FILE_SUFFIX}'):
+            if path_object.name not in alive:
+                path_object.unlink(missing_ok=True)
+
+
+### Ledger Loader Class -------------------------------------------------------
+
+class LedgerLoader:
+
+    MODE_STRING = 'string'
+    MODE_INCREMENTAL = 'incremental'
+    MODE_PARALLEL = 'parallel'
+
+    MODE_DEFAULT = MODE_INCREMENTAL
+
+    MODES = [MODE_STRING, MODE_INCREMENTAL, MODE_PARALLEL]
+
+    # Разбор меньшего объема пул процессов не окупает: запуск и pickle дороже
+    PARALLEL_MIN_BYTES = 2 * 1024 * 1024
+    GROUPS_PER_WORKER = 4
+
+    def __init__(self, journal, mode=MODE_DEFAULT, cache=True, workers=None):
+        self.journal = journal
+        self.mode = mode
+        self.cache = cache
+        self.workers = workers or os.cpu_count() or 1
+        self.ledger_cache = LedgerCache(journal.cache_dir)
+        self.parse_cache = ParseCache(journal.cache_dir / 'files')
+        self.parsed_files_count = 0
+        # Отпечаток версии журнала в кеше; None -- журнал загружен без кеша
+        self.fingerprint = None
+        # {path_object: parse_result} -- разобрано пулом процессов до последовательного прохода
+        self.prefetched = {}
+
+
+    def _validate_mode(self):
+        if self.mode not in self.MODES:
+            message = f'Loader does not support "{self.mode}" mode'
+            raise LoaderException(message)
+
+
+    @staticmethod
+    def log_errors(errors):
+        if errors:
+            beancount.parser.printer.print_errors(errors, file=sys.stderr)
+
+
+    def _parse_file(self, path_object, content_hash):
+        if path_object in self.prefetched:
+            return self.prefetched.pop(path_object)
+        if self.cache:
+            parse_result = self.parse_cache.get(path_object, content_hash)
+            if parse_result is not None:
+                return parse_result
+        parse_result = beancount.parser.parser.parse_file(str(path_object.absolute()))
+        self.parsed_files_count += 1
+        if self.cache:
+            self.parse_cache.put(path_object, content_hash, parse_result)
+        return parse_result
+
+
+    def _merge_options(self, options, file_options):
+        # Та же семантика, что у include в beancount, плюс плагины из любого файла
+        beancount.loader.aggregate_options_map(options, file_options)
+        for plugin in file_options['plugin']:
+            if plugin not in options['plugin']:
+                options['plugin'].append(plugin)
+
+
+    def _book(self, entries, errors, options):
+        with span('loader.book', entries=len(entries)):
+            entries.sort(key=data.entry_sortkey)
+            entries, balance_errors = beancount.parser.booking.book(entries, options)
+            errors.extend(balance_errors)
+
+        with span('loader.transform'):
+            entries, errors = beancount.loader.run_transformations(entries, errors, options, None)
+
+        with span('loader.validate') as args:
+            valid_errors = beancount.ops.validation.validate(entries, options, None, None)
+            errors.extend(valid_errors)
+            args['errors'] = len(errors)
+
+        return entries, errors, options
+
+
+    def _gen_groups(self, files):
+        # Жадная раскладка по объему: самый большой файл -- в самую легкую группу
+        count = min(len(files), self.workers * self.GROUPS_PER_WORKER)
+        groups = [[] for _ in range(count)]
+        sizes = [0] * count
+        for path_object, size, content_hash in sorted(files, key=lambda file: file[1], reverse=True):
+            index = sizes.index(min(sizes))
+            groups[index].append((path_object, content_hash))
+            sizes[index] += size
+        return groups
+
+
+    def _prefetch_parallel(self, records):
+        # Восстановление объектов из pickle стоит столько же, сколько разбор, поэтому
+        # пул выгоден только вместе с кешем: воркер разбирает файл и сам пишет его
+        # в кеш, а основному процессу остается один pickle.loads вместо разбора и dump
+        if not self.cache or self.workers < 2:
+            return
+
+        missed = []
+        for path_object, size, _, content_hash in records:
+            if not self.parse_cache.contains(path_object, content_hash):
+                missed.append((path_object, size, content_hash))
+
+        # Маленький журнал -- последовательно, файлы разберет _parse_file
+        missed_bytes = sum(size for _, size, _ in missed)
+        if len(missed) < 2 or missed_bytes < self.PARALLEL_MIN_BYTES:
+            return
+
+        groups = self._gen_groups(missed)
+        with span('loader.parse_parallel', files=len(missed), bytes=missed_bytes,
+                  groups=len(groups), workers=self.workers):
+            try:
+                with ProcessPoolExecutor(max_workers=min(self.workers, len(groups))) as executor:
+                    cache_dirs = [self.parse_cache.cache_dir] * len(groups)
+                    for group_results in executor.map(parse_files_group, groups, cache_dirs):
+                        for path_object, payload in group_results:
+                            self.prefetched[path_object] = ParseCache.loads(payload)
+                            self.parsed_files_count += 1
+            except (OSError, BrokenProcessPool):
+                # Пул недоступен (ограничения окружения) -- остаток разберется последовательно
+                pass
+
+
+    def _load_incremental(self, records):
+        entries, errors, options = beancount.parser.parser.parse_string(
+            self.journal.get_beancount_header())
+
+        with span('loader.parse', files=len(records), bytes=sum(record[1] for record in records)) as args:
+            for path_object, _, _, content_hash in records:
+                file_entries, file_errors, file_options = self._parse_file(path_object, content_hash)
+                entries.extend(file_entries)
+                errors.extend(file_errors)
+                self._merge_options(options, file_options)
+            args['parsed_files'] = self.parsed_files_count
+            args['entries'] = len(entries)
+
+        if self.cache:
+            self.parse_cache.prune([record[0] for record in records])
+
+        return self._book(entries, errors, options)
+
+
+    def _load_string(self):
+        beancount_string = self.journal.to_beancount_string()
+        with span('loader.load_string', chars=len(beancount_string)) as args:
+            ledger = beancount.loader.load_string(beancount_string)
+            args['entries'] = len(ledger[0])
+        return ledger
+
+
+    def _load_uncached(self, records):
+        if self.mode == self.MODE_STRING:
+            return self._load_string()
+        if self.mode == self.MODE_PARALLEL:
+            self._prefetch_parallel(records)
+        return self._load_incremental(records)
+
+
+    def load(self, quiet=False):
+        self._validate_mode()
+        files = self.journal.get_beancount_files()
+        with span('loader.describe', files=len(files)) as args:
+            records = self.ledger_cache.describe(files)
+            args['bytes'] = sum(record[1] for record in records)
+
+        if self.cache:
+            # Параллельный разбор дает тот же журнал, что и инкрементальный -- кеш общий
+            cache_mode = self.MODE_INCREMENTAL if self.mode == self.MODE_PARALLEL else self.mode
+            salt = f'{beancount.__version__}\0{cache_mode}\0{self.journal.get_beancount_header()}'
+            fingerprint = self.ledger_cache.fingerprint_records(records, salt=salt)
+            self.fingerprint = fingerprint
+            with span('loader.cache_get') as args:
+                ledger = self.ledger_cache.get(fingerprint)
+                args['hit'] = ledger is not None
+            if ledger is None:
+                ledger = self._load_uncached(records)
+                with span('loader.cache_put'):
+                    self.ledger_cache.put(fingerprint, ledger)
+        else:
+            ledger = self._load_uncached(records)
+
+        if not quiet:
+            self.log_errors(ledger[1])
+        return ledger
+
+
+# Functions ===================================================================
+
+def parse_files_group(files, cache_dir):
+    # Выполняется в процессе пула: результат уже сериализован и записан в кеш
+    parse_cache = ParseCache(cache_dir)
+    results = []
+    for path_object, content_hash in files:
+        parse_result = beancount.parser.parser.parse_file(str(path_object.absolute()))
+        payload = ParseCache.dumps(content_hash, parse_result)
+        parse_cache.write(path_object, payload)
+        results.append((path_object, payload))
+    return results
@@ -0,0 +1,287 @@
+import sqlite3
+from decimal import Decimal
+
+import pandas as pd
+from beancount.core import data
+
+from moneyctl.cache import LedgerCache
+from moneyctl.loader import LedgerLoader
+from moneyctl.report import Report, ReportException
+
+
+# Classes =====================================================================
+
+class MirrorException(ReportException):
+    def __init__(self, message=None):
+        super().__init__(message)
+
+
+### Decimal Sum Class ---------------------------------------------------------
+
+class DecimalSum:
+
+    # sum() SQLite складывает REAL: 10.10 + 20.20 = 30.599999999999998;
+    # здесь сумма точная, а в REAL переводится один раз
+    def __init__(self):
+        self.total = None
+
+
+    def step(self, value):
+        if value is None:
+            return
+        number = Decimal(repr(value)) if isinstance(value, float) else Decimal(str(value))
+        self.total = number if self.total is None else self.total + number
+
+
+    def finalize(self):
+        # Всегда REAL: столбец одного типа сортируется ORDER BY по значению
+        return float(self.total) if self.total is not None else None
+
+
+class DecimalTotal(DecimalSum):
+
+    # total() в SQLite -- как sum(), но 0 вместо NULL
+    def finalize(self):
+        return super().finalize() if self.total is not None else 0.0
+
+
+class DecimalText(DecimalSum):
+
+    # decimal_sum() -- точная сумма текстом, всегда TEXT; сортировка -- ORDER BY ... COLLATE DECIMAL
+    def finalize(self):
+        return str(self.total) if self.total is not None else None
+
+
+### Ledger Mirror Class -------------------------------------------------------
+
+class LedgerMirror:
+
+    MIRROR_FORMAT_VERSION = 2
+
+    # Суммы хранятся точным текстом: тип DECIMAL читается как Decimal,
+    # сравнение и сортировка -- по значению через одноименную сортировку
+    DECIMAL_TYPE = 'DECIMAL'
+
+    # Записи без исходного файла (опции заголовка, плагины) пересобираются при каждой синхронизации
+    GENERATED_FILE = ''
+
+    SCHEMA = '''
+        CREATE TABLE files (
+            path TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL
+        );
+        CREATE TABLE entries (
+            id INTEGER PRIMARY KEY,
+            file TEXT NOT NULL,
+            lineno INTEGER,
+            date TEXT NOT NULL,
+            type TEXT NOT NULL,
+            flag TEXT,
+            payee TEXT,
+            narration TEXT,
+            account TEXT,
+            currencies TEXT
+        );
+        CREATE TABLE postings (
+            id INTEGER PRIMARY KEY,
+            entry_id INTEGER NOT NULL,
+            file TEXT NOT NULL,
+            date TEXT NOT NULL,
+            flag TEXT,
+            account TEXT NOT NULL,
+            number DECIMAL TEXT COLLATE DECIMAL,
+            currency TEXT,
+            cost_number DECIMAL TEXT COLLATE DECIMAL,
+            cost_currency TEXT,
+            price_number DECIMAL TEXT COLLATE DECIMAL,
+            price_currency TEXT
+        );
+        CREATE TABLE prices (
+            id INTEGER PRIMARY KEY,
+            file TEXT NOT NULL,
+            date TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            quote_currency TEXT NOT NULL,
+            number DECIMAL TEXT COLLATE DECIMAL NOT NULL
+        );
+        CREATE VIEW accounts AS
+            SELECT
+                o.account AS name,
+                o.date AS open_date,
+                (SELECT min(c.date) FROM entries c WHERE c.type = 'close' AND c.account = o.account) AS close_date,
+                o.currencies AS currencies
+            FROM entries o
+            WHERE o.type = 'open';
+        CREATE INDEX entries_file ON entries (file);
+        CREATE INDEX entries_date ON entries (date);
+        CREATE INDEX entries_account ON entries (account);
+        CREATE INDEX postings_file ON postings (file);
+        CREATE INDEX postings_entry ON postings (entry_id);
+        CREATE INDEX postings_date ON postings (date);
+        CREATE INDEX postings_account ON postings (account, date);
+        CREATE INDEX postings_currency ON postings (currency, date);
+        CREATE INDEX prices_file ON prices (file);
+        CREATE INDEX prices_pair ON prices (currency, quote_currency, date);
+    '''
+
+    TABLES = ['entries', 'postings', 'prices']
+
+    def __init__(self, journal):
+        self.journal = journal
+        self.mirror_file = journal.state_dir / 'mirror.sqlite'
+        self.ledger_cache = LedgerCache(journal.cache_dir)
+        self.synced_files_count = 0
+
+
+    @staticmethod
+    def _compare_decimals(first, second):
+        first, second = Decimal(first), Decimal(second)
+        return (first > second) - (first < second)
+
+
+    @staticmethod
+    def _parse_decimal(value):
+        return Decimal(value.decode())
+
+
+    def _open(self, database, uri=False):
+        sqlite3.register_converter(self.DECIMAL_TYPE, self._parse_decimal)
+        connection = sqlite3.connect(database, uri=uri, detect_types=sqlite3.PARSE_DECLTYPES)
+        connection.create_collation(self.DECIMAL_TYPE, self._compare_decimals)
+        connection.create_aggregate('sum', 1, DecimalSum)
+        connection.create_aggregate('total', 1, DecimalTotal)
+        connection.create_aggregate('decimal_sum', 1, DecimalText)
+        return connection
+
+
+    def _connect(self):
+        self.mirror_file.parent.mkdir(parents=True, exist_ok=True)
+        connection = self._open(self.mirror_file)
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != self.MIRROR_FORMAT_VERSION:
+            # Другая схема -- пересоздаем зеркало целиком
+            connection.close()
+            self.mirror_file.unlink(missing_ok=True)
+            connection = self._open(self.mirror_file)
+            connection.executescript(self.SCHEMA)
+            connection.execute(f'PRAGMA user_version = {self.MIRROR_FORMAT_VERSION}')
+            connection.commit()
+        return connection
+
+
+    @staticmethod
+    def _to_sql_number(number):
+        return str(number) if isinstance(number, Decimal) else None
+
+
+    def _get_entry_file(self, entry, files):
+        filename = entry.meta.get('filename') if entry.meta else None
+        return filename if filename in files else self.GENERATED_FILE
+
+
+    def _insert_entry(self, connection, entry, file):
+        account = getattr(entry, 'account', None)
+        currencies = getattr(entry, 'currencies', None) if isinstance(entry, data.Open) else None
+        cursor = connection.execute(
+            'INSERT INTO entries (file, lineno, date, type, flag, payee, narration, account, currencies) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (file,
+             entry.meta.get('lineno') if entry.meta else None,
+             entry.date.isoformat(),
+             type(entry).__name__.lower(),
+             getattr(entry, 'flag', None),
+             getattr(entry, 'payee', None),
+             getattr(entry, 'narration', None),
+             account,
+             ','.join(currencies) if currencies else None))
+        return cursor.lastrowid
+
+
+    def _insert_entries(self, connection, entries, files, synced_files):
+        for entry in entries:
+            file = self._get_entry_file(entry, files)
+            if file not in synced_files:
+                continue
+            entry_id = self._insert_entry(connection, entry, file)
+            date = entry.date.isoformat()
+
+            if isinstance(entry, data.Transaction):
+                connection.executemany(
+                    'INSERT INTO postings (entry_id, file, date, flag, account, number, currency, '
+                    'cost_number, cost_currency, price_number, price_currency) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(entry_id, file, date, posting.flag, posting.account,
+                      self._to_sql_number(posting.units.number) if posting.units else None,
+                      posting.units.currency if posting.units else None,
+                      self._to_sql_number(posting.cost.number) if posting.cost else None,
+                      posting.cost.currency if posting.cost else None,
+                      self._to_sql_number(posting.price.number) if posting.price else None,
+                      posting.price.currency if posting.price else None)
+                     for posting in entry.postings])
+
+            elif isinstance(entry, data.Price):
+                connection.execute(
+                    'INSERT INTO prices (file, date, currency, quote_currency, number) VALUES (?, ?, ?, ?, ?)',
+                    (file, date, entry.currency, entry.amount.currency, self._to_sql_number(entry.amount.number)))
+
+
+    def sync(self, ledger=None):
+        # Перезаписываются только строки файлов, у которых изменилось содержимое
+        records = self.ledger_cache.describe(self.journal.get_beancount_files())
+        current = {str(path_object.absolute()): content_hash for path_object, _, _, content_hash in records}
+
+        connection = self._connect()
+        try:
+            mirrored = dict(connection.execute('SELECT path, content_hash FROM files'))
+            changed = {path for path, content_hash in current.items() if mirrored.get(path) != content_hash}
+            removed = set(mirrored) - set(current)
+            self.synced_files_count = len(changed)
+            if not changed and not removed:
+                return
+
+            if ledger is None:
+                ledger = LedgerLoader(self.journal).load(quiet=True)
+            entries = ledger[0]
+
+            with connection:
+                stale = changed | removed | {self.GENERATED_FILE}
+                for table in self.TABLES:
+                    connection.executemany(f'DELETE FROM {table} WHERE file = ?', [(path,) for path in stale])
+                connection.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in removed])
+
+                self._insert_entries(connection, entries, current, changed | {self.GENERATED_FILE})
+
+                connection.executemany('INSERT OR REPLACE INTO files (path, content_hash) VALUES (?, ?)',
+                                       [(path, current[path]) for path in changed])
+        finally:
+            connection.close()
+
+
+    def _convert_value(self, value):
+        # Столбцы DECIMAL уже Decimal; REAL (суммы, выражения) печатается отчетом как Decimal
+        if isinstance(value, float):
+            return Decimal(int(value)) if value.is_integer() else Decimal(repr(value))
+        if value is None:
+            return ''
+        if isinstance(value, (int, bytes)):
+            return str(value)
+        return value
+
+
+    def query(self, sql):
+        # Только чтение: запрос пользователя не может испортить зеркало
+        connection = self._open(f'{self.mirror_file.absolute().as_uri()}?mode=ro', uri=True)
+        try:
+            cursor = connection.execute(sql)
+            rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            raise MirrorException(f'Query failed: {e}')
+        finally:
+            connection.close()
+
+        if cursor.description is None or not rows:
+            return Report(None, None, keyed=False)
+        columns = [column[0] for column in cursor.description]
+        dataframe = pd.DataFrame([[self._convert_value(value) for value in row] for row in rows], columns=columns)
+        # Строки запроса не уникальны по первому столбцу
+        return Report(dataframe, None, keyed=False)
@@ -0,0 +1,289 @@
+import re
+import hashlib
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from beancount.core import data
+
+from moneyctl.report import ReportException
+from moneyctl.price_index import PriceIndex
+from moneyctl.trace import span
+
+
+# Classes =====================================================================
+
+class PortfolioException(ReportException):
+    def __init__(self, message=None):
+        super().__init__(message)
+
+
+### Portfolio Config Class ----------------------------------------------------
+
+class PortfolioConfig:
+
+    CUSTOM_TYPE = 'moneyctl-portfolio'
+
+    RULE_EXCLUDE = 'exclude'
+    RULE_GROUP = 'group'
+
+    RULES = [RULE_EXCLUDE, RULE_GROUP]
+
+    # Рубли -- деньги у брокера, а не бумага: исключаются всегда, вместе с правилами exclude
+    OPERATING_CURRENCY = 'RUB'
+
+    # Если в журнале нет правил exclude: FX* -- фонды
+    EXCLUDED_DEFAULT = [OPERATING_CURRENCY, 'FXUS', 'FXIT', 'FXIM']
+
+    def __init__(self, excluded=None, groups=None):
+        if excluded is None:
+            excluded = self.EXCLUDED_DEFAULT
+        self.excluded = [self.OPERATING_CURRENCY] + [
+            currency for currency in excluded if currency != self.OPERATING_CURRENCY]
+        self.groups = groups or []
+
+
+    @classmethod
+    def from_entries(cls, entries):
+        # Правила в любом файле журнала, например в config.bean:
+        #   2022-01-01 custom "moneyctl-portfolio" "exclude" "RUB" "FXUS"
+        #   2022-01-01 custom "moneyctl-portfolio" "group" "Фонды" "FX.*"
+        excluded = None
+        groups = []
+        for entry in entries:
+            if not isinstance(entry, data.Custom) or entry.type != cls.CUSTOM_TYPE:
+                continue
+            values = [str(value) for value, _ in entry.values]
+            rule = values[0] if values else None
+            location = f'{entry.meta.get("filename")}:{entry.meta.get("lineno")}'
+            if rule == cls.RULE_EXCLUDE:
+                excluded = (excluded or []) + values[1:]
+            elif rule == cls.RULE_GROUP and len(values) == 3:
+                try:
+                    groups.append((values[1], re.compile(values[2])))
+                except re.error as e:
+                    message = f'Portfolio group "{values[1]}" has invalid pattern in {location}: {e}'
+                    raise PortfolioException(message)
+            else:
+                message = f'Portfolio rule "{rule}" is not supported in {location}'
+                raise PortfolioException(message)
+        return cls(excluded=excluded, groups=groups)
+
+
+    def is_excluded(self, currency):
+        return currency in self.excluded
+
+
+    def get_group(self, currency):
+        # Первое подходящее правило; валюта без правила -- сама себе группа
+        for name, pattern in self.groups:
+            if pattern.fullmatch(currency):
+                return name
+        return currency
+
+
+### Portfolio Engine Class ----------------------------------------------------
+
+class PortfolioEngine:
+
+    LEVEL_LOT = 'lot'
+    LEVEL_HOLDING = 'holding'
+    LEVEL_GROUP = 'group'
+
+    LEVELS = [LEVEL_LOT, LEVEL_HOLDING, LEVEL_GROUP]
+    LEVEL_DEFAULT = LEVEL_HOLDING
+
+    VALUE_COLUMNS = ['cost', 'value', 'pnl', 'part']
+
+    # Снимок -- DataFrame лотов; другая версия формата не читается из кеша
+    SNAPSHOT_FORMAT_VERSION = 2
+
+    def __init__(self, get_native_engine, price_index, config, cache=None, fingerprint=None):
+        # Таблица проводок нужна только для снимка, которого еще нет в кеше
+        self.get_native_engine = get_native_engine
+        self.price_index = price_index
+        self.config = config
+        self.cache = cache
+        self.fingerprint = fingerprint
+        self._snapshots = {}
+
+
+    def _gen_cache_key(self, include, on_date):
+        key = f'{self.SNAPSHOT_FORMAT_VERSION}\0{self.fingerprint}\0{include}\0{on_date.isoformat() if on_date else "all"}'
+        return hashlib.sha256(key.encode()).hexdigest()
+
+
+    def get_snapshot(self, include, on_date):
+        # Снимок лотов на дату (None -- все проводки): в памяти процесса и на диске для версии журнала
+        if (include, on_date) in self._snapshots:
+            return self._snapshots[(include, on_date)]
+        with span('portfolio.snapshot') as args:
+            snapshot = None
+            use_cache = self.cache is not None and self.fingerprint is not None
+            if use_cache:
+                snapshot = self.cache.get(self._gen_cache_key(include, on_date))
+            args['cached'] = snapshot is not None
+            if snapshot is None:
+                snapshot = self.get_native_engine().lots(include=include, on_date=on_date)
+                if use_cache:
+                    self.cache.put(self._gen_cache_key(include, on_date), snapshot)
+            args['lots'] = len(snapshot)
+        self._snapshots[(include, on_date)] = snapshot
+        return snapshot
+
+
+    def _multiply(self, first, second):
+        return first * second if first is not None and second is not None else None
+
+
+    def _gen_price(self, currency, cost_currency, target, on_date, quote):
+        if quote is not None:
+            # Как FIRST(GETPRICE(currency, quote)) * FIRST(GETPRICE(quote, target)) в BQL
+            second = self.price_index.get_rate(quote, target, on_date) if target != quote else Decimal(1)
+            return self._multiply(self.price_index.get_rate(currency, quote, on_date), second)
+        # Как convert_position: прямой курс, иначе через валюту стоимости лота
+        price = self.price_index.get_rate(currency, target, on_date)
+        if price is None and cost_currency is not None:
+            price = self._multiply(self.price_index.get_rate(currency, cost_currency, on_date),
+                                   self.price_index.get_rate(cost_currency, target, on_date))
+        return price
+
+
+    def _gen_prices(self, frame, target, on_date, quote=None):
+        # Один поиск курса на бумагу, не на лот; столбец цен -- выборкой по номеру бумаги
+        currencies, first, inverse = np.unique(frame['currency'].to_numpy(), return_index=True, return_inverse=True)
+        cost_currencies = frame['cost_currency'].to_numpy()[first]
+        prices = np.empty(len(currencies), dtype=object)
+        prices[:] = [
+            self._gen_price(currency, cost_currency, target, on_date, quote)
+            for currency, cost_currency in zip(currencies.tolist(), cost_currencies.tolist())
+        ]
+        return prices[inverse.reshape(-1)]
+
+
+    def _gen_costs(self, frame, target, on_date):
+        # Стоимость покупки в целевой валюте по курсу на дату лота, одним поиском на валюту стоимости
+        costs = np.full(len(frame), None, dtype=object)
+        known = frame['cost_number'].notna().to_numpy()
+        cost_currencies = frame['cost_currency'].to_numpy()
+        ordinals = frame['ordinal'].to_numpy()
+        rates = np.array(self.price_index.values + [None], dtype=object)
+        rate_ids = np.full(len(frame), PriceIndex.NOT_FOUND, dtype=np.int64)
+        for cost_currency in pd.unique(cost_currencies[known]).tolist():
+            selected = known & (cost_currencies == cost_currency)
+            if cost_currency == target:
+                rate_ids[selected] = PriceIndex.UNCONVERTED
+            else:
+                rate_ids[selected] = self.price_index.lookup(cost_currency, target, ordinals[selected])
+        found = rate_ids != PriceIndex.NOT_FOUND
+        costs[found] = (frame['units'].to_numpy()[found] * frame['cost_number'].to_numpy()[found]
+                        * rates[rate_ids[found]])
+        return costs
+
+
+    def _gen_lots_frame(self, snapshot, target, on_date, quote):
+        # Лоты -- столбцами: дальше цены, стоимости и суммы считаются по столбцам
+        costs = snapshot['cost'].tolist()
+        frame = snapshot[['account', 'currency', 'units']].reset_index(drop=True)
+        frame['date'] = [cost.date.isoformat() if cost is not None and cost.date else '' for cost in costs]
+        frame['ordinal'] = np.array([(cost.date if cost is not None and cost.date else on_date).toordinal()
+                                     for cost in costs], dtype=np.int64)
+        frame['cost_number'] = pd.Series([cost.number if cost is not None else None for cost in costs], dtype=object)
+        frame['cost_currency'] = pd.Series([cost.currency if cost is not None and cost.currency else None
+                                            for cost in costs], dtype=object)
+        frame['price'] = self._gen_prices(frame, target, on_date, quote)
+        frame['cost'] = self._gen_costs(frame, target, on_date)
+        return frame
+
+
+    def _sum_known(self, values):
+        known = [value for value in values if value is not None]
+        return sum(known, Decimal()) if known else None
+
+
+    def _gen_values(self, units, prices):
+        values = np.full(len(units), None, dtype=object)
+        known = pd.notna(prices)
+        values[known] = units[known] * prices[known]
+        return values
+
+
+    def _gen_holdings(self, frame):
+        # Стоимость позиции -- сумма бумаг, умноженная на цену, как SUM(number) * GETPRICE в BQL
+        grouped = frame.groupby('currency', sort=False).agg(
+            units=('units', 'sum'), cost=('cost', self._sum_known), price=('price', 'first'))
+        holdings = pd.DataFrame({
+            'currency': grouped.index.tolist(),
+            'units': grouped['units'].to_numpy(),
+            'cost': grouped['cost'].to_numpy(),
+        })
+        holdings['value'] = self._gen_values(grouped['units'].to_numpy(), grouped['price'].to_numpy())
+        return holdings
+
+
+    def _gen_groups(self, holdings):
+        names = [self.config.get_group(currency) for currency in holdings['currency'].tolist()]
+        grouped = holdings.assign(group=names).groupby('group', sort=False).agg(
+            cost=('cost', self._sum_known), value=('value', self._sum_known))
+        return pd.DataFrame({
+            'group': grouped.index.tolist(),
+            'cost': grouped['cost'].to_numpy(),
+            'value': grouped['value'].to_numpy(),
+        })
+
+
+    def valuate(self, include, target, on_date, level=LEVEL_DEFAULT, all_postings=False, quote=None):
+        # all_postings -- лоты по всем проводкам, включая будущие, как в запросах BQL без даты;
+        # quote -- цены бумаг через эту валюту, как в запросе BQL отчета invest-parts
+        if level not in self.LEVELS:
+            message = f'Portfolio level "{level}" is not supported'
+            raise PortfolioException(message)
+
+        snapshot = self.get_snapshot(include, None if all_postings else on_date)
+        if len(snapshot):
+            snapshot = snapshot[~snapshot['currency'].isin(self.config.excluded)]
+        if not len(snapshot):
+            return None
+        frame = self._gen_lots_frame(snapshot, target, on_date, quote)
+
+        if level == self.LEVEL_LOT:
+            result = pd.DataFrame({
+                'account': frame['account'].str.replace(include, '', regex=False),
+                'currency': frame['currency'],
+                'date': frame['date'],
+                'units': frame['units'],
+                'cost': frame['cost'],
+                'value': self._gen_values(frame['units'].to_numpy(), frame['price'].to_numpy()),
+            })
+        elif level == self.LEVEL_HOLDING:
+            result = self._gen_holdings(frame)
+        else:
+            result = self._gen_groups(self._gen_holdings(frame))
+
+        values = result['value'].to_numpy()
+        costs = result['cost'].to_numpy()
+        known = pd.notna(values) & pd.notna(costs)
+        pnl = np.full(len(result), None, dtype=object)
+        pnl[known] = values[known] - costs[known]
+        result['pnl'] = pnl
+
+        # Доля в портфеле по рыночной стоимости; строки -- по убыванию стоимости
+        total_value = self._sum_known(values)
+        part = np.full(len(result), None, dtype=object)
+        if total_value:
+            known = pd.notna(values)
+            part[known] = values[known] / total_value * 100
+        result['part'] = part
+        order = result.assign(order=[value if value is not None else Decimal() for value in values])
+        order = order.sort_values(['order', result.columns[0]], ascending=False, kind='stable')
+        return order.drop(columns='order').reset_index(drop=True)
+
+
+    def gen_total(self, dataframe):
+        # Суммируются только денежные столбцы: бумаги разных валют не складываются
+        total = {column: '' for column in dataframe.columns}
+        total[dataframe.columns[0]] = 'total'
+        for column in self.VALUE_COLUMNS:
+            column_total = self._sum_known(dataframe[column].tolist())
+            total[column] = column_total if column_total is not None else ''
+        return pd.Series(total)
@@ -0,0 +1,145 @@
+from decimal import Decimal
+
+import numpy as np
+from beancount.core import prices
+
+
+# Classes =====================================================================
+
+### Price Index Class ---------------------------------------------------------
+
+class PriceIndex:
+
+    # Валюта, через которую строятся кросс-курсы пар без прямых цен
+    CROSS_CURRENCY = 'RUB'
+
+    # Курс 0 -- "без конвертации": число остается в исходной валюте
+    UNCONVERTED = 0
+    NOT_FOUND = -1
+
+    POINT_CACHE_SIZE = 1024
+
+    def __init__(self, price_map, cross_currency=CROSS_CURRENCY):
+        self.price_map = price_map
+        self.cross_currency = cross_currency
+        self.currencies = {currency for pair in price_map for currency in pair}
+        self.values = [Decimal(1)]
+        self.exponents = [0]
+        self._exponents_array = None
+        self._series = {}
+        self._composites = {}
+        self._point_cache = {}
+
+
+    @classmethod
+    def from_entries(cls, entries, cross_currency=CROSS_CURRENCY):
+        # build_price_map уже содержит обратные курсы (1 / rate)
+        return cls(prices.build_price_map(entries), cross_currency=cross_currency)
+
+
+    def has_currency(self, currency):
+        return currency == self.cross_currency or currency in self.currencies
+
+
+    def precompute(self):
+        # Ряды курсов по датам для всех пар из цен журнала строятся один раз;
+        # кросс-курс любой пары потом собирается из двух готовых рядов через
+        # cross_currency, поэтому price_map больше не нужен
+        for base, quote in list(self.price_map):
+            self.get_series(base, quote)
+        self.price_map = {}
+        return self
+
+
+    def _add_rate(self, value):
+        self.values.append(value)
+        self.exponents.append(value.as_tuple().exponent)
+        self._exponents_array = None
+        return len(self.values) - 1
+
+
+    def _direct_series(self, base, quote):
+        price_list = self.price_map.get((base, quote))
+        if not price_list:
+            return None
+        dates = np.array([date.toordinal() for date, _ in price_list], dtype=np.int64)
+        ids = np.array([self._add_rate(rate) for _, rate in price_list], dtype=np.int64)
+        return dates, ids
+
+
+    def _cross_series(self, base, quote):
+        if self.cross_currency in (base, quote):
+            return None
+        first = self.get_series(base, self.cross_currency)
+        second = self.get_series(self.cross_currency, quote)
+        if first is None or second is None:
+            return None
+
+        # Кросс-курс меняется в каждую дату, когда меняется любая из двух ног
+        dates = np.union1d(first[0], second[0])
+        first_positions = np.searchsorted(first[0], dates, side='right') - 1
+        second_positions = np.searchsorted(second[0], dates, side='right') - 1
+        found = (first_positions >= 0) & (second_positions >= 0)
+        if not found.any():
+            return None
+        ids = self.composite(first[1][first_positions[found]], second[1][second_positions[found]])
+        return dates[found], ids
+
+
+    def get_series(self, base, quote):
+        if (base, quote) not in self._series:
+            series = self._direct_series(base, quote)
+            if series is None:
+                series = self._cross_series(base, quote)
+            self._series[(base, quote)] = series
+        return self._series[(base, quote)]
+
+
+    def lookup(self, base, quote, dates):
+        # Последний курс на дату или раньше для всего столбца дат сразу
+        series = self.get_series(base, quote)
+        if series is None:
+            return np.full(len(dates), self.NOT_FOUND, dtype=np.int64)
+        series_dates, series_ids = series
+        positions = np.searchsorted(series_dates, dates, side='right') - 1
+        return np.where(positions >= 0, series_ids[positions], self.NOT_FOUND)
+
+
+    def composite(self, first_ids, second_ids):
+        # Произведение двух курсов получает собственный id; повторы не пересчитываются
+        first_ids = np.asarray(first_ids, dtype=np.int64)
+        second_ids = np.asarray(second_ids, dtype=np.int64)
+        if len(first_ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        pairs, inverse = np.unique(np.stack([first_ids, second_ids], axis=1), axis=0, return_inverse=True)
+        ids = []
+        for first_id, second_id in pairs.tolist():
+            if (first_id, second_id) not in self._composites:
+                value = self.values[first_id] * self.values[second_id]
+                self._composites[(first_id, second_id)] = self._add_rate(value)
+            ids.append(self._composites[(first_id, second_id)])
+        return np.array(ids, dtype=np.int64)[inverse.reshape(-1)]
+
+
+    def get_rate_id(self, base, quote, date):
+        # Точечный запрос (обычно на TODAY) с маленьким кешем
+        key = (base, quote, date)
+        if key not in self._point_cache:
+            if len(self._point_cache) >= self.POINT_CACHE_SIZE:
+                self._point_cache.clear()
+            ordinal = np.array([date.toordinal()], dtype=np.int64)
+            self._point_cache[key] = int(self.lookup(base, quote, ordinal)[0])
+        return self._point_cache[key]
+
+
+    def get_rate(self, base, quote, date):
+        if base == quote:
+            return Decimal(1)
+        rate_id = self.get_rate_id(base, quote, date)
+        return self.values[rate_id] if rate_id != self.NOT_FOUND else None
+
+
+    def get_exponents(self, rate_ids):
+        if self._exponents_array is None:
+            self._exponents_array = np.array(self.exponents, dtype=np.int32)
+        return self._exponents_array[rate_ids]
@@ -0,0 +1,345 @@
+import os
+import re
+import json
+import time
+import hashlib
+import datetime
+import threading
+import urllib.parse
+import urllib.request
+from abc import ABC, abstractmethod
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+
+from beancount.core import data
+
+from moneyctl.loader import LedgerLoader
+
+
+# Classes =====================================================================
+
+class PricesException(BaseException):
+    def __init__(self, message=None):
+        super().__init__(message)
+
+
+### Rate Limiter Class --------------------------------------------------------
+
+class RateLimiter:
+
+    def __init__(self, rate=None):
+        # rate -- запросов в секунду; None или 0 -- без ограничения
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = max(0.0, self.next_time - now)
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay:
+            time.sleep(delay)
+
+
+### Response Cache Class ------------------------------------------------------
+
+class ResponseCache:
+
+    FILE_SUFFIX = '.json'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+
+    def _gen_filepath(self, key):
+        name = hashlib.sha256(json.dumps(key).encode()).hexdigest()
+        return self.cache_dir / f'{name}{self.FILE_SUFFIX}'
+
+
+    def get(self, key):
+        try:
+            with open(self._gen_filepath(key), 'r') as file_object:
+                return json.load(file_object)
+        except (FileNotFoundError, ValueError):
+            return None
+
+
+    def put(self, key, response):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        filepath = self._gen_filepath(key)
+        tmp_filepath = filepath.with_name(f'{filepath.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp_filepath, 'w') as file_object:
+            json.dump(response, file_object)
+        os.replace(tmp_filepath, filepath)
+
+
+### Price Fetcher Classes -----------------------------------------------------
+
+class PriceFetcher(ABC):
+
+    SOURCE = None
+
+    def get_symbol(self, commodity, meta):
+        # Идентификатор инструмента у источника; None -- источник его не знает
+        return commodity
+
+
+    @abstractmethod
+    def request(self, symbol, quote, from_, to):
+        # Сырой ответ источника, пригодный для json.dump
+        pass
+
+
+    @abstractmethod
+    def parse(self, response):
+        # [(date, Decimal), ...]
+        pass
+
+
+class InvestingFetcher(PriceFetcher):
+
+    SOURCE = 'investing'
+    META_KEY = 'investing-id'
+    DATE_FORMAT = '%m/%d/%Y'
+
+    def get_symbol(self, commodity, meta):
+        # 2022-01-01 commodity USD
+        #   investing-id: "2186"
+        symbol = meta.get(self.META_KEY) if meta else None
+        return str(symbol) if symbol is not None else None
+
+
+    def request(self, symbol, quote, from_, to):
+        try:
+            from investiny import historical_data
+        except ImportError:
+            message = 'Package "investiny" is required for "investing" prices source'
+            raise PricesException(message)
+        return historical_data(investing_id=int(symbol),
+                               from_date=from_.strftime(self.DATE_FORMAT),
+                               to_date=to.strftime(self.DATE_FORMAT))
+
+
+    def parse(self, response):
+        return [
+            (datetime.datetime.strptime(date, self.DATE_FORMAT).date(), Decimal(str(close)))
+            for date, close in zip(response['date'], response['close'])
+        ]
+
+
+class HttpFetcher(PriceFetcher):
+
+    SOURCE = 'http'
+    DEFAULT_TIMEOUT = 30
+
+    def __init__(self, url, timeout=DEFAULT_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+
+    def request(self, symbol, quote, from_, to):
+        # GET <url>?commodity=USD&quote=RUB&from=2022-01-01&to=2022-12-31
+        # -> [{"date": "2022-01-03", "price": "74.29"}, ...]
+        query = urllib.parse.urlencode({
+            'commodity': symbol,
+            'quote': quote,
+            'from': from_.isoformat(),
+            'to': to.isoformat(),
+        })
+        try:
+            with urllib.request.urlopen(f'{self.url}?{query}', timeout=self.timeout) as response:
+                return json.load(response)
+        except (OSError, ValueError) as e:
+            message = f'Prices request for "{symbol}" failed: {e}'
+            raise PricesException(message)
+
+
+    def parse(self, response):
+        return [(datetime.date.fromisoformat(row['date']), Decimal(str(row['price']))) for row in response]
+
+
+### Price Downloader Class ----------------------------------------------------
+
+class PriceDownloader:
+
+    SOURCES = [InvestingFetcher.SOURCE, HttpFetcher.SOURCE]
+    SOURCE_DEFAULT = InvestingFetcher.SOURCE
+
+    DEFAULT_QUOTE = 'RUB'
+    DEFAULT_WORKERS = 4
+    DEFAULT_RATE_LIMIT = 2.0
+    # Разрыв между ценами длиннее этого (выходные, праздники) считается пропуском
+    DEFAULT_MAX_GAP = 5
+
+    PRICES_FILENAME = 'fetched'
+    PRICE_LINE_REGEX = re.compile(r'^(\d{4}-\d{2}-\d{2})\s+price\s+(\S+)\s+(\S+)\s+(\S+)\s*$')
+
+    def __init__(self, journal, fetcher, quote=DEFAULT_QUOTE, workers=DEFAULT_WORKERS,
+                 rate_limit=DEFAULT_RATE_LIMIT, cache=True, max_gap=DEFAULT_MAX_GAP, today=None):
+        self.journal = journal
+        self.fetcher = fetcher
+        self.quote = quote
+        self.workers = workers
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.response_cache = ResponseCache(journal.state_dir / 'prices-cache' / fetcher.SOURCE) if cache else None
+        self.max_gap = max_gap
+        self.today = today or datetime.date.today()
+
+        self.requests_count = 0
+        self.fetched_count = 0
+        self.requests_lock = threading.Lock()
+
+
+    @classmethod
+    def create_fetcher(cls, source, url=None):
+        if source == InvestingFetcher.SOURCE:
+            return InvestingFetcher()
+        if source == HttpFetcher.SOURCE:
+            if not url:
+                message = f'Prices source "{source}" requires url'
+                raise PricesException(message)
+            return HttpFetcher(url)
+        message = f'Prices source "{source}" is not supported'
+        raise PricesException(message)
+
+
+    def find_held_commodities(self, entries):
+        # {commodity: (первая дата, последняя дата владения)}
+        first_dates = {}
+        last_dates = {}
+        balances = {}
+        for entry in entries:
+            if not isinstance(entry, data.Transaction):
+                continue
+            for posting in entry.postings:
+                if posting.units is None or posting.account.split(':')[0] not in ('Assets', 'Liabilities'):
+                    continue
+                currency = posting.units.currency
+                if currency == self.quote:
+                    continue
+                first_dates.setdefault(currency, entry.date)
+                last_dates[currency] = entry.date
+                balances[currency] = balances.get(currency, Decimal()) + posting.units.number
+
+        return {
+            currency: (first_date, self.today if balances[currency] != 0 else last_dates[currency])
+            for currency, first_date in first_dates.items()
+        }
+
+
+    def _find_existing_dates(self, entries):
+        existing = {}
+        for entry in entries:
+            if isinstance(entry, data.Price) and entry.amount.currency == self.quote:
+                existing.setdefault(entry.currency, set()).add(entry.date)
+        return existing
+
+
+    def _split_by_year(self, from_, to):
+        while from_ <= to:
+            year_end = datetime.date(from_.year, 12, 31)
+            yield from_, min(to, year_end)
+            from_ = year_end + datetime.timedelta(days=1)
+
+
+    def _find_ranges_gaps(self, from_, to, dates):
+        dates = sorted(date for date in dates if from_ <= date <= to)
+        gaps = []
+        previous = from_ - datetime.timedelta(days=1)
+        for date in dates + [to + datetime.timedelta(days=1)]:
+            if (date - previous).days > self.max_gap:
+                gap_from = previous + datetime.timedelta(days=1)
+                gap_to = min(date - datetime.timedelta(days=1), to)
+                if gap_from <= gap_to:
+                    gaps.append((gap_from, gap_to))
+            previous = date
+        return gaps
+
+
+    def find_gaps(self, entries):
+        # [(commodity, symbol, from, to), ...] -- пропуски, разбитые по годам
+        commodities_meta = {entry.currency: entry.meta for entry in entries if isinstance(entry, data.Commodity)}
+        existing = self._find_existing_dates(entries)
+
+        gaps = []
+        for commodity, (from_, to) in sorted(self.find_held_commodities(entries).items()):
+            symbol = self.fetcher.get_symbol(commodity, commodities_meta.get(commodity))
+            if symbol is None:
+                continue
+            for gap_from, gap_to in self._find_ranges_gaps(from_, to, existing.get(commodity, set())):
+                for chunk_from, chunk_to in self._split_by_year(gap_from, gap_to):
+                    gaps.append((commodity, symbol, chunk_from, chunk_to))
+        return gaps
+
+
+    def _fetch(self, gap):
+        commodity, symbol, from_, to = gap
+        key = [self.fetcher.SOURCE, symbol, self.quote, from_.isoformat(), to.isoformat()]
+
+        response = self.response_cache.get(key) if self.response_cache else None
+        if response is None:
+            self.rate_limiter.wait()
+            response = self.fetcher.request(symbol, self.quote, from_, to)
+            with self.requests_lock:
+                self.requests_count += 1
+            # Незавершенный диапазон может дополниться -- его не кешируем
+            if self.response_cache and to < self.today:
+                self.response_cache.put(key, response)
+
+        return [(date, commodity, price) for date, price in self.fetcher.parse(response) if from_ <= date <= to]
+
+
+    def _gen_prices_filepath(self, year):
+        return self.journal.prices_dir / str(year) / f'{self.PRICES_FILENAME}.{self.journal.beancount_files_extension}'
+
+
+    def _read_prices_file(self, filepath):
+        prices = {}
+        if not filepath.exists():
+            return prices
+        with open(filepath, 'r') as file_object:
+            for line in file_object:
+                match = self.PRICE_LINE_REGEX.match(line)
+                if match:
+                    date, commodity, price, quote = match.groups()
+                    prices[(date, commodity, quote)] = price
+        return prices
+
+
+    def _write_prices_file(self, year, new_prices):
+        filepath = self._gen_prices_filepath(year)
+        prices = self._read_prices_file(filepath)
+        for date, commodity, price in new_prices:
+            prices[(date.isoformat(), commodity, self.quote)] = str(price)
+
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        tmp_filepath = filepath.with_name(f'{filepath.name}.{os.getpid()}.tmp')
+        with open(tmp_filepath, 'w') as file_object:
+            for (date, commodity, quote), price in sorted(prices.items()):
+                file_object.write(f'{date} price {commodity} {price} {quote}\n')
+        os.replace(tmp_filepath, filepath)
+        return filepath
+
+
+    def run(self, dry_run=False, ledger=None):
+        if ledger is None:
+            ledger = LedgerLoader(self.journal).load(quiet=True)
+        gaps = self.find_gaps(ledger[0])
+        if dry_run or not gaps:
+            return gaps
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(self._fetch, gaps))
+
+        prices_by_year = {}
+        for prices in results:
+            for price in prices:
+                prices_by_year.setdefault(price[0].year, []).append(price)
+                self.fetched_count += 1
+
+        for year, prices in sorted(prices_by_year.items()):
+            self._write_prices_file(year, prices)
+
+        return gaps
@@ -1,8 +1,11 @@
-from rich.console import Console
-from rich.table import Table
-from rich import box
-import pandas as pd
+import sys
+import csv
+import json
+import math
 import decimal
+from json.encoder import encode_basestring
+
+from moneyctl.trace import span
 
 
 # Classes =====================================================================
@@ -19,27 +22,45 @@ class Report:
     FORMAT_MD_TABLE = 'md-table'
     FORMAT_JSON = 'json'
     FORMAT_CSV = 'csv'
+    FORMAT_NDJSON = 'ndjson'
 
     FORMAT_DEFAULT = FORMAT_TABLE
 
-    FORMATS = [FORMAT_TABLE, FORMAT_MD_TABLE, FORMAT_JSON, FORMAT_CSV]
+    FORMATS = [FORMAT_TABLE, FORMAT_MD_TABLE, FORMAT_JSON, FORMAT_CSV, FORMAT_NDJSON]
+
+    FORMATS_EXTENSIONS = {
+        FORMAT_TABLE: 'txt',
+        FORMAT_MD_TABLE: 'md',
+        FORMAT_JSON: 'json',
+        FORMAT_CSV: 'csv',
+        FORMAT_NDJSON: 'ndjson',
+    }
 
     def get_formats_names(self):
         return self.FORMATS
 
+    def get_format_extension(self):
+        return self.FORMATS_EXTENSIONS[self.format]
+
     def get_default_format_name(self):
         return self.FORMAT_DEFAULT
 
-    def __init__(self, report_dataframe=None, total_dataframe=None):
+    def __init__(self, report_dataframe=None, total_dataframe=None, keyed=True):
         self.report_dataframe = report_dataframe
         self.total_dataframe = total_dataframe
+        # keyed -- строки в JSON объектом по первому столбцу (счет, валюта), иначе списком;
+        # форма задается типом отчета и не зависит от данных
+        self.keyed = keyed
         self.rounding = True
         self.format = self.get_default_format_name()
+        self.title = None
+        self.file = None
         # TODO раскрашивать вывод или нет
         # TODO раскрашивать accounts
 
 
-    def set(self, report_dataframe=None, total_dataframe=None, format=None, rounding=None):
+    def set(self, report_dataframe=None, total_dataframe=None, format=None, rounding=None,
+            title=None, file=None):
         if report_dataframe is not None:
             self.report_dataframe = report_dataframe
         if total_dataframe is not None:
@@ -48,6 +69,10 @@ class Report:
             self.rounding = rounding
         if format is not None:
             self.format = format
+        if title is not None:
+            self.title = title
+        if file is not None:
+            self.file = file
 
     def _validate_format(self):
         if self.format not in self.FORMATS:
@@ -55,22 +80,44 @@ class Report:
             raise ReportException(message)
 
     def is_empty(self):
-        if isinstance(self.report_dataframe, pd.DataFrame):
-            return False
-        else:
+        if self.report_dataframe is None:
             return True
+        else:
+            return False
 
     def validate(self):
         self._validate_format()
 
     def _print_csv(self):
         if self.is_empty():
-            print('')
+            print('', file=self.file)
         else:
-            print(self.report_dataframe.to_csv())
+            print(self.report_dataframe.to_csv(), file=self.file)
+
+    def _encode_columns(self):
+        # Кодируем по столбцам: одна операция на столбец вместо форматирования каждой ячейки
+        columns = list(self.report_dataframe.columns)
+        encoded = [encode_json_column(self.report_dataframe[column].tolist()) for column in columns]
+        return columns, encoded
+
+    def _print_ndjson(self):
+        if self.is_empty():
+            return
+        columns, encoded = self._encode_columns()
+        template = gen_json_object_template(columns)
+        lines = [template % row for row in zip(*encoded)]
+        lines.append('')
+        print('\n'.join(lines), end='', file=self.file)
+
+    def _validate_keys(self):
+        # Повторяющиеся ключи JSON молча теряли бы строки
+        keys = self.report_dataframe[self.report_dataframe.columns[0]]
+        if not keys.is_unique:
+            message = f'Report key "{keys.name}" is not unique, JSON object would lose rows'
+            raise ReportException(message)
 
-    def _print_json(self): # TODO реализовать метод
-        # { 
+    def _print_json(self):
+        # {
         #   "report": {
         #     "Sberbank": {
         #        "position_rub": 4500.50,
@@ -82,7 +129,32 @@ class Report:
         #     "position_usd": 100.00,
         #   },
         # }
-        pass
+        # Отчеты с keyed=False (запросы, лоты портфеля) -- список объектов строк со всеми столбцами
+        if self.is_empty():
+            print(f'{{"report": {"{}" if self.keyed else "[]"}, "total": null}}', file=self.file)
+            return
+
+        columns, encoded = self._encode_columns()
+        if self.keyed:
+            self._validate_keys()
+            # Ключ объекта -- первый столбец (счет, валюта), всегда строкой
+            encoded[0] = list(map(encode_basestring, map(str, self.report_dataframe[columns[0]].tolist())))
+            template = gen_json_object_template(columns[1:])
+            row_template = '%s: ' + template
+            rows = [row_template % row for row in zip(*encoded)]
+            report = f'{{{", ".join(rows)}}}'
+        else:
+            row_template = gen_json_object_template(columns)
+            rows = [row_template % row for row in zip(*encoded)]
+            report = f'[{", ".join(rows)}]'
+
+        total = 'null'
+        if self.total_dataframe is not None:
+            template = gen_json_object_template(columns[1:])
+            total_values = [encode_json_column([self.total_dataframe[column]])[0] for column in columns[1:]]
+            total = template % tuple(total_values)
+
+        print(f'{{"report": {report}, "total": {total}}}', file=self.file)
 
     def _format_decimal(self, decimal_):
         if self.rounding:
@@ -107,12 +179,18 @@ class Report:
             return self._format_header(field)
         if as_footer:
             return self._format_footer(field)
+        if field is None:
+            return ''
+        if not isinstance(field, str):
+            return str(field)
         else:
             return field
 
 
     def _select_justify(self, field):
-        # TODO переделать логику -- нужно идти в датафрейм и смотреть тип
+        values = self.report_dataframe[field]
+        if len(values) and isinstance(values.iloc[0], decimal.Decimal):
+            return 'right'
         if 'position' in field:
             return 'right'
         elif 'part' in field:
@@ -149,15 +227,20 @@ class Report:
         return rows
 
 
-    def _print_table(self, style=box.SIMPLE):
-        console = Console()
+    def _print_table(self, style='SIMPLE'):
+        # rich импортируется лениво, чтобы не замедлять автодополнение и --help
+        from rich.console import Console
+        from rich.table import Table
+        from rich import box
+
+        console = Console(file=self.file)
 
         if self.is_empty():
-            console.print('no data')
+            console.print(f'{self.title}: no data' if self.title else 'no data')
             return
 
         show_footer= True if self.total_dataframe is not None else False
-        table = Table(show_footer=show_footer, box=style)
+        table = Table(show_footer=show_footer, box=getattr(box, style), title=self.title)
 
         for column in self._gen_columns():
             table.add_column(header=column['header'], footer=column['footer'], justify=column['justify'])
@@ -171,20 +254,133 @@ class Report:
     def print(self):
         self.validate()
 
-        if self.format == self.FORMAT_CSV:
-            self._print_csv()
-            return
+        rows = 0 if self.report_dataframe is None else len(self.report_dataframe)
+        with span('report.print', format=self.format, rows=rows):
+            if self.format == self.FORMAT_CSV:
+                self._print_csv()
+                return
 
-        if self.format == self.FORMAT_JSON:
-            self._print_json()
-            return
-    
-        if self.format == self.FORMAT_TABLE:
-            self._print_table()
-            return
+            if self.format == self.FORMAT_JSON:
+                self._print_json()
+                return
 
-        if self.format == self.FORMAT_MD_TABLE:
-            self._print_table(style=box.MARKDOWN)
-            return
+            if self.format == self.FORMAT_NDJSON:
+                self._print_ndjson()
+                return
+
+            if self.format == self.FORMAT_TABLE:
+                self._print_table()
+                return
+
+            if self.format == self.FORMAT_MD_TABLE:
+                self._print_table(style='MARKDOWN')
+                return
+
+
+### Stream Report Class -------------------------------------------------------
+
+class StreamReport(Report):
+
+    # Форматы, которые пишутся построчно, без накопления строк в памяти, и их методы
+    STREAM_FORMATS = {
+        Report.FORMAT_CSV: '_stream_csv',
+        Report.FORMAT_NDJSON: '_stream_ndjson',
+        Report.FORMAT_JSON: '_stream_json',
+    }
+
+    def __init__(self, columns, rows):
+        super().__init__(None, None)
+        self.columns = columns
+        self.rows = rows
+
+
+    def _materialize(self):
+        # Таблице rich нужны все строки сразу
+        import pandas as pd
+
+        rows = list(self.rows)
+        if rows:
+            self.report_dataframe = pd.DataFrame(rows, columns=self.columns)
+
+
+    def _stream_csv(self):
+        writer = csv.writer(self.file or sys.stdout, lineterminator='\n')
+        writer.writerow(self.columns)
+        for row in self.rows:
+            writer.writerow(row)
+
+
+    def _stream_ndjson(self):
+        file_object = self.file or sys.stdout
+        template = gen_json_object_template(self.columns)
+        for row in self.rows:
+            file_object.write(template % tuple(map(encode_json_value, row)))
+            file_object.write('\n')
+
+
+    def _stream_json(self):
+        # Строки потока не уникальны по первому столбцу, поэтому "report" -- список
+        file_object = self.file or sys.stdout
+        template = gen_json_object_template(self.columns)
+        file_object.write('{"report": [')
+        separator = ''
+        for row in self.rows:
+            file_object.write(separator)
+            file_object.write(template % tuple(map(encode_json_value, row)))
+            separator = ', '
+        file_object.write('], "total": null}\n')
+
+
+    def print(self):
+        self.validate()
 
+        with span('report.stream', format=self.format):
+            if self.format in self.STREAM_FORMATS:
+                getattr(self, self.STREAM_FORMATS[self.format])()
+                return
+
+            self._materialize()
+            super().print()
+
+
+# Functions ===================================================================
+
+def encode_json_value(value):
+    # Decimal пишется как число JSON без перевода во float
+    if hasattr(value, 'dtype') and hasattr(value, 'item'):
+        # Скаляр numpy (итог столбца int64) -- в значение Python без импорта numpy
+        value = value.item()
+    if isinstance(value, str):
+        return encode_basestring(value)
+    if isinstance(value, decimal.Decimal):
+        return str(value) if value.is_finite() else 'null'
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        return repr(value) if math.isfinite(value) else 'null'
+    if hasattr(value, 'isoformat'):
+        return encode_basestring(value.isoformat())
+    return json.dumps(value, ensure_ascii=False)
+
+
+def encode_json_column(values):
+    # Однородный столбец кодируется одним map(), смешанный -- по ячейкам
+    types = set(map(type, values))
+    if types == {decimal.Decimal} and all(map(decimal.Decimal.is_finite, values)):
+        return list(map(str, values))
+    if types == {str}:
+        return list(map(encode_basestring, values))
+    if types == {int}:
+        return list(map(str, values))
+    return list(map(encode_json_value, values))
+
+
+def gen_json_object_template(columns):
+    # '{"account": %s, "position": %s}' -- строка собирается одной операцией %
+    fields = ', '.join(encode_basestring(str(column)).replace('%', '%%') + ': %s' for column in columns)
+    return '{' + fields + '}'
 
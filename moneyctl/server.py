@@ -0,0 +1,183 @@
+import io
+import os
+import sys
+import json
+import base64
+import socket
+import threading
+import socketserver
+from contextlib import redirect_stdout, redirect_stderr
+
+from moneyctl.cli import cli
+from moneyctl.client import Client
+from moneyctl.loader import LedgerLoader
+
+
+# Classes =====================================================================
+
+class ServerException(BaseException):
+    def __init__(self, message=None):
+        super().__init__(message)
+
+
+### Request Handler Class -----------------------------------------------------
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line)
+            response = self.server.moneyctl_server.execute(request)
+        except Exception as e:
+            stderr = base64.b64encode(f'Server Error: {e}\n'.encode()).decode()
+            response = {'code': 1, 'stdout': '', 'stderr': stderr}
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+### Server Class --------------------------------------------------------------
+
+class Server:
+
+    DEFAULT_POLL_INTERVAL = 1.0
+
+    def __init__(self, journal, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.journal = journal
+        self.socket_file = journal.socket_file
+        self.poll_interval = poll_interval
+
+        self.ledger = None
+        self.signature = None
+        self.socket_server = None
+
+        self.execute_lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.stopped = threading.Event()
+
+
+    def _gen_signature(self):
+        paths = self.journal.get_beancount_files()
+        paths += self.journal.get_templates_files()
+        signature = []
+        for path_object in sorted(paths):
+            stat = path_object.stat()
+            signature.append((str(path_object), stat.st_size, stat.st_mtime_ns))
+        return signature
+
+
+    def refresh(self):
+        with self.reload_lock:
+            signature = self._gen_signature()
+            if signature == self.signature:
+                return
+            ledger = LedgerLoader(self.journal).load(quiet=True)
+            with self.execute_lock:
+                self.journal.invalidate()
+                self.ledger = ledger
+                self.signature = signature
+
+
+    def _watch(self):
+        while not self.stopped.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f'Journal reload failed: {e}', file=sys.stderr)
+
+
+    def _apply_env(self, env):
+        saved_env = {key: os.environ.get(key) for key in Client.FORWARDED_ENV}
+        for key in Client.FORWARDED_ENV:
+            if key in env:
+                os.environ[key] = env[key]
+            else:
+                os.environ.pop(key, None)
+        return saved_env
+
+
+    def _restore_env(self, saved_env):
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+    def _gen_stream(self, options):
+        # Поток с буфером, как у sys.stdout: click пишет автодополнение байтами
+        return io.TextIOWrapper(io.BytesIO(),
+                                encoding=options.get('encoding', 'utf-8'),
+                                errors=options.get('errors', 'strict'),
+                                write_through=True)
+
+
+    def _read_stream(self, stream):
+        stream.flush()
+        return base64.b64encode(stream.buffer.getvalue()).decode()
+
+
+    def _run_cli(self, argv, env, streams):
+        stdout = self._gen_stream(streams.get('stdout', {}))
+        stderr = self._gen_stream(streams.get('stderr', {}))
+        code = 0
+        saved_env = self._apply_env(env)
+        try:
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                cli.main(args=argv, prog_name='moneyctl', obj={'ledger': self.ledger})
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                stderr.write(f'{e.code}\n')
+                code = 1
+        finally:
+            self._restore_env(saved_env)
+        return {'code': code, 'stdout': self._read_stream(stdout), 'stderr': self._read_stream(stderr)}
+
+
+    def execute(self, request):
+        self.refresh()
+        with self.execute_lock:
+            return self._run_cli(request.get('argv', []),
+                                 request.get('env', {}),
+                                 request.get('streams', {}))
+
+
+    def _remove_stale_socket(self):
+        if not self.socket_file.exists():
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            try:
+                connection.connect(str(self.socket_file))
+            except OSError:
+                self.socket_file.unlink(missing_ok=True)
+                return
+        message = f'Server is already running on "{self.socket_file.absolute()}"'
+        raise ServerException(message)
+
+
+    def serve_forever(self):
+        self._remove_stale_socket()
+        self.refresh()
+
+        self.socket_file.parent.mkdir(parents=True, exist_ok=True)
+        self.socket_server = socketserver.ThreadingUnixStreamServer(str(self.socket_file), RequestHandler)
+        self.socket_server.daemon_threads = True
+        self.socket_server.moneyctl_server = self
+
+        watcher = threading.Thread(target=self._watch, daemon=True)
+        watcher.start()
+        try:
+            self.socket_server.serve_forever()
+        finally:
+            self.stopped.set()
+            self.socket_server.server_close()
+            self.socket_file.unlink(missing_ok=True)
+
+
+    def shutdown(self):
+        self.stopped.set()
+        if self.socket_server is not None:
+            self.socket_server.shutdown()
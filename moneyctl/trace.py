@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+
+
+# Classes =====================================================================
+
+### Tracer Class --------------------------------------------------------------
+
+class Tracer:
+
+    TRACE_VAR = 'MONEYCTL_TRACE'
+    PSTATS_VAR = 'MONEYCTL_PSTATS'
+
+    OUTPUT_STDERR = 'stderr'
+    # MONEYCTL_TRACE=1 -- трасса в stderr, MONEYCTL_TRACE=<путь> -- в файл
+    STDERR_VALUES = ['1', OUTPUT_STDERR]
+    DISABLED_VALUES = ['', '0']
+
+    def __init__(self):
+        self.enabled = False
+        self.output = None
+        self.pstats_file = None
+        self.profiler = None
+        self.started = None
+        self.events = []
+
+
+    @classmethod
+    def get_env_output(cls):
+        value = os.environ.get(cls.TRACE_VAR, '')
+        if value in cls.DISABLED_VALUES:
+            return None
+        return cls.OUTPUT_STDERR if value in cls.STDERR_VALUES else value
+
+
+    @classmethod
+    def get_env_pstats_file(cls):
+        return os.environ.get(cls.PSTATS_VAR) or None
+
+
+    @classmethod
+    def is_requested(cls, argv=()):
+        # Профилируемая команда выполняется в процессе, а не на сервере
+        return bool(cls.get_env_output() or cls.get_env_pstats_file()
+                    or any(arg.startswith(('--profile', '--pstats')) for arg in argv))
+
+
+    def start(self, output=None, pstats_file=None):
+        self.enabled = output is not None
+        self.output = output
+        self.pstats_file = pstats_file
+        self.started = time.perf_counter()
+        self.events = []
+        if pstats_file:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+
+    def _gen_event(self, name, started, finished, args):
+        # Формат Trace Event: открывается в chrome://tracing и Perfetto
+        return {
+            'name': name,
+            'ph': 'X',
+            'ts': round((started - self.started) * 1_000_000),
+            'dur': round((finished - started) * 1_000_000),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        }
+
+
+    @contextmanager
+    def span(self, name, **args):
+        # Счетчики (файлы, байты, строки) можно дописать в args внутри блока
+        if not self.enabled:
+            yield args
+            return
+        started = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.events.append(self._gen_event(name, started, time.perf_counter(), args))
+
+
+    def _write_trace(self, finished):
+        trace = {
+            'traceEvents': [self._gen_event('moneyctl', self.started, finished, {'argv': sys.argv[1:]})] + self.events,
+            'displayTimeUnit': 'ms',
+        }
+        text = json.dumps(trace, ensure_ascii=False, default=str)
+        if self.output == self.OUTPUT_STDERR:
+            sys.stderr.write(text + '\n')
+            sys.stderr.flush()
+        else:
+            with open(self.output, 'w') as file_object:
+                file_object.write(text + '\n')
+
+
+    def stop(self):
+        finished = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.pstats_file)
+            self.profiler = None
+        if self.enabled:
+            self._write_trace(finished)
+        self.enabled = False
+        self.events = []
+
+
+# Functions ===================================================================
+
+tracer = Tracer()
+
+
+def span(name, **args):
+    return tracer.span(name, **args)
+
+
+def traced(name):
+    # Декоратор: весь вызов метода -- один span
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -59,6 +59,30 @@ def lint_python_code(c):
     os.execlp("poetry", "poetry", "run", "ruff", "check", ".")
 
 
+@task(pre=[poetry_install])
+def benchmark_startup(c):
+    """Measure CLI startup and shell completion time"""
+    c.run(f"poetry run python {c.benchmark.startup_file}")
+
+
+@task(pre=[poetry_install])
+def benchmark_report_formats(c):
+    """Measure report serialisation time in csv, json and ndjson formats"""
+    c.run(f"poetry run python {c.benchmark.report_formats_file}")
+
+
+@task(pre=[poetry_install])
+def benchmark_suite(c, size="small"):
+    """Measure time and peak memory of journal operations on generated journal"""
+    c.run(f"poetry run python {c.benchmark.suite_file} --size {size}")
+
+
+@task(pre=[poetry_install])
+def benchmark_commit(c, writers=16):
+    """Stress journal commits with concurrent writers and measure throughput"""
+    c.run(f"poetry run python {c.benchmark.commit_file} --writers {writers}")
+
+
 ### Namespaces ----------------------------------------------------------------
 
 ns = Collection(
@@ -68,6 +92,10 @@ ns = Collection(
     shell_update_completions,
     install,
     lint_python_code,
+    benchmark_startup,
+    benchmark_report_formats,
+    benchmark_suite,
+    benchmark_commit,
 )
 ns.configure(
     {
@@ -89,5 +117,11 @@ ns.configure(
         "install": {
             "wrapper_file": Path(".") / "misc" / "wrapper" / "moneyctl.fish",
         },
+        "benchmark": {
+            "startup_file": Path(".") / "benchmarks" / "bench_startup.py",
+            "report_formats_file": Path(".") / "benchmarks" / "bench_report_formats.py",
+            "suite_file": Path(".") / "benchmarks" / "bench_suite.py",
+            "commit_file": Path(".") / "benchmarks" / "bench_commit.py",
+        },
     }
 )
@@ -0,0 +1,18 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from moneyctl.journal import Journal
+
+
+JOURNAL_EXAMPLE_DIR = Path(__file__).parent.parent / 'misc' / 'journal_example'
+
+
+@pytest.fixture
+def journal_dir(tmp_path, monkeypatch):
+    root_dir = tmp_path / 'journal'
+    shutil.copytree(JOURNAL_EXAMPLE_DIR, root_dir, ignore=shutil.ignore_patterns('.moneyctl'))
+    monkeypatch.chdir(root_dir)
+    monkeypatch.setattr(Journal, '_instance', None)
+    return root_dir
@@ -0,0 +1,20 @@
+from moneyctl.cache import LedgerCache
+
+
+def test_fingerprint_changes_with_content(tmp_path):
+    bean_file = tmp_path / 'a.bean'
+    bean_file.write_text('2022-01-01 commodity RUB\n')
+    cache = LedgerCache(tmp_path / 'cache')
+    before = cache.fingerprint([bean_file])
+    assert before == cache.fingerprint([bean_file])
+    bean_file.write_text('2022-01-01 commodity USD\n')
+    assert before != cache.fingerprint([bean_file])
+
+
+def test_put_get_and_evict_generations(tmp_path):
+    cache = LedgerCache(tmp_path / 'cache', max_generations=2)
+    for i in range(4):
+        cache.put(f'gen{i}', ([i], [], {}))
+    assert cache.get('gen0') is None
+    assert cache.get('gen3') == ([3], [], {})
+    assert len(list((tmp_path / 'cache').iterdir())) == 2
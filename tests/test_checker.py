@@ -0,0 +1,151 @@
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from moneyctl.cli import cli
+from moneyctl.journal import Journal
+from moneyctl.loader import LedgerLoader
+from moneyctl.checker import JournalChecker, CheckException
+
+
+BROKEN_TRANSACTIONS = '''
+2022-06-01 * "Перевод самому себе"
+    Assets:Карты:Sberbank-0001    -100 RUB
+    Assets:Карты:Sberbank-0001     100 RUB
+
+2022-06-01 * "Не сходится"
+    Assets:Карты:Sberbank-0001    -100 RUB
+    Expenses:Питание                90 RUB
+
+2022-06-01 * "Неизвестный счет"
+    Assets:Карты:Sberbank-0001    -100 RUB
+    Expenses:Неизвестно            100 RUB
+
+2022-06-01 * "Неизвестная валюта"
+    Assets:Карты:Tinkoff-0002     -100 EUR
+    Expenses:Питание               100 EUR
+
+2022-04-01 * "До открытия вклада"
+    Assets:Карты:Sberbank-0001    -100 RUB
+    Assets:Вклады:Вклад-RUB-1      100 RUB
+
+2022-06-02 balance Assets:Карты:Sberbank-0001  1 RUB
+'''
+
+
+def _codes(errors):
+    return sorted((os.path.basename(filename), lineno, code) for filename, lineno, code, _ in errors)
+
+
+def test_example_journal_is_valid(journal_dir):
+    assert JournalChecker(Journal()).run() == []
+
+
+def test_check_reports_errors(journal_dir):
+    (journal_dir / 'transactions' / '2022' / '2022-06-01.bean').write_text(BROKEN_TRANSACTIONS)
+    errors = JournalChecker(Journal()).run()
+    assert _codes(errors) == [
+        ('2022-06-01.bean', 2, 'same-account'),
+        ('2022-06-01.bean', 6, 'unbalanced'),
+        ('2022-06-01.bean', 12, 'unknown-account'),
+        ('2022-06-01.bean', 15, 'invalid-currency'),
+        ('2022-06-01.bean', 15, 'unknown-commodity'),
+        ('2022-06-01.bean', 16, 'invalid-currency'),
+        ('2022-06-01.bean', 16, 'unknown-commodity'),
+        ('2022-06-01.bean', 20, 'inactive-account'),
+        ('2022-06-01.bean', 22, 'balance'),
+    ]
+
+    # Те же ошибки находит полная загрузка beancount (кроме проверок moneyctl)
+    _, loader_errors, _ = LedgerLoader(Journal(), cache=False).load(quiet=True)
+    messages = {error.message.split(':')[0] for error in loader_errors}
+    assert {"Transaction does not balance", "Invalid reference to unknown account 'Expenses", "Balance failed for 'Assets"} <= messages
+
+    result = CliRunner().invoke(cli, ['check'], obj={})
+    assert result.exit_code == 1
+    assert "transactions/2022/2022-06-01.bean:6: Transaction does not balance" in result.output
+
+
+def test_check_rechecks_only_changed_and_dependent_files(journal_dir):
+    checker = JournalChecker(Journal())
+    checker.run()
+    assert checker.checked_files_count == len(checker.files)
+
+    checker = JournalChecker(Journal())
+    checker.run()
+    assert checker.checked_files_count == 0
+
+    # Закрытие счета перепроверяет только файлы, которые на него ссылаются
+    with open(journal_dir / 'accounts' / '2022' / '2022-05-10.bean', 'a') as file_object:
+        file_object.write('\n2022-03-30 close Assets:Счета:Накопительный-счет-RUB-1\n')
+    checker = JournalChecker(Journal())
+    errors = checker.run()
+    assert checker.checked_files_count == 3
+    assert _codes(errors) == [('2022-05-10.bean', 11, 'inactive-account')]
+
+
+def test_balance_counts_elided_posting(journal_dir):
+    filepath = journal_dir / 'transactions' / '2022' / '2022-06-01.bean'
+    filepath.write_text(
+        '2022-06-01 * "Обед"\n'
+        '    Expenses:Питание               100 RUB\n'
+        '    Assets:Карты:Sberbank-0001\n'
+        '\n'
+        '2022-06-02 balance Assets:Карты:Sberbank-0001  7900 RUB\n'
+    )
+    assert JournalChecker(Journal()).run() == []
+    _, loader_errors, _ = LedgerLoader(Journal(), cache=False).load(quiet=True)
+    assert loader_errors == []
+
+    # Остаток автоматической проводки учитывается, а не пропускается
+    with open(filepath, 'a') as file_object:
+        file_object.write('\n2022-06-03 balance Assets:Карты:Sberbank-0001  8000 RUB\n')
+    errors = JournalChecker(Journal()).run()
+    assert _codes(errors) == [('2022-06-01.bean', 7, 'balance')]
+    assert 'accumulated 7900 RUB' in errors[0][3]
+
+
+def test_unreadable_cache_fails_check(journal_dir):
+    journal = Journal()
+    checker = JournalChecker(journal)
+    checker.cache_file.mkdir(parents=True)
+    with pytest.raises(CheckException, match='Cannot read check cache'):
+        checker.run()
+
+    result = CliRunner().invoke(cli, ['check'], obj={})
+    assert result.exit_code == 1
+    assert 'Error: Cannot read check cache' in result.output
+
+    # Без кеша проверка не читает и не пишет check.json
+    assert JournalChecker(journal, cache=False).run() == []
+
+
+def test_pad_fills_next_balance(journal_dir):
+    (journal_dir / 'transactions' / '2022' / '2022-06-01.bean').write_text(
+        '2022-06-01 pad Assets:Карты:Sberbank-0001 Equity:Начальное-сальдо-RUB\n'
+        '\n'
+        '2022-06-02 balance Assets:Карты:Sberbank-0001  100000 RUB\n'
+        '\n'
+        '2022-06-03 * "Обед"\n'
+        '    Assets:Карты:Sberbank-0001  -500 RUB\n'
+        '    Expenses:Питание  500 RUB\n'
+        '\n'
+        '2022-06-04 balance Assets:Карты:Sberbank-0001  99500 RUB\n'
+        '\n'
+        '2022-06-05 pad Assets:Карты:Sberbank-0001 Equity:Начальное-сальдо-RUB\n'
+        '\n'
+        '2022-06-06 balance Assets:Карты:Sberbank-0001  99000 RUB\n'
+    )
+    assert JournalChecker(Journal()).run() == []
+    assert CliRunner().invoke(cli, ['check'], obj={}).exit_code == 0
+
+    with open(journal_dir / 'transactions' / '2022' / '2022-06-01.bean', 'a') as file_object:
+        file_object.write('\n2022-06-07 balance Assets:Карты:Sberbank-0001  98000 RUB\n')
+    _, loader_errors, _ = LedgerLoader(Journal(), cache=False).load(quiet=True)
+    assert [error.message.split(':')[0] for error in loader_errors] == ["Balance failed for 'Assets"]
+
+    # Второе утверждение после pad не дополняется -- как в beancount
+    errors = JournalChecker(Journal()).run()
+    assert _codes(errors) == [('2022-06-01.bean', 15, 'balance')]
+    assert 'expected 98000 RUB != accumulated 99000 RUB' in errors[0][3]
@@ -0,0 +1,29 @@
+import sys
+import datetime
+from pathlib import Path
+
+from moneyctl.journal import Journal
+from moneyctl.beancount_wrapper import BeancountWrapper
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'benchmarks'))
+
+from gen_journal import JournalGenerator
+
+
+def test_generated_journal_is_valid(tmp_path, monkeypatch):
+    stats = JournalGenerator(tmp_path, years=2, accounts=30, postings=2000, tickers=3, seed=1, end_year=2023).generate()
+    assert stats['postings'] >= 2000
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Journal, '_instance', None)
+    assert 'Assets:Инвестиции:Broker-000:Cash' in Journal().complete_accounts_names('Assets:Инвестиции:')
+
+    native, bql = (BeancountWrapper(journal=Journal(), engine=engine) for engine in BeancountWrapper.ENGINES)
+    assert native.errors == []
+
+    from_, to = datetime.date(2022, 1, 1), datetime.date(2023, 12, 31)
+    native_reports, bql_reports = (wrapper.dashboard_reports(from_=from_, to=to, empty_accounts=True)
+                                   for wrapper in (native, bql))
+    for name, report in native_reports.items():
+        assert report.report_dataframe.astype(str).values.tolist() == \
+            bql_reports[name].report_dataframe.astype(str).values.tolist()
@@ -0,0 +1,47 @@
+import io
+
+import pytest
+
+from moneyctl.journal import Journal
+from moneyctl.importer import TransactionImporter, ImportException
+
+
+ROWS = '''date,from,to,amount,comment
+2022-03-25,Income:Работа,Assets:Карты:Sberbank-0001,40000,Зарплата
+2022-04-01,Assets:Карты:Sberbank-0001,Expenses:Питание,1234.50,Продукты
+2022-04-01,Assets:Карты:Sberbank-0001,Expenses:Питание,99,Кофе
+'''
+
+
+def test_import_skips_existing_and_reimported_rows(journal_dir):
+    importer = TransactionImporter(Journal())
+    importer.run(io.StringIO(ROWS))
+    assert (importer.imported_count, importer.skipped_count) == (2, 1)
+
+    text = (journal_dir / 'transactions' / '2022' / '2022-04-01.bean').read_text()
+    assert text.count('Expenses:Питание') == 2
+
+    importer = TransactionImporter(Journal())
+    importer.run(io.StringIO(ROWS))
+    assert (importer.imported_count, importer.skipped_count) == (0, 3)
+
+
+def test_import_reports_row_number(journal_dir):
+    rows = 'date,from,to,amount,comment\n2022-04-01,Assets:Карты:Sberbank-0001,Expenses:Nope,1,x\n'
+    with pytest.raises(ImportException, match='Row 1'):
+        TransactionImporter(Journal()).run(io.StringIO(rows))
+
+
+def test_import_keeps_identical_rows_of_one_file(journal_dir):
+    row = '2022-04-02,Assets:Карты:Sberbank-0001,Expenses:Питание,99,Кофе\n'
+    rows = 'date,from,to,amount,comment\n' + row + row
+    importer = TransactionImporter(Journal())
+    importer.run(io.StringIO(rows))
+    assert (importer.imported_count, importer.skipped_count) == (2, 0)
+
+    # Повторный импорт сопоставляет каждую строку со своей транзакцией в журнале
+    importer = TransactionImporter(Journal())
+    importer.run(io.StringIO(rows + row))
+    assert (importer.imported_count, importer.skipped_count) == (1, 2)
+    text = (journal_dir / 'transactions' / '2022' / '2022-04-02.bean').read_text()
+    assert text.count('Expenses:Питание') == 3
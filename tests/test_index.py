@@ -0,0 +1,75 @@
+import random
+from datetime import date
+
+import pytest
+
+from moneyctl.journal import Journal, JournalException, AccountStatus
+from moneyctl.index import IntervalTree
+
+
+def test_complete_accounts_by_prefix(journal_dir):
+    journal = Journal()
+    names = journal.complete_accounts_names('Assets:Карты', status=AccountStatus.OPEN)
+    assert names == ['Assets:Карты:Sberbank-0001', 'Assets:Карты:Tinkoff-0002']
+    assert journal.complete_accounts_names('Nothing') == []
+
+
+def test_index_reused_until_accounts_change(journal_dir, monkeypatch):
+    Journal().index.refresh()
+
+    monkeypatch.setattr(Journal, '_instance', None)
+    journal = Journal()
+
+    def fail_scan():
+        raise AssertionError('accounts should not be rescanned')
+
+    # Отдельный контекст: undo() общего monkeypatch вернул бы и chdir фикстуры journal_dir
+    with monkeypatch.context() as scan_patch:
+        scan_patch.setattr(journal, 'scan_accounts', fail_scan)
+        assert journal.get_account('Expenses:Питание').get_commodity().get_ticker() == 'RUB'
+    assert 'Assets:Карты:Tinkoff-0002' in journal.complete_accounts_names('Assets:', status=AccountStatus.OPEN)
+
+    accounts_file = journal_dir / 'accounts' / '2022' / '2022-06-01.bean'
+    accounts_file.write_text('2022-06-01 close Assets:Карты:Tinkoff-0002\n')
+    journal.index.refresh()
+    assert 'Assets:Карты:Tinkoff-0002' not in journal.complete_accounts_names('Assets:', status=AccountStatus.OPEN)
+
+
+def test_account_lifetime_intervals(journal_dir):
+    accounts_file = journal_dir / 'accounts' / '2022' / '2022-06-01.bean'
+    accounts_file.write_text(
+        '2022-06-01 close Assets:Карты:Tinkoff-0002\n'
+        '2022-09-01 open Assets:Карты:Tinkoff-0002 USD\n'
+        '2022-10-01 close Assets:Карты:Tinkoff-0002\n'
+    )
+    journal = Journal()
+    assert journal.get_account('Assets:Карты:Tinkoff-0002').intervals == [
+        ['2022-01-01', '2022-06-01'], ['2022-09-01', '2022-10-01'],
+    ]
+    assert journal.is_account_open('Assets:Карты:Tinkoff-0002', date(2022, 6, 1))
+    assert not journal.is_account_open('Assets:Карты:Tinkoff-0002', date(2022, 7, 1))
+    assert journal.is_account_open('Assets:Карты:Tinkoff-0002', date(2022, 9, 15))
+    assert not journal.is_account_open('Assets:Вклады:Вклад-RUB-1', date(2022, 5, 9))
+
+    assert 'Assets:Карты:Tinkoff-0002' not in journal.get_open_accounts_names(date(2022, 7, 1))
+    assert journal.complete_accounts_names('Assets:Карты', status=AccountStatus.OPEN, date=date(2022, 9, 1)) == [
+        'Assets:Карты:Sberbank-0001', 'Assets:Карты:Tinkoff-0002',
+    ]
+
+    transaction = journal.new_transaction()
+    transaction.set(account_from='Assets:Карты:Tinkoff-0002', account_to='Expenses:Питание',
+                    amount_from=5, amount_to=400, comment='Кофе', date=date(2022, 7, 1))
+    with pytest.raises(JournalException, match='is not open on 2022-07-01'):
+        transaction.close()
+
+
+def test_interval_tree_matches_linear_scan():
+    rng = random.Random(1)
+    intervals = []
+    for i in range(300):
+        start = rng.randrange(1000)
+        intervals.append((start, start + rng.randrange(200), i))
+    tree = IntervalTree(intervals)
+    for point in range(-5, 1250, 7):
+        expected = sorted(value for start, end, value in intervals if start <= point <= end)
+        assert sorted(tree.query(point)) == expected
@@ -0,0 +1,55 @@
+from datetime import date
+
+from moneyctl.journal import Journal
+from moneyctl.loader import LedgerLoader
+
+
+def _balances(entries):
+    return sorted(
+        (posting.account, str(posting.units))
+        for entry in entries if hasattr(entry, 'postings')
+        for posting in entry.postings
+    )
+
+
+def test_incremental_matches_string_mode(journal_dir):
+    journal = Journal()
+    string_entries, _, _ = LedgerLoader(journal, mode=LedgerLoader.MODE_STRING, cache=False).load()
+    entries, errors, options = LedgerLoader(journal).load()
+    assert _balances(entries) == _balances(string_entries)
+    assert options['operating_currency'] == ['RUB', 'USD']
+
+
+def test_commit_reparses_only_touched_file(journal_dir):
+    journal = Journal()
+    LedgerLoader(journal).load()
+
+    transaction = journal.new_transaction()
+    transaction.set(account_from='Assets:Карты:Sberbank-0001',
+                    account_to='Expenses:Питание',
+                    amount_from=100, amount_to=100, comment='Продукты',
+                    date=date(2022, 3, 25))
+    transaction.close()
+    journal.commit()
+
+    loader = LedgerLoader(journal)
+    entries, _, _ = loader.load()
+    assert loader.parsed_files_count == 1
+    assert ('Expenses:Питание', '100 RUB') in _balances(entries)
+
+
+def test_parallel_matches_incremental(journal_dir, monkeypatch):
+    monkeypatch.setattr(LedgerLoader, 'PARALLEL_MIN_BYTES', 0)
+    journal = Journal()
+    entries, _, _ = LedgerLoader(journal, cache=False).load()
+
+    loader = LedgerLoader(journal, mode=LedgerLoader.MODE_PARALLEL, workers=2)
+    parallel_entries, errors, _ = loader.load()
+    assert parallel_entries == entries
+    assert loader.parsed_files_count == len(journal.get_beancount_files())
+
+    # Кеш разбора, записанный воркерами, читает обычный загрузчик
+    loader = LedgerLoader(journal)
+    loader.ledger_cache.clear()
+    loader.load()
+    assert loader.parsed_files_count == 0
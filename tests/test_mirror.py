@@ -0,0 +1,111 @@
+import json
+from datetime import date
+
+from click.testing import CliRunner
+
+from moneyctl.cli import cli
+from moneyctl.journal import Journal
+from moneyctl.mirror import LedgerMirror
+
+
+def _sum_postings(mirror, account):
+    report = mirror.query(f"SELECT sum(number) AS position FROM postings WHERE account = '{account}'")
+    return str(report.report_dataframe['position'][0])
+
+
+def test_mirror_syncs_only_changed_files(journal_dir):
+    journal = Journal()
+    mirror = LedgerMirror(journal)
+    mirror.sync()
+    assert mirror.synced_files_count == len(journal.get_beancount_files())
+    assert _sum_postings(mirror, 'Income:Работа') == '-80000'
+
+    mirror.sync()
+    assert mirror.synced_files_count == 0
+
+    transaction = journal.new_transaction()
+    transaction.set(account_from='Income:Работа',
+                    account_to='Assets:Карты:Sberbank-0001',
+                    amount_from=10000, amount_to=10000, comment='Зарплата',
+                    date=date(2023, 6, 10))
+    transaction.close()
+    journal.commit()
+
+    mirror.sync()
+    assert mirror.synced_files_count == 1
+    assert _sum_postings(mirror, 'Income:Работа') == '-90000'
+
+    transaction.get_file().unlink()
+    mirror.sync()
+    assert _sum_postings(mirror, 'Income:Работа') == '-80000'
+
+
+def test_query_command_prints_csv(journal_dir):
+    sql = "SELECT name, open_date FROM accounts WHERE name LIKE 'Income:%' ORDER BY name LIMIT 1"
+    result = CliRunner().invoke(cli, ['query', '--format', 'csv', sql], obj={})
+    assert result.exit_code == 0, result.output
+    assert 'Income:Инвестиции,2022-01-01' in result.output
+
+    result = CliRunner().invoke(cli, ['query', 'DELETE FROM postings'], obj={})
+    assert result.exit_code == 1
+
+
+def test_mirror_keeps_amounts_exact(journal_dir):
+    with open(journal_dir / 'transactions' / '2022' / '2022-03-25.bean', 'a') as file_object:
+        file_object.write('\n2022-03-26 * "Кофе"\n'
+                          '    Assets:Карты:Sberbank-0001  -10.10 RUB\n'
+                          '    Expenses:Питание  10.10 RUB\n'
+                          '\n2022-03-27 * "Обед"\n'
+                          '    Assets:Карты:Sberbank-0001  -20.20 RUB\n'
+                          '    Expenses:Питание  20.20 RUB\n'
+                          '\n2022-03-28 * "Курс"\n'
+                          '    Assets:Карты:Sberbank-0001  -0.12345678901234567 RUB\n'
+                          '    Expenses:Питание  0.12345678901234567 RUB\n')
+    mirror = LedgerMirror(Journal())
+    mirror.sync()
+
+    # sum() складывает точно и отдает REAL один раз: 30.3, а не 30.599999999999998 из 10.10 + 20.20
+    report = mirror.query("SELECT sum(number) AS position FROM postings "
+                          "WHERE account = 'Expenses:Питание' AND number > 1 AND number < 100")
+    assert str(report.report_dataframe['position'][0]) == '30.3'
+    # Точная сумма за пределами точности REAL -- decimal_sum() текстом
+    report = mirror.query("SELECT decimal_sum(number) AS position FROM postings WHERE account = 'Expenses:Питание'")
+    assert report.report_dataframe['position'][0] == '30.42345678901234567'
+
+    report = mirror.query("SELECT number FROM postings WHERE account = 'Expenses:Питание' AND number > 10 ORDER BY number")
+    assert [str(number) for number in report.report_dataframe['number']] == ['10.10', '20.20']
+
+    result = CliRunner().invoke(cli, ['query', '--format', 'csv', '--no-rounding',
+                                      "SELECT sum(number) AS position FROM postings "
+                                      "WHERE account = 'Expenses:Питание' AND number > 1"], obj={})
+    assert result.exit_code == 0, result.output
+    assert result.output.strip().splitlines()[-1] == '0,30.3'
+
+
+def test_sum_sorts_by_value(journal_dir):
+    with open(journal_dir / 'transactions' / '2022' / '2022-03-25.bean', 'a') as file_object:
+        file_object.write('\n2022-03-28 * "Курс"\n'
+                          '    Assets:Карты:Sberbank-0001  -0.12345678901234567 RUB\n'
+                          '    Expenses:Питание  0.12345678901234567 RUB\n')
+    mirror = LedgerMirror(Journal())
+    mirror.sync()
+    # Суммы одного типа: ORDER BY не ставит текст после всех чисел
+    report = mirror.query("SELECT account, sum(number) AS position FROM postings GROUP BY account ORDER BY position")
+    positions = report.report_dataframe['position'].tolist()
+    assert positions == sorted(positions)
+
+    accounts = report.report_dataframe['account'].tolist()
+
+    report = mirror.query("SELECT account, decimal_sum(number) AS position FROM postings "
+                          "GROUP BY account ORDER BY position COLLATE DECIMAL")
+    assert report.report_dataframe['account'].tolist() == accounts
+    assert '0.12345678901234567' in report.report_dataframe['position'].tolist()
+
+
+def test_query_json_keeps_every_row(journal_dir):
+    sql = "SELECT account, number FROM postings WHERE account = 'Assets:Карты:Sberbank-0001'"
+    result = CliRunner().invoke(cli, ['query', '--format', 'json', sql], obj={})
+    assert result.exit_code == 0, result.output
+    rows = json.loads(result.output)['report']
+    assert len(rows) == 5
+    assert {row['account'] for row in rows} == {'Assets:Карты:Sberbank-0001'}
@@ -0,0 +1,121 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from moneyctl.journal import Journal
+from moneyctl.engine import NativeEngine
+from moneyctl.portfolio import PortfolioConfig, PortfolioEngine, PortfolioException
+from moneyctl.beancount_wrapper import BeancountWrapper
+
+
+PORTFOLIO_JOURNAL = '''
+option "booking_method" "FIFO"
+2022-01-01 open Assets:Инвестиции:Broker
+2022-01-01 open Assets:Bank RUB
+2022-01-01 open Assets:Usd USD
+2022-01-01 open Income:PnL RUB
+2022-01-01 open Equity:Open
+2022-01-01 custom "moneyctl-portfolio" "exclude" "RUB"
+2022-01-01 custom "moneyctl-portfolio" "group" "Акции США" "AAPL|MSFT"
+2022-01-01 price USD 70 RUB
+2022-01-02 * "Open"
+  Assets:Bank 10000 RUB
+  Assets:Usd 300 USD
+  Equity:Open
+2022-02-01 * "Buy"
+  Assets:Инвестиции:Broker 10 SBER {200 RUB}
+  Assets:Bank -2000 RUB
+2022-03-01 * "Buy"
+  Assets:Инвестиции:Broker 10 SBER {250 RUB}
+  Assets:Bank -2500 RUB
+2022-03-01 * "Buy"
+  Assets:Инвестиции:Broker 2 AAPL {150 USD}
+  Assets:Usd -300 USD
+2022-04-01 * "Sell"
+  Assets:Инвестиции:Broker -15 SBER {}
+  Assets:Bank 4500 RUB
+  Income:PnL
+2022-06-01 price SBER 300 RUB
+2022-06-01 price AAPL 160 USD
+2022-06-01 price USD 80 RUB
+'''
+
+
+def _rows(report):
+    return [[str(value) for value in row] for row in report.report_dataframe.values.tolist()]
+
+
+def test_lots_cost_basis_and_pnl():
+    wrapper = BeancountWrapper(beancount_string=PORTFOLIO_JOURNAL)
+    report = wrapper.portfolio_report(level=PortfolioEngine.LEVEL_LOT, on_date=date(2022, 6, 30))
+    # FIFO: от первой покупки SBER не осталось ничего, от второй -- 5 штук
+    assert _rows(report) == [
+        ['Broker', 'AAPL', '2022-03-01', '2', '21000', '25600', '4600', str(Decimal(25600) / Decimal(27100) * 100)],
+        ['Broker', 'SBER', '2022-03-01', '5', '1250', '1500', '250', str(Decimal(1500) / Decimal(27100) * 100)],
+    ]
+    assert str(report.total_dataframe['pnl']) == '4850'
+
+
+def test_holdings_groups_and_date():
+    wrapper = BeancountWrapper(beancount_string=PORTFOLIO_JOURNAL)
+    report = wrapper.portfolio_report(level=PortfolioEngine.LEVEL_GROUP, on_date=date(2022, 6, 30))
+    assert [row[:4] for row in _rows(report)] == [['Акции США', '21000', '25600', '4600'], ['SBER', '1250', '1500', '250']]
+
+    # До продажи: оба лота SBER, цен еще нет -- стоимость неизвестна
+    report = wrapper.portfolio_report(level=PortfolioEngine.LEVEL_HOLDING, on_date=date(2022, 3, 15))
+    assert [row[:3] for row in _rows(report)] == [['SBER', '20', '4500'], ['AAPL', '2', '21000']]
+    assert report.report_dataframe['value'].tolist() == [None, None]
+
+
+def test_unknown_rule_is_reported():
+    journal = PORTFOLIO_JOURNAL + '2022-01-01 custom "moneyctl-portfolio" "hide" "SBER"\n'
+    with pytest.raises(PortfolioException, match='Portfolio rule "hide" is not supported'):
+        BeancountWrapper(beancount_string=journal).portfolio_report()
+
+
+def test_snapshot_cached_per_ledger_version(journal_dir, monkeypatch):
+    first = BeancountWrapper(journal=Journal()).portfolio_report(level=PortfolioEngine.LEVEL_LOT)
+    monkeypatch.setattr(BeancountWrapper, '_portfolio_memo', (None, None))
+
+    def fail_lots(self, include, on_date):
+        raise AssertionError('snapshot should be loaded from cache')
+
+    monkeypatch.setattr(NativeEngine, 'lots', fail_lots)
+    second = BeancountWrapper(journal=Journal()).portfolio_report(level=PortfolioEngine.LEVEL_LOT)
+    assert first.is_empty() == second.is_empty()
+    assert (journal_dir / '.moneyctl' / 'cache' / 'portfolio').is_dir()
+
+
+PARTS_JOURNAL = '''
+2022-01-01 open Assets:Инвестиции:Broker
+2022-01-01 open Equity:Open
+2022-01-01 custom "moneyctl-portfolio" "exclude" "FXUS"
+2022-01-02 * "Open"
+  Assets:Инвестиции:Broker 100000 RUB
+  Assets:Инвестиции:Broker 10 FXUS {100 RUB}
+  Equity:Open
+2022-02-01 * "Buy"
+  Assets:Инвестиции:Broker 100 SBER {200 RUB}
+  Assets:Инвестиции:Broker 100 GAZP {150 RUB}
+  Assets:Инвестиции:Broker -35000 RUB
+2022-06-01 price SBER 300 RUB
+2022-06-01 price GAZP 170.5 RUB
+2022-06-01 price SBER 4 USD
+2022-06-01 price USD 80 RUB
+'''
+
+
+@pytest.mark.parametrize('currency', ['RUB', 'USD'])
+def test_invest_parts_engines_match(currency):
+    # Обе цены -- через рубли, как GETPRICE в BQL, даже если у бумаги есть прямая цена в целевой валюте
+    reports = [BeancountWrapper(beancount_string=PARTS_JOURNAL, engine=engine, currency=currency).invest_parts_report()
+               for engine in BeancountWrapper.ENGINES]
+    rows = [report.report_dataframe.values.tolist() for report in reports]
+    assert rows[0] == rows[1]
+    assert [row[0] for row in rows[0]] == ['SBER', 'GAZP']
+
+
+def test_exclude_rule_keeps_operating_currency_excluded():
+    config = PortfolioConfig.from_entries(BeancountWrapper(beancount_string=PARTS_JOURNAL).entries)
+    assert config.excluded == ['RUB', 'FXUS']
@@ -0,0 +1,40 @@
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+from beancount import loader
+from beancount.core import prices
+
+from moneyctl.price_index import PriceIndex
+
+
+PRICES = '''
+2022-01-01 price USD 70 RUB
+2022-02-01 price USD 80 RUB
+2022-01-15 price EUR 90 RUB
+2022-03-01 price EUR 100 RUB
+'''
+
+
+def _build():
+    entries, _, _ = loader.load_string(PRICES)
+    return entries, PriceIndex.from_entries(entries)
+
+
+def test_lookup_matches_get_price():
+    entries, price_index = _build()
+    price_map = prices.build_price_map(entries)
+    days = [date(2021, 12, 31), date(2022, 1, 1), date(2022, 1, 20), date(2022, 2, 1), date(2023, 1, 1)]
+    for pair in [('USD', 'RUB'), ('RUB', 'USD')]:
+        ids = price_index.lookup(*pair, np.array([day.toordinal() for day in days]))
+        rates = [price_index.values[i] if i != PriceIndex.NOT_FOUND else None for i in ids.tolist()]
+        assert rates == [prices.get_price(price_map, pair, day)[1] for day in days]
+
+
+def test_cross_rate_through_rub():
+    _, price_index = _build()
+    assert price_index.get_rate('USD', 'EUR', date(2022, 1, 10)) is None
+    assert price_index.get_rate('USD', 'EUR', date(2022, 1, 20)) == Decimal(70) * (1 / Decimal(90))
+    assert price_index.get_rate('USD', 'EUR', date(2022, 2, 10)) == Decimal(80) * (1 / Decimal(90))
+    assert price_index.get_rate('EUR', 'USD', date(2022, 3, 10)) == Decimal(100) * (1 / Decimal(80))
+    assert price_index.get_rate('USD', 'USD', date(2022, 3, 10)) == Decimal(1)
@@ -0,0 +1,92 @@
+import json
+import datetime
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from click.testing import CliRunner
+
+from moneyctl.cli import cli
+from moneyctl.journal import Journal
+from moneyctl.prices import PriceDownloader, PriceFetcher, HttpFetcher
+
+
+class FakePricesHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+        self.server.requests.append(query)
+        day = datetime.date.fromisoformat(query['from'])
+        rows = []
+        while day <= datetime.date.fromisoformat(query['to']):
+            if day.weekday() < 5:
+                rows.append({'date': day.isoformat(), 'price': f'{70 + day.day / 100:.2f}'})
+            day += datetime.timedelta(days=1)
+        body = json.dumps(rows).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def prices_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakePricesHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _run(prices_server, **kwargs):
+    Journal._instance = None
+    fetcher = HttpFetcher(f'http://127.0.0.1:{prices_server.server_port}/prices')
+    downloader = PriceDownloader(Journal(), fetcher, rate_limit=0, today=datetime.date(2023, 3, 1), **kwargs)
+    return downloader.run(), downloader
+
+
+def test_fetch_fills_gaps_and_writes_yearly_files(journal_dir, prices_server):
+    gaps, downloader = _run(prices_server)
+    assert [(gap[0], gap[2].isoformat(), gap[3].isoformat()) for gap in gaps] == [
+        ('USD', '2022-01-02', '2022-12-31'),
+        ('USD', '2023-01-01', '2023-03-01'),
+    ]
+    assert downloader.requests_count == 2
+    prices_2022 = (journal_dir / 'prices' / '2022' / 'fetched.bean').read_text().splitlines()
+    assert prices_2022[0] == '2022-01-03 price USD 70.03 RUB'
+    assert (journal_dir / 'prices' / '2023' / 'fetched.bean').exists()
+
+    # Пропусков больше нет -- повторный запуск ничего не запрашивает
+    gaps, downloader = _run(prices_server)
+    assert gaps == [] and downloader.requests_count == 0
+
+    # Закрытый диапазон 2022 года берется из кеша ответов
+    (journal_dir / 'prices' / '2022' / 'fetched.bean').unlink()
+    (journal_dir / 'prices' / '2023' / 'fetched.bean').unlink()
+    gaps, downloader = _run(prices_server)
+    assert len(gaps) == 2 and downloader.requests_count == 1
+    assert len(prices_server.requests) == 3
+
+
+def test_fetch_command_dry_run(journal_dir, prices_server):
+    url = f'http://127.0.0.1:{prices_server.server_port}/prices'
+    result = CliRunner().invoke(cli, ['prices', 'fetch', '--source', 'http', '--url', url, '-n'], obj={})
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith('USD\t2022-01-02\t2022-12-31\n')
+    assert prices_server.requests == []
+
+
+def test_incomplete_fetcher_fails_on_creation():
+    class RequestOnlyFetcher(PriceFetcher):
+        def request(self, symbol, quote, from_, to):
+            return []
+
+    with pytest.raises(TypeError, match='parse'):
+        RequestOnlyFetcher()
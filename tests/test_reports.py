@@ -0,0 +1,288 @@
+import io
+import json
+import datetime
+from datetime import date
+from decimal import Decimal
+
+import pytest
+import pandas as pd
+from click.testing import CliRunner
+
+from moneyctl.cli import cli
+from moneyctl.journal import Journal
+from moneyctl.report import Report, ReportException
+from moneyctl.beancount_wrapper import BeancountWrapper
+
+
+MULTICURRENCY_JOURNAL = '''
+2020-01-01 open Assets:Bank RUB
+2020-01-01 open Assets:Cards:Usd USD
+2020-01-01 open Assets:Cards:Eur EUR
+2020-01-01 open Assets:Empty RUB
+2020-01-01 open Assets:Инвестиции:Broker
+2020-01-01 open Expenses:Food
+2020-01-01 open Expenses:Travel
+2020-01-01 open Income:Job
+2020-01-01 open Income:Div
+2020-01-01 open Equity:Open
+2020-01-01 price USD 70.5 RUB
+2021-01-01 price USD 73.1234 RUB
+2022-06-01 price EUR 1.05 USD
+2022-07-01 price AAPL 11000.5 RUB
+2022-07-01 price SBER 250 RUB
+2020-01-02 * "Open"
+  Assets:Bank 1000.50 RUB
+  Assets:Cards:Usd 100 USD
+  Assets:Cards:Eur 10.333 EUR
+  Equity:Open
+2020-03-01 * "Food"
+  Expenses:Food 10.10 USD
+  Assets:Cards:Usd
+2021-03-01 * "Trip"
+  Expenses:Food 250 RUB
+  Expenses:Travel 5 EUR
+  Assets:Bank -250 RUB
+  Assets:Cards:Eur -5 EUR
+2021-04-01 * "Income"
+  Income:Job -5000 RUB
+  Income:Div -3.5 USD
+  Assets:Bank 5000 RUB
+  Assets:Cards:Usd 3.5 USD
+2021-05-01 * "There"
+  Assets:Empty 100 RUB
+  Assets:Bank -100 RUB
+2021-05-02 * "And back"
+  Assets:Empty -100 RUB
+  Assets:Bank 100 RUB
+2022-07-02 * "Buy"
+  Assets:Инвестиции:Broker 2 AAPL {150 USD}
+  Assets:Инвестиции:Broker 10 SBER {240 RUB}
+  Assets:Инвестиции:Broker 3 FXUS {1.5 RUB}
+  Assets:Инвестиции:Broker -2404.5 RUB
+  Assets:Cards:Usd -300 USD
+'''
+
+
+def _dump_reports(wrapper):
+    from_, to = datetime.date(2020, 1, 1), datetime.date(2030, 1, 1)
+    reports = wrapper.dashboard_reports(from_=from_, to=to, empty_accounts=True)
+    result = {}
+    for name, report in reports.items():
+        dataframe = report.report_dataframe
+        result[name] = None if dataframe is None else [[str(value) for value in row] for row in dataframe.values.tolist()]
+    return result
+
+
+def test_dashboard_writes_report_files(journal_dir):
+    result = CliRunner().invoke(cli, ['report', '--format', 'csv', 'dashboard', '-y', '2023', '-o', 'out'], obj={})
+    assert result.exit_code == 0, result.output
+    names = sorted(path_object.name for path_object in (journal_dir / 'out').iterdir())
+    assert names == ['assets.csv', 'expenses.csv', 'income.csv', 'invest-cash.csv', 'invest-parts.csv']
+    assert 'Работа,40000' in (journal_dir / 'out' / 'income.csv').read_text()
+
+
+@pytest.mark.parametrize('source', ['multicurrency', 'example'])
+def test_native_engine_matches_bql(journal_dir, source):
+    if source == 'multicurrency':
+        wrappers = [BeancountWrapper(beancount_string=MULTICURRENCY_JOURNAL, engine=engine)
+                    for engine in BeancountWrapper.ENGINES]
+    else:
+        wrappers = [BeancountWrapper(journal=Journal(), engine=engine) for engine in BeancountWrapper.ENGINES]
+    native, bql = (_dump_reports(wrapper) for wrapper in wrappers)
+    assert native == bql
+    assert any(rows for rows in native.values())
+
+
+@pytest.mark.parametrize('on_date', [date(2019, 1, 1), date(2020, 3, 1), date(2021, 5, 1), date(2022, 7, 2)])
+def test_assets_on_date_matches_bql(on_date):
+    dataframes = [
+        BeancountWrapper(beancount_string=MULTICURRENCY_JOURNAL, engine=engine).assets_report(on_date=on_date).report_dataframe
+        for engine in BeancountWrapper.ENGINES
+    ]
+    native, bql = (None if dataframe is None else dataframe.astype(str).values.tolist() for dataframe in dataframes)
+    assert native == bql
+
+
+def test_balance_index_lookup():
+    from moneyctl.engine import NativeEngine
+
+    wrapper = BeancountWrapper(beancount_string=MULTICURRENCY_JOURNAL)
+    balance_index = NativeEngine(wrapper.entries, wrapper.options).get_balance_index()
+    assert str(balance_index.get_balance('Assets:Bank', 'RUB', date(2020, 1, 1))) == '0'
+    assert str(balance_index.get_balance('Assets:Bank', 'RUB', date(2021, 5, 1))) == '5650.50'
+    assert str(balance_index.get_balance('Assets:Cards:Usd', 'USD', date(2030, 1, 1))) == '-206.60'
+
+    # Группа находится по словарю, а не перебором всех групп
+    balance_index.groups = []
+    assert str(balance_index.get_balance('Assets:Bank', 'RUB', date(2021, 5, 1))) == '5650.50'
+
+
+@pytest.mark.parametrize('by', BeancountWrapper.PERIODS)
+def test_period_pivot_matches_bql(by):
+    reports = [
+        BeancountWrapper(beancount_string=MULTICURRENCY_JOURNAL, engine=engine).expenses_report(
+            from_=date(2020, 1, 1), to=date(2021, 12, 31), by=by)
+        for engine in BeancountWrapper.ENGINES
+    ]
+    native, bql = (report.report_dataframe.astype(str) for report in reports)
+    assert native.values.tolist() == bql.values.tolist()
+    assert list(native.columns)[-1] == 'total'
+    assert len(native.columns) == {'month': 24, 'quarter': 8, 'year': 2}[by] + 2
+    assert str(reports[0].total_dataframe['total']) == '967.050'
+
+
+def test_register_streams_running_balance(journal_dir):
+    result = CliRunner().invoke(cli, ['report', '--format', 'csv', 'register', '-a', 'sberbank', '-f', '2022-03-25'], obj={})
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == [
+        'date,narration,account,amount,currency,balance',
+        '2022-03-25,Зарплата,Assets:Карты:Sberbank-0001,40000,RUB,43000',
+        '2022-03-25,Перевод на накопительный счет,Assets:Карты:Sberbank-0001,-35000,RUB,8000',
+        '2023-05-10,Зарплата,Assets:Карты:Sberbank-0001,40000,RUB,48000',
+        '2023-05-10,Открыл вклад в банке,Assets:Карты:Sberbank-0001,-40000,RUB,8000',
+    ]
+
+    result = CliRunner().invoke(cli, ['report', '--format', 'ndjson', 'register', '-a', 'Tinkoff'], obj={})
+    assert result.output == ('{"date": "2022-01-01", "narration": "Начальное сальдо", '
+                             '"account": "Assets:Карты:Tinkoff-0002", "amount": 100, "currency": "USD", "balance": 100}\n')
+
+
+def test_register_rows_are_lazy():
+    wrapper = BeancountWrapper(beancount_string=MULTICURRENCY_JOURNAL)
+    rows = wrapper.register_rows('Cards:Usd')
+    assert next(rows)[3:] == (Decimal('100'), 'USD', Decimal('100'))
+    assert next(rows)[3:] == (Decimal('-10.10'), 'USD', Decimal('89.90'))
+
+
+def test_json_formats_keep_decimals_exact(journal_dir):
+    result = CliRunner().invoke(cli, ['report', '--format', 'json', 'assets'], obj={})
+    assert result.exit_code == 0, result.output
+    document = json.loads(result.output, parse_float=Decimal)
+    assert document['report']['Карты:Tinkoff-0002'] == {'position': Decimal('7468.00')}
+    assert document['total'] == {'position': Decimal('90418.00')}
+
+    result = CliRunner().invoke(cli, ['report', '--format', 'ndjson', 'assets'], obj={})
+    rows = [json.loads(line) for line in result.output.splitlines()]
+    assert [row['account'] for row in rows] == list(document['report'])
+
+
+@pytest.mark.parametrize('currency', ['USD', 'EUR'])
+def test_target_currency_matches_bql(currency):
+    reports = [
+        BeancountWrapper(beancount_string=MULTICURRENCY_JOURNAL, engine=engine, currency=currency).expenses_report(
+            from_=date(2020, 1, 1), to=date(2022, 12, 31))
+        for engine in BeancountWrapper.ENGINES
+    ]
+    native, bql = (report.report_dataframe.astype(str).values.tolist() for report in reports)
+    assert native == bql
+    if currency == 'USD':
+        # 10.10 USD + 250 RUB по курсу 73.1234 на дату проводки
+        assert native[0] == ['Food', '13.51887822502782966875172653']
+
+
+def test_currency_rates_cached_with_ledger(journal_dir, monkeypatch):
+    from moneyctl.price_index import PriceIndex
+
+    rub = BeancountWrapper(journal=Journal()).assets_report().report_dataframe
+    monkeypatch.setattr(BeancountWrapper, '_price_index_memo', (None, None))
+    monkeypatch.setattr(BeancountWrapper, '_native_engine_memo', (None, None))
+
+    def fail_build(entries, cross_currency=None):
+        raise AssertionError('rates table should be loaded from cache')
+
+    monkeypatch.setattr(PriceIndex, 'from_entries', fail_build)
+    usd = BeancountWrapper(journal=Journal(), currency='USD').assets_report().report_dataframe
+    assert list(usd['account']) == list(rub['account'])
+    assert usd['position'].sum() < rub['position'].sum()
+
+    with pytest.raises(ReportException, match='Currency "XYZ" has no prices'):
+        BeancountWrapper(journal=Journal(), currency='XYZ')
+
+
+NETWORTH_JOURNAL = MULTICURRENCY_JOURNAL + '''
+2020-01-01 open Liabilities:Credit RUB
+2021-02-15 * "Credit"
+  Assets:Bank 300 RUB
+  Liabilities:Credit -300 RUB
+'''
+
+
+@pytest.mark.parametrize('step, from_, to, points', [
+    ('day', date(2021, 2, 10), date(2021, 3, 6), 25),
+    ('week', date(2020, 12, 20), date(2021, 5, 10), 22),
+    ('month', date(2019, 12, 25), date(2021, 5, 10), 18),
+])
+@pytest.mark.parametrize('currency', ['RUB', 'USD'])
+def test_networth_series_matches_bql(step, from_, to, points, currency):
+    reports = [
+        BeancountWrapper(beancount_string=NETWORTH_JOURNAL, engine=engine, currency=currency).networth_report(
+            from_=from_, to=to, step=step)
+        for engine in BeancountWrapper.ENGINES
+    ]
+    # Кросс-курсы несут 28 знаков: порядок умножений может сдвинуть последний знак
+    native, bql = (
+        [[row[0]] + [value if currency == 'RUB' else value.quantize(Decimal('1e-18')) for value in row[1:]]
+         for row in report.report_dataframe.values.tolist()]
+        for report in reports
+    )
+    assert native == bql
+    assert native[-1][0] == to.isoformat()
+    assert len(native) == points
+
+
+def test_networth_steps_and_values():
+    wrapper = BeancountWrapper(beancount_string=NETWORTH_JOURNAL)
+    report = wrapper.networth_report(from_=date(2021, 2, 10), to=date(2021, 3, 3), step='week')
+    # 1000.50 RUB + 89.90 USD по 73.1234 + 10.333 EUR без курса (как number(convert()) в BQL)
+    assert report.report_dataframe.astype(str).values.tolist() == [
+        ['2021-02-14', '7584.626660', '0', '7584.626660'],
+        ['2021-02-21', '7884.626660', '-300', '7584.626660'],
+        ['2021-02-28', '7884.626660', '-300', '7584.626660'],
+        ['2021-03-03', '7629.626660', '-300', '7329.626660'],
+    ]
+    assert report.total_dataframe is None
+
+    with pytest.raises(ReportException, match='Step "year" is not supported'):
+        wrapper.networth_report(step='year')
+
+
+def test_networth_cli_csv(journal_dir):
+    result = CliRunner().invoke(cli, ['report', '--format', 'csv', 'networth',
+                                      '--from', '2022-03-01', '--to', '2022-05-15', '--step', 'month'], obj={})
+    assert result.exit_code == 0, result.output
+    lines = result.output.strip().splitlines()
+    assert lines[0] == ',date,assets,liabilities,networth'
+    assert [line.split(',')[1] for line in lines[1:]] == ['2022-03-31', '2022-04-30', '2022-05-15']
+
+
+def test_json_shape_depends_on_report_type():
+    dataframe = pd.DataFrame({'account': ['Cash', 'Cash', 'Bank'], 'number': [Decimal('1.10'), Decimal('2'), Decimal('3')]})
+    output = io.StringIO()
+    report = Report(dataframe, None, keyed=False)
+    report.set(format=Report.FORMAT_JSON, file=output)
+    report.print()
+    document = json.loads(output.getvalue(), parse_float=Decimal)
+    assert document['report'] == [
+        {'account': 'Cash', 'number': Decimal('1.10')},
+        {'account': 'Cash', 'number': 2},
+        {'account': 'Bank', 'number': 3},
+    ]
+
+    # Отчет по счетам не меняет форму из-за данных: повтор ключа -- ошибка, а не список
+    report = Report(dataframe, None)
+    report.set(format=Report.FORMAT_JSON, file=io.StringIO())
+    with pytest.raises(ReportException, match='not unique'):
+        report.print()
+
+
+def test_json_total_encodes_numpy_scalars():
+    dataframe = pd.DataFrame({'currency': ['SBER', 'GAZP'], 'lots': [10, 20], 'part': [0.25, 0.75]})
+    total = dataframe.sum()
+    total['currency'] = 'total'
+    output = io.StringIO()
+    report = Report(dataframe, total)
+    report.set(format=Report.FORMAT_JSON, file=output)
+    report.print()
+    document = json.loads(output.getvalue())
+    assert document['report'] == {'SBER': {'lots': 10, 'part': 0.25}, 'GAZP': {'lots': 20, 'part': 0.75}}
+    assert document['total'] == {'lots': 30, 'part': 1.0}
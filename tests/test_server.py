@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import base64
+import threading
+import subprocess
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+from moneyctl.cli import cli
+from moneyctl.client import Client
+from moneyctl.journal import Journal, JournalException
+from moneyctl.server import Server
+
+
+def _start_server():
+    server = Server(Journal(), poll_interval=0.1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    for _ in range(100):
+        if server.socket_file.exists():
+            break
+        time.sleep(0.05)
+    return server
+
+
+def _request(argv):
+    request = {
+        'argv': argv,
+        'env': {'COLUMNS': '80', 'LINES': '25'},
+        'streams': {'stdout': {'encoding': 'utf-8'}, 'stderr': {'encoding': 'utf-8'}},
+    }
+    response = Client(Journal().socket_file)._request(request)
+    return response['code'], base64.b64decode(response['stdout']).decode()
+
+
+def test_server_output_matches_in_process(journal_dir):
+    server = _start_server()
+    try:
+        for argv in (['report', 'assets'], ['report', '--format', 'csv', 'income', '-y', '2023']):
+            code, stdout = _request(argv)
+            local = CliRunner().invoke(cli, argv, obj={}, env={'COLUMNS': '80', 'LINES': '25'})
+            assert code == local.exit_code == 0
+            assert stdout == local.output
+    finally:
+        server.shutdown()
+
+
+def test_server_reloads_changed_journal(journal_dir):
+    server = _start_server()
+    try:
+        _, before = _request(['report', '--format', 'csv', 'expenses', '-y', '2022'])
+        transactions_file = journal_dir / 'transactions' / '2022' / '2022-03-25.bean'
+        with open(transactions_file, 'a') as file_object:
+            file_object.write('\n2022-03-25 * "Обед"\n'
+                              '    Assets:Карты:Sberbank-0001  -500 RUB\n'
+                              '    Expenses:Питание  500 RUB\n')
+        _, after = _request(['report', '--format', 'csv', 'expenses', '-y', '2022'])
+        assert 'Питание' not in before
+        assert 'Питание,500' in after
+    finally:
+        server.shutdown()
+
+
+@pytest.mark.parametrize('argv', [['report', 'assets'], ['query', 'SELECT account FROM postings']])
+def test_forwarding_outside_journal_fails(tmp_path, argv):
+    env = {key: value for key, value in os.environ.items() if key != Client.DAEMON_VAR}
+    env['PYTHONPATH'] = str(Path(__file__).parent.parent)
+    result = subprocess.run([sys.executable, '-m', 'moneyctl', *argv], cwd=tmp_path, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode == 1
+    assert 'Templates dir' in result.stderr and 'does not exist' in result.stderr
+    assert not (tmp_path / Journal.STATE_DIR_NAME).exists()
+
+
+def test_failed_journal_is_not_kept(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Journal, '_instance', None)
+    for _ in range(2):
+        with pytest.raises(JournalException, match='does not exist'):
+            Journal()
+    assert Journal._instance is None
+
+
+def test_empty_complete_var_does_not_force_forwarding(monkeypatch):
+    monkeypatch.delenv(Client.DAEMON_VAR, raising=False)
+    monkeypatch.setenv(Client.COMPLETE_VAR, '')
+    client = Client()
+    assert not client._is_forwardable(['transaction', 'add', '-e'])
+    assert not client._is_forwardable(['report', 'register', 'Expenses'])
+    assert client._is_forwardable(['report', 'assets'])
+
+    monkeypatch.setenv(Client.COMPLETE_VAR, 'bash_complete')
+    assert client._is_forwardable(['transaction', 'add'])
@@ -0,0 +1,106 @@
+import os
+import re
+import sys
+import importlib
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from moneyctl import cli
+from moneyctl.loader import LedgerLoader
+
+
+ROOT_DIR = Path(__file__).parent.parent
+HEAVY_MODULES = ('beancount', 'pandas', 'rich')
+
+# Классы, значения которых cli копирует к себе, чтобы не импортировать их модули
+MIRRORED_CLASSES = {
+    'LedgerLoader': 'moneyctl.loader',
+    'BeancountWrapper': 'moneyctl.beancount_wrapper',
+    'PortfolioEngine': 'moneyctl.portfolio',
+    'PriceDownloader': 'moneyctl.prices',
+}
+
+SNIPPET = f'''
+import sys
+from moneyctl.cli import cli
+code = 0
+try:
+    cli(obj={{}}, prog_name='moneyctl')
+except SystemExit as e:
+    code = e.code or 0
+heavy = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+sys.stderr.write(f'EXIT:{{code}} HEAVY:' + ','.join(heavy))
+'''
+
+
+def _run_cli(args, env=None):
+    full_env = dict(os.environ)
+    full_env.update(env or {})
+    full_env['PYTHONPATH'] = str(ROOT_DIR)
+    result = subprocess.run([sys.executable, '-c', SNIPPET, *args], env=full_env,
+                            capture_output=True, text=True)
+    # Команда, упавшая до своей работы, тоже не импортирует тяжелые модули -- код проверяется отдельно
+    status = result.stderr.rpartition('EXIT:')[2]
+    code, _, heavy = status.partition(' HEAVY:')
+    return int(code), heavy, result.stderr
+
+
+@pytest.mark.parametrize('args, env', [
+    ([], {'_MONEYCTL_COMPLETE': 'fish_complete',
+          'COMP_WORDS': 'moneyctl transaction add -f Assets',
+          'COMP_CWORD': 'Assets'}),
+    (['--help'], {}),
+    (['report', '--help'], {}),
+    (['transaction', 'add', '-f', 'Assets:Карты:Sberbank-0001', '-t', 'Expenses:Питание',
+      '-a', '100', '-m', 'Продукты', '-d', '2022-03-25'], {}),
+])
+def test_light_commands_skip_heavy_imports(journal_dir, args, env):
+    code, heavy, stderr = _run_cli(args, env)
+    assert code == 0, stderr
+    assert heavy == ''
+
+
+def test_loader_modes_in_sync():
+    assert cli.LOADER_MODES == LedgerLoader.MODES
+    assert cli.LOADER_MODE_DEFAULT == LedgerLoader.MODE_DEFAULT
+
+
+def test_report_engines_in_sync():
+    from moneyctl.beancount_wrapper import BeancountWrapper
+
+    assert cli.REPORT_ENGINES == BeancountWrapper.ENGINES
+    assert cli.REPORT_ENGINE_DEFAULT == BeancountWrapper.ENGINE_DEFAULT
+    assert cli.REPORT_PERIODS == BeancountWrapper.PERIODS
+
+
+def test_prices_sources_in_sync():
+    from moneyctl.prices import PriceDownloader
+
+    assert cli.PRICES_SOURCES == PriceDownloader.SOURCES
+    assert cli.PRICES_SOURCE_DEFAULT == PriceDownloader.SOURCE_DEFAULT
+
+
+def test_portfolio_levels_in_sync():
+    from moneyctl.portfolio import PortfolioEngine
+
+    assert cli.PORTFOLIO_LEVELS == PortfolioEngine.LEVELS
+    assert cli.PORTFOLIO_LEVEL_DEFAULT == PortfolioEngine.LEVEL_DEFAULT
+
+
+def test_networth_steps_in_sync():
+    from moneyctl.beancount_wrapper import BeancountWrapper
+
+    assert cli.NETWORTH_STEPS == BeancountWrapper.STEPS
+    assert cli.NETWORTH_STEP_DEFAULT == BeancountWrapper.STEP_DEFAULT
+
+
+def test_all_mirrored_constants_in_sync():
+    # Любая копия с пометкой "# Class.ATTR без импорта ..." равна оригиналу, в том числе новая
+    source = Path(cli.__file__).read_text(encoding='utf-8')
+    mirrored = re.findall(r'^(\w+) = .*# (\w+)\.(\w+) без импорта', source, re.MULTILINE)
+    assert len(mirrored) >= 6
+    for name, class_name, attribute in mirrored:
+        module = importlib.import_module(MIRRORED_CLASSES[class_name])
+        assert getattr(cli, name) == getattr(getattr(module, class_name), attribute), name
@@ -0,0 +1,80 @@
+import pytest
+from click.testing import CliRunner
+
+from moneyctl.cli import cli
+from moneyctl.journal import Journal, JournalException
+from moneyctl.checker import JournalChecker
+
+
+def test_yml_and_toml_templates(journal_dir):
+    (journal_dir / 'templates' / 'rent.toml').write_text(
+        'comment = "Аренда"\n'
+        'account_from = "Assets:Карты:Sberbank-0001"\n'
+        'account_to = "Expenses:Питание"\n'
+        'amount_from = 30000\n'
+        'date = 2022-06-01\n'
+    )
+    journal = Journal()
+    assert journal.get_templates_names() == ['food-shop', 'rent', 'salary']
+
+    template = journal.get_template('salary')
+    assert template.comment == 'Зарплата'
+    assert template.account_from.get_name() == 'Income:Работа'
+
+    template = journal.get_template('rent')
+    assert template.amount_from == 30000
+    assert template.date.isoformat() == '2022-06-01'
+
+
+def test_template_loaded_without_reading_files(journal_dir, monkeypatch):
+    Journal().index.refresh()
+
+    monkeypatch.setattr(Journal, '_instance', None)
+    journal = Journal()
+    journal.index.refresh()
+
+    def fail_compile(accounts_names):
+        raise AssertionError('templates should not be recompiled')
+
+    monkeypatch.setattr(journal.templates, 'compile', fail_compile)
+    assert journal.get_template('food-shop').account_to.get_name() == 'Expenses:Питание'
+    assert list(journal.accounts) == ['Assets:Карты:Sberbank-0001', 'Expenses:Питание']
+
+
+def test_broken_template_errors_collected_at_compile(journal_dir, capsys):
+    (journal_dir / 'templates' / 'broken.yml').write_text(
+        'comment: "Сломанный"\n'
+        'account_from: "Assets:Нет-такого"\n'
+        'amount_to: -5\n'
+    )
+    (journal_dir / 'templates' / 'garbage.yml').write_text('comment: "Не закрыта\n')
+
+    # Сборка индекса ничего не печатает: она идет и при дополнении по TAB, и в демоне
+    journal = Journal()
+    journal.index.refresh()
+    assert capsys.readouterr().err == ''
+    assert [(name, filename) for name, filename, _ in journal.index.get_templates_errors()] == [
+        ('broken', 'templates/broken.yml'),
+        ('broken', 'templates/broken.yml'),
+        ('garbage', 'templates/garbage.yml'),
+    ]
+
+    # Команда с шаблоном сообщает об остальных сломанных шаблонах
+    result = CliRunner().invoke(
+        cli, ['transaction', 'add', '-T', 'food-shop', '-a', '100', '-d', '2022-06-01'], obj={})
+    assert result.exit_code == 0, result.stderr
+    warnings = result.stderr.splitlines()
+    assert 'Warning: template "templates/broken.yml": Account "Assets:Нет-такого" does not exist' in warnings
+    assert any(line.startswith('Warning: template "templates/garbage.yml": Cannot parse template') for line in warnings)
+
+    with pytest.raises(JournalException, match='Account "Assets:Нет-такого" does not exist'):
+        journal.get_template('broken')
+    with pytest.raises(JournalException, match='Cannot parse template'):
+        journal.get_template('garbage')
+
+    errors = [error for error in JournalChecker(journal).run() if error[2] == JournalChecker.ERROR_TEMPLATE]
+    assert [(filename, message) for filename, _, _, message in errors] == [
+        ('templates/broken.yml', 'Account "Assets:Нет-такого" does not exist'),
+        ('templates/broken.yml', 'Field "amount_to" should be a number greater then zero'),
+        ('templates/garbage.yml', 'Cannot parse template: line 1: Unterminated string starting at: line 1 column 1 (char 0)'),
+    ]
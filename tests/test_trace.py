@@ -0,0 +1,47 @@
+import json
+
+from click.testing import CliRunner
+
+from moneyctl.cli import cli
+from moneyctl.client import Client
+from moneyctl.trace import Tracer
+
+
+def test_profile_writes_phase_spans(journal_dir):
+    trace_file = journal_dir / 'trace.json'
+    result = CliRunner().invoke(cli, ['--profile-output', str(trace_file),
+                                      'report', '--no-cache', '--engine', 'bql', 'assets'], obj={})
+    assert result.exit_code == 0, result.output
+
+    events = {event['name']: event for event in json.loads(trace_file.read_text())['traceEvents']}
+    for name in ['moneyctl', 'journal.glob', 'loader.parse', 'loader.book', 'bql.query', 'bql.dataframe', 'report.print']:
+        assert name in events
+    assert events['loader.parse']['args']['files'] == events['journal.glob']['args']['files'] > 0
+    assert events['loader.parse']['args']['bytes'] > 0
+    assert 0 < events['report.print']['args']['rows'] <= events['bql.dataframe']['args']['rows']
+
+
+def test_pstats_dump_from_env(journal_dir, monkeypatch):
+    import pstats
+
+    monkeypatch.setenv(Tracer.PSTATS_VAR, str(journal_dir / 'report.pstats'))
+    result = CliRunner().invoke(cli, ['report', 'assets'], obj={})
+    assert result.exit_code == 0, result.output
+    assert pstats.Stats(str(journal_dir / 'report.pstats')).total_calls > 0
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer()
+    with tracer.span('phase', rows=1) as args:
+        args['files'] = 2
+    assert tracer.events == []
+
+
+def test_traced_commands_are_not_forwarded(monkeypatch):
+    monkeypatch.delenv(Client.DAEMON_VAR, raising=False)
+    monkeypatch.delenv(Tracer.TRACE_VAR, raising=False)
+    client = Client()
+    assert client._is_forwardable(['report', 'assets'])
+    assert not client._is_forwardable(['--profile', 'report', 'assets'])
+    monkeypatch.setenv(Tracer.TRACE_VAR, '1')
+    assert not client._is_forwardable(['report', 'assets'])
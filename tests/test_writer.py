@@ -0,0 +1,52 @@
+import sys
+import json
+from pathlib import Path
+
+import pytest
+
+from moneyctl.journal import Journal, JournalException
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'benchmarks'))
+
+from bench_commit import run_stress, is_valid
+
+
+def test_concurrent_writers_lose_nothing(journal_dir):
+    result = run_stress(journal_dir, writers=4, transactions_count=25, batch=3, fsync='off')
+    assert result['transactions'] == 100
+    assert is_valid(result)
+    assert not (journal_dir / '.moneyctl' / 'commit.wal').exists()
+
+
+def test_interrupted_commit_is_rolled_forward(journal_dir):
+    journal = Journal()
+    filepath = journal_dir / 'transactions' / '2022' / '2022-03-25.bean'
+    size = filepath.stat().st_size
+    text = '\n2022-03-25 * "Прерванная"\n  Expenses:Питание  10 RUB\n  Assets:Карты:Sberbank-0001\n'
+
+    # Процесс упал после половины записи: намерение есть, хвост файла обрезан
+    journal.state_dir.mkdir(parents=True, exist_ok=True)
+    journal.writer.intent_file.write_text(json.dumps([[str(filepath), size, text]]))
+    with open(filepath, 'a') as file_object:
+        file_object.write(text[:20])
+
+    with journal.writer.lock():
+        pass
+    assert filepath.read_text().endswith(text)
+    assert filepath.read_text().count('Прерванная') == 1
+    assert not journal.writer.intent_file.exists()
+
+
+def test_recovery_refuses_modified_file(journal_dir):
+    journal = Journal()
+    filepath = journal_dir / 'transactions' / '2022' / '2022-03-25.bean'
+    size = filepath.stat().st_size
+
+    journal.state_dir.mkdir(parents=True, exist_ok=True)
+    journal.writer.intent_file.write_text(json.dumps([[str(filepath), size, '\nexpected\n']]))
+    with open(filepath, 'a') as file_object:
+        file_object.write('\nforeign\n')
+
+    with pytest.raises(JournalException):
+        with journal.writer.lock():
+            pass